@@ -0,0 +1,99 @@
+# accounts.py - Обработка почтовых ящиков нескольких сотрудников
+import asyncio
+import json
+import logging
+import os
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# Параметры, которые должны быть заданы в описании каждого ящика
+REQUIRED_ACCOUNT_KEYS = ("name", "email", "password")
+
+# Параметры-списки; одиночная строка в файле превращается в список из одного элемента
+LIST_SETTINGS = ("ADDRESSES_TO_FIND", "EXCLUDED_ADDRESSES", "SENDER_PATTERNS", "SUBJECT_PATTERNS")
+
+
+def account_cache_dir(name, cache_dir="cache"):
+    """Отдельная директория кеша почтового ящика."""
+    safe_name = re.sub(r'[^\w.-]', '_', name)
+    return os.path.join(cache_dir, "accounts", safe_name)
+
+
+def load_accounts(path, base_config):
+    """Загрузка списка почтовых ящиков из JSON-файла.
+
+    Файл содержит список объектов с ключами name, email, password и,
+    при необходимости, любыми параметрами .env в нижнем регистре
+    (imap_server, addresses_to_find, required_address и т.д.).
+    Недостающие параметры берутся из base_config.
+    Возвращает список пар (имя, конфигурация ящика).
+    """
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+    except Exception as e:
+        logging.error(f"Ошибка при чтении списка почтовых ящиков {path}: {e}")
+        return []
+    if isinstance(data, dict):
+        data = data.get("accounts", [])
+
+    accounts = []
+    names = set()
+    for index, entry in enumerate(data, start=1):
+        missing = [key for key in REQUIRED_ACCOUNT_KEYS if not entry.get(key)]
+        if missing:
+            logging.error(f"Почтовый ящик №{index} в {path} пропущен: не заданы {', '.join(missing)}")
+            continue
+        name = str(entry["name"])
+        if name in names:
+            logging.error(f"Почтовый ящик '{name}' указан в {path} повторно и пропущен")
+            continue
+        names.add(name)
+
+        config = dict(base_config)
+        config.update({key.upper(): value for key, value in entry.items()})
+        for key in LIST_SETTINGS:
+            if isinstance(config.get(key), str):
+                config[key] = [config[key]]
+        accounts.append((name, config))
+
+    logging.info(f"Загружено почтовых ящиков: {len(accounts)}")
+    return accounts
+
+
+async def _process_account(name, config, months, process, semaphore, executor):
+    """Обработка одного ящика; None при ошибке, чтобы не прерывать остальные."""
+    async with semaphore:
+        loop = asyncio.get_running_loop()
+        started = time.monotonic()
+        logging.info(f"[{name}] Обработка почтового ящика {config['EMAIL']}")
+        try:
+            reports = await loop.run_in_executor(executor, process, name, config, months)
+        except Exception as e:
+            logging.error(f"[{name}] Ошибка при обработке почтового ящика: {e}")
+            return None
+        logging.info(f"[{name}] Обработка завершена за {time.monotonic() - started:.1f} с")
+        return reports
+
+
+async def _process_all(accounts, months, process, concurrency):
+    semaphore = asyncio.Semaphore(concurrency)
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="account") as executor:
+        results = await asyncio.gather(*(
+            _process_account(name, config, months, process, semaphore, executor)
+            for name, config in accounts
+        ))
+    return {name: reports for (name, _), reports in zip(accounts, results)}
+
+
+def process_accounts(accounts, months, process, concurrency=4):
+    """Одновременная обработка почтовых ящиков.
+
+    Ящики обрабатываются в цикле asyncio, одновременно не больше
+    concurrency ящиков. Функция process(имя, конфигурация, месяцы)
+    выполняет загрузку и построение отчётов ящика в отдельном потоке,
+    так как imaplib работает с сокетом синхронно.
+    Возвращает словарь {имя: список отчётов или None при ошибке}.
+    """
+    return asyncio.run(_process_all(accounts, months, process, max(1, concurrency)))
@@ -0,0 +1,161 @@
+# address_matcher.py - Поиск адресов в точках маршрута
+import re
+from collections import deque
+
+# Версия правил нормализации; входит в хеш настроек фильтрации отчётов
+NORMALIZATION_VERSION = 1
+
+# Сокращения в адресах и их полные формы. Однобуквенные сокращения
+# раскрываются только с точкой, чтобы не задеть обычные слова.
+ABBREVIATIONS = {
+    "ул": "улица",
+    "пер": "переулок",
+    "просп": "проспект",
+    "пр-т": "проспект",
+    "пр-кт": "проспект",
+    "пл": "площадь",
+    "наб": "набережная",
+    "б-р": "бульвар",
+    "бул": "бульвар",
+    "мкр": "микрорайон",
+    "мкрн": "микрорайон",
+    "мкр-н": "микрорайон",
+    "стр": "строение",
+    "корп": "корпус",
+    "ш.": "шоссе",
+    "д.": "дом",
+    "к.": "корпус",
+    "г.": "город",
+}
+
+
+def _abbreviation_pattern():
+    """Регулярное выражение для всех сокращений (длинные варианты первыми)."""
+    parts = []
+    for abbreviation in sorted(ABBREVIATIONS, key=len, reverse=True):
+        if abbreviation.endswith("."):
+            parts.append(re.escape(abbreviation))
+        else:
+            # Сокращение с точкой или отдельное слово перед пробелом, запятой или концом строки
+            parts.append(re.escape(abbreviation) + r'(?:\.|(?=[\s,]|$))')
+    return re.compile(r'(?<![\w-])(' + "|".join(parts) + r')\s*')
+
+
+ABBREVIATION_RE = _abbreviation_pattern()
+SPACES_RE = re.compile(r'\s+')
+COMMA_RE = re.compile(r'\s*,\s*')
+
+
+def _expand(match):
+    abbreviation = match.group(1)
+    full = ABBREVIATIONS.get(abbreviation) or ABBREVIATIONS.get(abbreviation.rstrip("."))
+    return full + " "
+
+
+def normalize_address(text):
+    """Нормализация адреса: регистр, ё/е, сокращения и пробелы."""
+    text = (text or "").lower().replace("ё", "е")
+    text = SPACES_RE.sub(" ", text)
+    text = ABBREVIATION_RE.sub(_expand, text)
+    text = COMMA_RE.sub(", ", text)
+    return SPACES_RE.sub(" ", text).strip()
+
+
+class AhoCorasick:
+    """Автомат Ахо-Корасик для поиска всех шаблонов в тексте за один проход."""
+
+    def __init__(self):
+        """Инициализация пустого автомата."""
+        self._goto = [{}]
+        self._fail = [0]
+        self._output = [set()]
+        self._built = True
+
+    def add(self, pattern, value):
+        """Добавление шаблона со значением, возвращаемым при совпадении."""
+        if not pattern:
+            return
+        state = 0
+        for char in pattern:
+            next_state = self._goto[state].get(char)
+            if next_state is None:
+                next_state = len(self._goto)
+                self._goto.append({})
+                self._fail.append(0)
+                self._output.append(set())
+                self._goto[state][char] = next_state
+            state = next_state
+        self._output[state].add(value)
+        self._built = False
+
+    def build(self):
+        """Построение ссылок неудачи обходом в ширину."""
+        queue = deque(self._goto[0].values())
+        for state in queue:
+            self._fail[state] = 0
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self._goto[state].items():
+                queue.append(next_state)
+                fail = self._fail[state]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[next_state] = self._goto[fail].get(char, 0)
+                self._output[next_state] |= self._output[self._fail[next_state]]
+        self._built = True
+
+    def search(self, text):
+        """Множество значений всех шаблонов, входящих в текст."""
+        if not self._built:
+            self.build()
+        found = set()
+        state = 0
+        goto = self._goto
+        fail = self._fail
+        output = self._output
+        for char in text:
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            if output[state]:
+                found |= output[state]
+        return found
+
+
+class AddressMatcher:
+    """Скомпилированные списки искомых, обязательного и исключаемых адресов.
+
+    Все адреса нормализуются и объединяются в один автомат, поэтому
+    проверка точки маршрута не зависит от количества адресов в списках.
+    """
+
+    def __init__(self, addresses_to_find, required_address="", excluded_addresses=None):
+        """Компиляция списков адресов в автомат."""
+        self.addresses_to_find = list(addresses_to_find or [])
+        self.required_address = required_address or ""
+        self.excluded_addresses = list(excluded_addresses or [])
+
+        self._automaton = AhoCorasick()
+        for index, address in enumerate(self.addresses_to_find):
+            self._automaton.add(normalize_address(address), ("find", index))
+        if self.required_address:
+            self._automaton.add(normalize_address(self.required_address), ("required", 0))
+        for index, address in enumerate(self.excluded_addresses):
+            self._automaton.add(normalize_address(address), ("excluded", index))
+        self._automaton.build()
+
+    def match(self, start_point, end_point):
+        """Совпадения в начальной и конечной точках маршрута.
+
+        Возвращает словарь: find_start/find_end - найденные искомые адреса,
+        required - найден ли обязательный адрес, excluded - найденные исключаемые.
+        """
+        start_hits = self._automaton.search(normalize_address(start_point))
+        end_hits = self._automaton.search(normalize_address(end_point))
+        hits = start_hits | end_hits
+        return {
+            "find_start": [self.addresses_to_find[i] for kind, i in sorted(start_hits) if kind == "find"],
+            "find_end": [self.addresses_to_find[i] for kind, i in sorted(end_hits) if kind == "find"],
+            "required": ("required", 0) in hits,
+            "excluded": [self.excluded_addresses[i] for kind, i in sorted(hits) if kind == "excluded"]
+        }
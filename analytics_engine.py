@@ -0,0 +1,312 @@
+# analytics_engine.py - Расчёт стоимости поездок по рабочим неделям, месяцам и годам
+import hashlib
+import logging
+import calendar
+from array import array
+from bisect import bisect_left
+from datetime import date
+from functools import lru_cache
+
+# Время суток в минутах: до 04:00 - поездка после полуночи, до 12:00 - утренняя
+AFTER_MIDNIGHT_END = 4 * 60
+MORNING_END = 12 * 60
+MINUTES_PER_DAY = 24 * 60
+
+# Минимальное число поездок, при котором расчёт выполняется через NumPy.
+# Для отчёта за месяц загрузка NumPy дольше самого расчёта.
+VECTORIZE_MIN_TRIPS = 5000
+
+_numpy = None
+
+
+def _load_numpy():
+    """NumPy, если он установлен; загружается при первом векторном расчёте."""
+    global _numpy
+    if _numpy is None:
+        try:
+            import numpy
+            _numpy = numpy
+        except ImportError:
+            _numpy = False
+    return _numpy or None
+
+
+def _parse_month(month):
+    year, month_num = map(int, month.split('-'))
+    return year, month_num
+
+
+class MonthCalendar:
+    """Рабочие дни и рабочие недели месяца."""
+
+    __slots__ = ("month", "first_day", "workdays", "weeks")
+
+    def __init__(self, month, first_day, workdays, weeks):
+        self.month = month
+        # Порядковый номер (date.toordinal) первого дня месяца
+        self.first_day = first_day
+        # Признак рабочего дня для каждого дня месяца, начиная с 1-го
+        self.workdays = workdays
+        # Рабочие недели: кортежи номеров рабочих дней с понедельника по пятницу
+        self.weeks = weeks
+
+
+class WorkweekCalendar:
+    """Календарь рабочих недель с праздничными днями.
+
+    Рабочие дни - с понедельника по пятницу, кроме праздников. Неделя
+    заканчивается в пятницу или в последний день месяца. Календари
+    месяцев рассчитываются один раз и запоминаются.
+    """
+
+    def __init__(self, holidays=()):
+        """Инициализация; holidays - даты праздников (date или строки YYYY-MM-DD)."""
+        parsed = set()
+        for holiday in holidays:
+            try:
+                parsed.add(holiday if isinstance(holiday, date) else date.fromisoformat(str(holiday).strip()))
+            except ValueError:
+                logging.warning(f"Пропущена некорректная дата праздника: {holiday}")
+        self.holidays = frozenset(parsed)
+        self._months = {}
+
+    def month(self, month):
+        """Календарь месяца YYYY-MM."""
+        month_calendar = self._months.get(month)
+        if month_calendar is None:
+            month_calendar = self._build_month(month)
+            self._months[month] = month_calendar
+        return month_calendar
+
+    def _build_month(self, month):
+        year, month_num = _parse_month(month)
+        first_weekday, last_day = calendar.monthrange(year, month_num)
+
+        workdays = []
+        weeks = []
+        current_week = []
+        for day in range(1, last_day + 1):
+            weekday = (first_weekday + day - 1) % 7
+            is_workday = weekday <= 4 and date(year, month_num, day) not in self.holidays
+            workdays.append(is_workday)
+            if is_workday:
+                current_week.append(day)
+            # Неделя заканчивается в пятницу или в последний день месяца
+            if (weekday == 4 or day == last_day) and current_week:
+                weeks.append(tuple(current_week))
+                current_week = []
+
+        return MonthCalendar(month, date(year, month_num, 1).toordinal(), tuple(workdays), tuple(weeks))
+
+    def month_key(self, month):
+        """Признак праздников месяца для ключа кеша отчёта; пустая строка, если праздников нет."""
+        year, month_num = _parse_month(month)
+        holidays = sorted(holiday.isoformat() for holiday in self.holidays
+                          if holiday.year == year and holiday.month == month_num)
+        if not holidays:
+            return ""
+        return "-" + hashlib.sha1(",".join(holidays).encode('utf-8')).hexdigest()[:8]
+
+
+@lru_cache(maxsize=None)
+def get_calendar(holidays=()):
+    """Общий календарь для списка праздников (кортеж строк или дат)."""
+    return WorkweekCalendar(holidays)
+
+
+class TripColumns:
+    """Поездки в виде столбцов: день (порядковый номер даты), минута от начала суток, стоимость в рублях.
+
+    Учитываются поездки с известными временем начала и стоимостью;
+    стоимость в формулах - в целых рублях, как в чеке без копеек.
+    """
+
+    def __init__(self, trips=()):
+        """Инициализация; trips - записи Trip."""
+        self.day = array('q')
+        self.minute = array('q')
+        self.cost = array('q')
+        self.extend(trips)
+
+    def extend(self, trips):
+        """Добавление поездок."""
+        for trip in trips:
+            if trip.start is None or trip.cost is None:
+                continue
+            self.day.append(trip.start.toordinal())
+            self.minute.append(trip.start.hour * 60 + trip.start.minute)
+            self.cost.append(trip.cost // 100)
+
+    def __len__(self):
+        return len(self.day)
+
+
+def _assign_python(month_calendar, day, minute, cost):
+    """Стоимость утренней и вечерней поездки каждого дня месяца (построчный расчёт)."""
+    workdays = month_calendar.workdays
+    first_day = month_calendar.first_day
+    last_day = first_day + len(workdays)
+
+    # Поездки с одинаковым временем начала (до минуты) - одна поездка, берётся последняя
+    trips = {}
+    for trip_day, trip_minute, trip_cost in zip(day, minute, cost):
+        if first_day <= trip_day < last_day:
+            trips[(trip_day - first_day) * MINUTES_PER_DAY + trip_minute] = trip_cost
+
+    morning = [0] * len(workdays)
+    evening = [0] * len(workdays)
+    for key in sorted(trips):
+        trip_cost = trips[key]
+        if not trip_cost:
+            continue
+        index, trip_minute = divmod(key, MINUTES_PER_DAY)
+        # Поездка после полуночи считается вечерней поездкой предыдущего рабочего дня
+        if trip_minute < AFTER_MIDNIGHT_END and index > 0 and workdays[index - 1] and not evening[index - 1]:
+            evening[index - 1] = trip_cost
+            continue
+        if not workdays[index]:
+            continue
+        if trip_minute < MORNING_END:
+            if not morning[index]:
+                morning[index] = trip_cost
+        elif not evening[index]:
+            evening[index] = trip_cost
+    return morning, evening
+
+
+def _first_by_group(np, groups, values):
+    """Первое значение values для каждой группы groups (groups упорядочены по времени)."""
+    unique_groups, first_positions = np.unique(groups, return_index=True)
+    return unique_groups, values[first_positions]
+
+
+def _assign_numpy(np, month_calendar, day, minute, cost):
+    """Стоимость утренней и вечерней поездки каждого дня месяца (векторный расчёт)."""
+    workdays = np.asarray(month_calendar.workdays, dtype=bool)
+    days_count = len(workdays)
+    index = day - month_calendar.first_day
+    in_month = (index >= 0) & (index < days_count)
+    keys = index[in_month] * MINUTES_PER_DAY + minute[in_month]
+    costs = cost[in_month]
+
+    # Поездки с одинаковым временем начала - одна поездка, берётся последняя:
+    # np.unique по перевёрнутому массиву находит последние вхождения и упорядочивает по времени
+    keys, last_positions = np.unique(keys[::-1], return_index=True)
+    costs = costs[::-1][last_positions]
+    nonzero = costs != 0
+    keys = keys[nonzero]
+    costs = costs[nonzero]
+    index, minute = np.divmod(keys, MINUTES_PER_DAY)
+    is_workday = workdays[index]
+
+    morning = np.zeros(days_count, dtype=np.int64)
+    evening = np.zeros(days_count, dtype=np.int64)
+
+    # Вечерняя поездка - первая поездка рабочего дня после 12:00
+    evening_mask = is_workday & (minute >= MORNING_END)
+    evening_days, evening_costs = _first_by_group(np, index[evening_mask], costs[evening_mask])
+    evening[evening_days] = evening_costs
+
+    # Первая поездка после полуночи становится вечерней поездкой предыдущего рабочего дня без вечерней поездки
+    previous_workday = np.zeros(len(index), dtype=bool)
+    has_previous = index > 0
+    previous_workday[has_previous] = workdays[index[has_previous] - 1]
+    after_midnight = np.flatnonzero((minute < AFTER_MIDNIGHT_END) & previous_workday)
+    target_days, chosen = _first_by_group(np, index[after_midnight] - 1, after_midnight)
+    free = evening[target_days] == 0
+    evening[target_days[free]] = costs[chosen[free]]
+    consumed = np.zeros(len(index), dtype=bool)
+    consumed[chosen[free]] = True
+
+    # Утренняя поездка - первая оставшаяся поездка рабочего дня до 12:00
+    morning_mask = is_workday & (minute < MORNING_END) & ~consumed
+    morning_days, morning_costs = _first_by_group(np, index[morning_mask], costs[morning_mask])
+    morning[morning_days] = morning_costs
+    return morning.tolist(), evening.tolist()
+
+
+class AnalyticsEngine:
+    """Расчёт стоимости поездок по рабочим неделям, месяцам и годам.
+
+    Для каждого рабочего дня учитываются первая утренняя (до 12:00) и первая
+    вечерняя поездка; поездка после полуночи (до 04:00) считается вечерней
+    поездкой предыдущего рабочего дня того же месяца, если у него её ещё нет.
+    Большие наборы поездок считаются через NumPy, если он установлен.
+    """
+
+    def __init__(self, columns, work_calendar=None, vectorize=None):
+        """Инициализация; vectorize=None - NumPy при числе поездок от VECTORIZE_MIN_TRIPS."""
+        self.columns = columns
+        self.calendar = work_calendar or get_calendar()
+        if vectorize is None:
+            vectorize = len(columns) >= VECTORIZE_MIN_TRIPS
+        self._np = _load_numpy() if vectorize else None
+        self._arrays = None
+        self._sorted = None
+
+    def _numpy_columns(self):
+        if self._arrays is None:
+            np = self._np
+            self._arrays = tuple(
+                np.frombuffer(column, dtype=np.int64) if len(column) else np.zeros(0, dtype=np.int64)
+                for column in (self.columns.day, self.columns.minute, self.columns.cost)
+            )
+        return self._arrays
+
+    def _month_rows(self, month_calendar):
+        """Столбцы поездок месяца; поездки упорядочиваются по дню один раз для всех месяцев."""
+        if self._sorted is None:
+            # Сортировка устойчивая: поездки одного дня остаются в исходном порядке
+            order = sorted(range(len(self.columns)), key=self.columns.day.__getitem__)
+            self._sorted = tuple(
+                array('q', (column[row] for row in order))
+                for column in (self.columns.day, self.columns.minute, self.columns.cost)
+            )
+        day, minute, cost = self._sorted
+        start = bisect_left(day, month_calendar.first_day)
+        end = bisect_left(day, month_calendar.first_day + len(month_calendar.workdays))
+        return day[start:end], minute[start:end], cost[start:end]
+
+    def daily_costs(self, month):
+        """Календарь месяца и списки стоимости утренней и вечерней поездки по дням месяца."""
+        month_calendar = self.calendar.month(month)
+        if self._np is not None:
+            morning, evening = _assign_numpy(self._np, month_calendar, *self._numpy_columns())
+        else:
+            morning, evening = _assign_python(month_calendar, *self._month_rows(month_calendar))
+        return month_calendar, morning, evening
+
+    def weekly(self, month):
+        """Рабочие недели месяца: неделя "1-5", формула расчёта и сумма в рублях."""
+        month_calendar, morning, evening = self.daily_costs(month)
+        weeks = []
+        for week in month_calendar.weeks:
+            formula = "=(" + ")+(".join(f"{morning[day - 1]}+{evening[day - 1]}" for day in week) + ")"
+            weeks.append({
+                "week": f"{week[0]}-{week[-1]}",
+                "formula": formula,
+                "total": sum(morning[day - 1] + evening[day - 1] for day in week)
+            })
+        return weeks
+
+    def monthly(self, month):
+        """Итоги месяца: недели и формулы через табуляцию (как в отчёте) и сумма в рублях."""
+        weeks = self.weekly(month)
+        return {
+            "month": month,
+            "weeks": "\t".join(week["week"] for week in weeks),
+            "formulas": "\t".join(week["formula"] for week in weeks),
+            "week_totals": [week["total"] for week in weeks],
+            "total": sum(week["total"] for week in weeks)
+        }
+
+    def yearly(self, year, months=None):
+        """Итоги года по месяцам; months - месяцы YYYY-MM (по умолчанию все месяцы года)."""
+        if months is None:
+            months = [f"{year:04d}-{month_num:02d}" for month_num in range(1, 13)]
+        monthly = [self.monthly(month) for month in months if _parse_month(month)[0] == year]
+        return {
+            "year": year,
+            "months": monthly,
+            "total": sum(item["total"] for item in monthly)
+        }
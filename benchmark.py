@@ -0,0 +1,168 @@
+# benchmark.py - Замеры производительности разбора, анализа и кеша
+import os
+import sys
+import json
+import time
+import logging
+import platform
+import argparse
+import tempfile
+from datetime import datetime
+from itertools import cycle, islice
+
+from cache_manager import create_cache_manager
+from analytics import TripAnalytics
+from analytics_engine import AnalyticsEngine, TripColumns
+from mail_client import EmailClient
+from parser import EmailParser
+from extractors import EXTRACTORS
+from receipt_generator import generate_mailbox
+
+# Число уникальных писем; большие наборы повторяют их по кругу, чтобы не держать в памяти все письма
+UNIQUE_MESSAGES = 2000
+
+MONTH = "2024-05"
+
+
+def measure(function, repeat):
+    """Лучшее время выполнения function() из repeat попыток и результат последней."""
+    best = None
+    result = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = function()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def run_benchmarks(sizes, backends, cache_backends, repeat, seed):
+    """Замеры для каждого размера набора писем: список словарей с результатами."""
+    logging.info(f"Генерация {min(max(sizes), UNIQUE_MESSAGES)} уникальных писем")
+    unique_emails = [email_data for _, _, email_data in generate_mailbox(min(max(sizes), UNIQUE_MESSAGES), MONTH, seed)]
+    email_client = EmailClient({})
+    unique_html = [email_client.extract_html_from_email(email_data) for email_data in unique_emails]
+
+    results = []
+
+    def record(name, size, seconds):
+        results.append({
+            "name": name,
+            "size": size,
+            "seconds": round(seconds, 6),
+            "per_item_us": round(seconds / size * 1e6, 3)
+        })
+        logging.info(f"{name} [{size}]: {seconds:.3f} с ({seconds / size * 1e6:.1f} мкс на письмо)")
+
+    for size in sizes:
+        emails = list(islice(cycle(unique_emails), size))
+        html_contents = list(islice(cycle(unique_html), size))
+
+        seconds, _ = measure(lambda: [email_client.extract_html_from_email(email_data) for email_data in emails], repeat)
+        record("extract_html_from_email", size, seconds)
+
+        trips = []
+        for backend in backends:
+            email_parser = EmailParser(["улица"], backend=backend)
+            if email_parser.extractor.name != backend:
+                continue
+            seconds, _ = measure(lambda: [email_parser.parse_email_content(content) for content in html_contents], repeat)
+            record(f"parse_email_content[{backend}]", size, seconds)
+            if not trips:
+                trips = [email_parser.extract_trip(content) for content in html_contents]
+        trips = [trip for trip in trips if trip is not None]
+
+        seconds, _ = measure(lambda: TripAnalytics.format_weekly_costs(trips, MONTH), repeat)
+        record("format_weekly_costs", size, seconds)
+
+        seconds, _ = measure(lambda: AnalyticsEngine(TripColumns(trips)).yearly(int(MONTH[:4])), repeat)
+        record("analytics_yearly", size, seconds)
+
+        for cache_backend in cache_backends:
+            with tempfile.TemporaryDirectory() as cache_dir:
+                cache_manager = create_cache_manager(cache_backend, cache_dir)
+                state = cache_manager.load_state(MONTH)
+                mailbox_state = cache_manager.get_mailbox_state(state, "INBOX", 1)
+                for uid, trip in enumerate(islice(cycle(trips), size), start=1):
+                    cache_manager.append_message(MONTH, "INBOX", mailbox_state, str(uid), trip)
+                cache_manager.close_journal(MONTH)
+
+                seconds, _ = measure(lambda: cache_manager.save_state(MONTH, state), repeat)
+                record(f"cache_save[{cache_backend}]", size, seconds)
+                seconds, _ = measure(lambda: cache_manager.collect_trips(cache_manager.load_state(MONTH)), repeat)
+                record(f"cache_load[{cache_backend}]", size, seconds)
+                if hasattr(cache_manager, "close"):
+                    cache_manager.close()
+
+    return results
+
+
+def compare(results, baseline_path, threshold):
+    """Сравнение с сохранёнными результатами; возвращает число замедлений больше threshold процентов."""
+    with open(baseline_path, 'r', encoding='utf-8') as f:
+        baseline = {(item["name"], item["size"]): item["seconds"] for item in json.load(f)["results"]}
+
+    regressions = 0
+    for item in results:
+        previous = baseline.get((item["name"], item["size"]))
+        if not previous:
+            continue
+        change = (item["seconds"] - previous) / previous * 100
+        status = "ЗАМЕДЛЕНИЕ" if change > threshold else "ok"
+        if change > threshold:
+            regressions += 1
+        print(f"{item['name']} [{item['size']}]: {previous:.4f} -> {item['seconds']:.4f} с ({change:+.1f}%) {status}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Замеры производительности на синтетических письмах')
+    parser.add_argument('--sizes', type=str, default='100,1000,10000',
+                        help='Размеры наборов писем через запятую (например 100,1000,10000,100000)')
+    parser.add_argument('--backends', type=str, default=','.join(EXTRACTORS),
+                        help='Способы разбора через запятую')
+    parser.add_argument('--cache-backends', type=str, default='json,sqlite',
+                        help='Способы хранения кеша через запятую')
+    parser.add_argument('--repeat', type=int, default=3, help='Количество повторов замера (берётся лучший)')
+    parser.add_argument('--seed', type=int, default=0, help='Начальное значение генератора писем')
+    parser.add_argument('--output', type=str, default=None, help='Файл JSON для сохранения результатов')
+    parser.add_argument('--compare', type=str, default=None, help='Файл JSON с результатами для сравнения')
+    parser.add_argument('--threshold', type=float, default=10.0,
+                        help='Допустимое замедление в процентах при сравнении')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s [%(levelname)s] %(message)s')
+
+    sizes = [int(size) for size in args.sizes.split(",") if size.strip()]
+    results = run_benchmarks(
+        sizes,
+        [backend.strip() for backend in args.backends.split(",") if backend.strip()],
+        [backend.strip() for backend in args.cache_backends.split(",") if backend.strip()],
+        max(1, args.repeat),
+        args.seed
+    )
+
+    data = {
+        "created_at": datetime.now().isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "seed": args.seed,
+        "repeat": args.repeat,
+        "results": results
+    }
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+        logging.info(f"Результаты сохранены в {args.output}")
+
+    if args.compare:
+        if not os.path.exists(args.compare):
+            logging.error(f"Файл для сравнения {args.compare} не найден")
+            return 1
+        regressions = compare(results, args.compare, args.threshold)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,47 @@
+# cache-query.py - Запросы к кешу поездок в базе SQLite
+import argparse
+import logging
+from config import setup_logging
+from sqlite_cache import SQLiteCacheManager
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Поиск поездок в кеше SQLite за период и по адресу')
+    parser.add_argument('--cache-dir', type=str, default='cache',
+                        help='Директория кеша (база trips.sqlite3)')
+    parser.add_argument('--from', dest='date_from', type=str, default=None,
+                        help='Первая дата периода в формате YYYY-MM-DD')
+    parser.add_argument('--to', dest='date_to', type=str, default=None,
+                        help='Последняя дата периода в формате YYYY-MM-DD')
+    parser.add_argument('--address', type=str, default=None,
+                        help='Адрес в начальной или конечной точке маршрута')
+    parser.add_argument('--duplicates', action='store_true',
+                        help='Вывести повторяющиеся чеки')
+    parser.add_argument('--migrate', action='store_true',
+                        help='Повторно перенести в базу JSON-файлы кеша')
+    args = parser.parse_args()
+
+    setup_logging(logging.INFO)
+    cache = SQLiteCacheManager(args.cache_dir)
+    try:
+        if args.migrate:
+            logging.info(f"Перенесено месяцев: {cache.migrate_json()}")
+
+        if args.duplicates:
+            duplicates = cache.find_duplicates()
+            for duplicate in duplicates:
+                messages = ", ".join(f"{month} {mailbox} UID {uid}" for month, mailbox, uid in duplicate["messages"])
+                print(f"{duplicate['trip']} ({messages})")
+            logging.info(f"Повторяющихся чеков: {len(duplicates)}")
+            return
+
+        trips = cache.find_trips(args.date_from, args.date_to, args.address)
+        for trip in trips:
+            print(trip)
+        logging.info(f"Найдено поездок: {len(trips)}")
+    finally:
+        cache.close()
+
+
+if __name__ == "__main__":
+    main()
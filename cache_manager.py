@@ -1,15 +1,48 @@
 # cache_manager.py - Кеширование данных
 import os
 import json
+import hashlib
 import logging
-from datetime import datetime
+from collections import Counter
+from datetime import datetime, timedelta
+from trip import Trip
+import metrics
+
+# Версия формата файла кеша; файлы другой версии считаются устаревшими
+CACHE_VERSION = 4
+
+
+def month_end(month):
+    """Первый момент следующего месяца для строки формата YYYY-MM."""
+    start_date = datetime.strptime(month, "%Y-%m")
+    return (start_date.replace(day=28) + timedelta(days=4)).replace(day=1)
+
+
+def create_cache_manager(backend="json", cache_dir="cache"):
+    """Создание менеджера кеша: json - файлы по месяцам, sqlite - база SQLite."""
+    if backend == "sqlite":
+        from sqlite_cache import SQLiteCacheManager
+        return SQLiteCacheManager(cache_dir)
+    if backend != "json":
+        logging.warning(f"Неизвестный способ хранения кеша '{backend}', используются JSON-файлы")
+    return CacheManager(cache_dir)
+
 
 class CacheManager:
-    """Класс для кеширования данных о поездках."""
+    """Класс для кеширования данных о поездках.
+    
+    Кеш месяца хранит результаты обработки каждого письма по ключу
+    (папка, UIDVALIDITY, UID), поэтому повторный запуск загружает только
+    новые письма, а прерванный запуск продолжается с места остановки.
+    В кеш попадают поездки без фильтрации по адресам; отчёты с учётом
+    фильтров кешируются отдельно по хешу настроек фильтрации.
+    """
     
     def __init__(self, cache_dir="cache"):
         """Инициализация менеджера кеша."""
         self.cache_dir = cache_dir
+        # Открытые на дозапись журналы месяцев
+        self._journals = {}
         # Создаем директорию для кеша, если она не существует
         if not os.path.exists(cache_dir):
             os.makedirs(cache_dir)
@@ -18,47 +51,247 @@ class CacheManager:
         """Получение пути к файлу кеша для указанного месяца."""
         return os.path.join(self.cache_dir, f"{month}.json")
     
+    def get_journal_path(self, month):
+        """Путь к журналу результатов писем, записанных после последнего сохранения кеша."""
+        return os.path.join(self.cache_dir, f"{month}.journal")
+    
     def has_cache(self, month):
         """Проверка наличия кеша для указанного месяца."""
         cache_path = self.get_cache_path(month)
         return os.path.exists(cache_path)
     
-    def save_to_cache(self, month, trips):
-        """Сохранение данных о поездках в кеш."""
+    def _read(self, month):
+        """Чтение файла кеша месяца; None, если файла нет или он повреждён."""
+        cache_path = self.get_cache_path(month)
+        if not os.path.exists(cache_path):
+            return None
         try:
-            cache_path = self.get_cache_path(month)
-            os.makedirs(os.path.dirname(cache_path), exist_ok=True)
-            
-            # Добавляем метаданные кеша
-            cache_data = {
-                "created_at": datetime.now().isoformat(),
-                "month": month,
-                "trips_count": len(trips),
-                "trips": trips
-            }
-            
-            with open(cache_path, 'w', encoding='utf-8') as f:
-                json.dump(cache_data, f, ensure_ascii=False, indent=2)
-                
-            logging.info(f"Данные успешно сохранены в кеш: {cache_path}")
-            return True
+            with open(cache_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
         except Exception as e:
-            logging.error(f"Ошибка при сохранении данных в кеш: {e}")
+            logging.error(f"Ошибка при чтении кеша {cache_path}: {e}")
+            return None
+    
+    def is_complete(self, month):
+        """Проверка, что кеш месяца полный и его можно использовать без обращения к почте.
+        
+        Кеш полный, если последний запуск обработал все письма и начался
+        после окончания месяца, то есть новых писем за месяц уже не будет.
+        """
+        cache_data = self._read(month)
+        if cache_data is None:
             return False
+        if cache_data.get("version") != CACHE_VERSION:
+            # Кеш старого формата содержит уже отфильтрованные поездки и должен быть пересоздан
+            return False
+        return bool(cache_data.get("complete"))
     
-    def load_from_cache(self, month):
-        """Загрузка данных о поездках из кеша."""
-        try:
-            cache_path = self.get_cache_path(month)
-            if not os.path.exists(cache_path):
-                logging.warning(f"Кеш для месяца {month} не найден")
-                return None
+    def load_state(self, month):
+        """Загрузка состояния кеша месяца для дозагрузки писем."""
+        with metrics.stage("cache.load"):
+            cache_data = self._read(month)
+            if cache_data is None or cache_data.get("version") != CACHE_VERSION:
+                if cache_data is not None:
+                    logging.info(f"Кеш месяца {month} в устаревшем формате, будет пересоздан")
+                cache_data = {
+                    "version": CACHE_VERSION,
+                    "created_at": datetime.now().isoformat(),
+                    "month": month,
+                    "complete": False,
+                    "mailboxes": {}
+                }
+            self._replay_journal(month, cache_data)
+            return cache_data
+    
+    def _replay_journal(self, month, state):
+        """Применение к состоянию записей журнала месяца (результатов прерванного запуска)."""
+        journal_path = self.get_journal_path(month)
+        if not os.path.exists(journal_path):
+            return
+        replayed = 0
+        with open(journal_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # Последняя строка могла остаться недописанной
+                    logging.warning(f"Пропущена повреждённая запись журнала {journal_path}")
+                    continue
+                if record.get("version") != CACHE_VERSION:
+                    continue
+                mailbox_state = self.get_mailbox_state(state, record["mailbox"], record["uidvalidity"])
+                mailbox_state["messages"][record["uid"]] = record["trip"]
+                replayed += 1
+        if replayed:
+            logging.info(f"Из журнала месяца {month} восстановлено записей: {replayed}")
+    
+    def get_mailbox_state(self, state, mailbox, uidvalidity):
+        """Состояние папки в кеше месяца; сбрасывается при смене UIDVALIDITY."""
+        mailboxes = state.setdefault("mailboxes", {})
+        mailbox_state = mailboxes.get(mailbox)
+        if mailbox_state is not None and mailbox_state.get("uidvalidity") != uidvalidity:
+            logging.info(
+                f"UIDVALIDITY папки {mailbox} изменился "
+                f"({mailbox_state.get('uidvalidity')} -> {uidvalidity}), кеш папки сброшен"
+            )
+            mailbox_state = None
+        if mailbox_state is None:
+            mailbox_state = {"uidvalidity": uidvalidity, "last_uid": 0, "messages": {}}
+            mailboxes[mailbox] = mailbox_state
+            state["complete"] = False
+        return mailbox_state
+    
+    @staticmethod
+    def set_message(mailbox_state, uid, trip):
+        """Запись результата обработки письма (Trip или None) в состояние папки."""
+        mailbox_state["messages"][uid] = trip.to_dict() if trip is not None else None
+    
+    def append_message(self, month, mailbox, mailbox_state, uid, trip):
+        """Запись результата обработки письма в состояние папки и в журнал месяца.
+        
+        Журнал дописывается по одной строке на письмо, поэтому результаты
+        попадают на диск сразу, без перезаписи всего файла кеша; при
+        следующем save_state журнал сворачивается в файл кеша.
+        """
+        self.set_message(mailbox_state, uid, trip)
+        journal = self._journals.get(month)
+        if journal is None:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            journal = open(self.get_journal_path(month), 'a', encoding='utf-8')
+            self._journals[month] = journal
+        record = {
+            "version": CACHE_VERSION,
+            "mailbox": mailbox,
+            "uidvalidity": mailbox_state["uidvalidity"],
+            "uid": uid,
+            "trip": mailbox_state["messages"][uid]
+        }
+        journal.write(json.dumps(record, ensure_ascii=False) + "\n")
+        journal.flush()
+    
+    def close_journal(self, month):
+        """Закрытие журнала месяца, открытого на дозапись."""
+        journal = self._journals.pop(month, None)
+        if journal is not None:
+            journal.close()
+    
+    @staticmethod
+    def collect_trips(state):
+        """Список извлечённых поездок (Trip) из состояния кеша в порядке папок и UID.
+        
+        Копия чека в другой папке (та же дата и время начала и стоимость)
+        учитывается один раз: из папок берётся наибольшее число поездок
+        с одинаковыми началом и стоимостью.
+        """
+        mailboxes = state.get("mailboxes", {})
+        several_folders = len(mailboxes) > 1
+        # Число поездок с одинаковыми началом и стоимостью в уже просмотренных папках
+        seen = Counter()
+        trips = []
+        for mailbox in sorted(mailboxes):
+            messages = mailboxes[mailbox].get("messages", {})
+            counts = Counter()
+            for uid in sorted(messages, key=int):
+                data = messages[uid]
+                if not data:
+                    continue
+                if several_folders and data.get("start"):
+                    key = (data["start"], data.get("cost"))
+                    counts[key] += 1
+                    if counts[key] <= seen[key]:
+                        continue
+                trips.append(Trip.from_dict(data))
+            for key, count in counts.items():
+                seen[key] = max(seen[key], count)
+        return trips
+    
+    @staticmethod
+    def state_revision(state):
+        """Ревизия состояния кеша: меняется при добавлении писем, сбросе папки и изменении поездок.
+
+        Повторный разбор (--offline) меняет поездки без изменения числа писем,
+        поэтому в ревизию входит содержимое записей писем.
+        """
+        mailboxes = state.get("mailboxes", {})
+        summary = {
+            mailbox: [data.get("uidvalidity"), data.get("last_uid"), data.get("messages", {})]
+            for mailbox, data in mailboxes.items()
+        }
+        data = json.dumps([CACHE_VERSION, summary], sort_keys=True)
+        return hashlib.sha1(data.encode('utf-8')).hexdigest()[:16]
+    
+    def save_state(self, month, state):
+        """Сохранение состояния кеша месяца."""
+        with metrics.stage("cache.save"):
+            try:
+                cache_path = self.get_cache_path(month)
+                os.makedirs(os.path.dirname(cache_path), exist_ok=True)
                 
-            with open(cache_path, 'r', encoding='utf-8') as f:
-                cache_data = json.load(f)
+                state["updated_at"] = datetime.now().isoformat()
+                state["trips_count"] = len(self.collect_trips(state))
+                
+                # Запись через временный файл, чтобы прерванный запуск не повредил кеш
+                tmp_path = cache_path + ".tmp"
+                with open(tmp_path, 'w', encoding='utf-8') as f:
+                    json.dump(state, f, ensure_ascii=False, indent=2)
+                os.replace(tmp_path, cache_path)
                 
-            logging.info(f"Данные успешно загружены из кеша: {cache_path}")
-            return cache_data.get("trips", [])
+                # Записи журнала вошли в файл кеша
+                self.close_journal(month)
+                if os.path.exists(self.get_journal_path(month)):
+                    os.remove(self.get_journal_path(month))
+                
+                logging.debug(f"Состояние кеша сохранено: {cache_path}")
+                return True
+            except Exception as e:
+                logging.error(f"Ошибка при сохранении данных в кеш: {e}")
+                return False
+    
+    def load_from_cache(self, month):
+        """Загрузка извлечённых поездок месяца из кеша."""
+        cache_data = self._read(month)
+        if cache_data is None or cache_data.get("version") != CACHE_VERSION:
+            logging.warning(f"Кеш для месяца {month} не найден")
+            return None
+        
+        logging.info(f"Данные успешно загружены из кеша: {self.get_cache_path(month)}")
+        return self.collect_trips(cache_data)
+    
+    def get_report_path(self, month, filter_key):
+        """Путь к файлу отчёта месяца для заданных настроек фильтрации."""
+        return os.path.join(self.cache_dir, "reports", f"{month}-{filter_key}.json")
+    
+    def load_report(self, month, filter_key, revision):
+        """Загрузка отчёта из кеша; None, если отчёта нет или кеш месяца изменился.
+        
+        Поездки отчёта возвращаются записями Trip.
+        """
+        report_path = self.get_report_path(month, filter_key)
+        if not os.path.exists(report_path):
+            return None
+        try:
+            with open(report_path, 'r', encoding='utf-8') as f:
+                report = json.load(f)
         except Exception as e:
-            logging.error(f"Ошибка при загрузке данных из кеша: {e}")
-            return None 
\ No newline at end of file
+            logging.error(f"Ошибка при загрузке отчёта из кеша: {e}")
+            return None
+        if report.get("revision") != revision:
+            logging.debug(f"Отчёт {report_path} устарел")
+            return None
+        report["trips"] = [Trip.from_dict(trip) for trip in report.get("trips", [])]
+        return report
+    
+    def save_report(self, month, filter_key, revision, report):
+        """Сохранение отчёта месяца для заданных настроек фильтрации."""
+        try:
+            report_path = self.get_report_path(month, filter_key)
+            os.makedirs(os.path.dirname(report_path), exist_ok=True)
+            report = dict(report, revision=revision, created_at=datetime.now().isoformat())
+            report["trips"] = [trip.to_dict() for trip in report["trips"]]
+            with open(report_path, 'w', encoding='utf-8') as f:
+                json.dump(report, f, ensure_ascii=False, indent=2)
+            logging.debug(f"Отчёт сохранён в кеш: {report_path}")
+            return True
+        except Exception as e:
+            logging.error(f"Ошибка при сохранении отчёта в кеш: {e}")
+            return False
@@ -1,11 +1,19 @@
 # config.py - Работа с конфигурацией
 import os
-import ast
+import re
 import logging
+from functools import lru_cache
 from dotenv import load_dotenv
 
+# Элемент списка в кавычках в значении вида ["a", "b"]
+QUOTED_ITEM = re.compile(r'[\'"]([^\'"]+)[\'"]')
+
 def setup_logging(level=logging.INFO):
-    """Настройка логирования."""
+    """Настройка логирования; при повторном вызове меняется только уровень."""
+    root_logger = logging.getLogger()
+    if root_logger.handlers:
+        root_logger.setLevel(level)
+        return
     logging.basicConfig(
         level=level,
         format='%(asctime)s [%(levelname)s] %(message)s',
@@ -15,67 +23,71 @@ def setup_logging(level=logging.INFO):
         ]
     )
 
-def load_config():
-    """Загрузка конфигурации из .env файла."""
+def parse_list_setting(name):
+    """Разбор списка строк из переменной окружения вида ["a", "b"]."""
+    value = os.getenv(name, "[]").strip()
+    if not (value.startswith("[") and value.endswith("]")):
+        logging.error(f"Параметр {name} должен быть списком в квадратных скобках")
+        return []
+    items = [item.strip() for item in QUOTED_ITEM.findall(value[1:-1])]
+    logging.debug(f"Распознано {len(items)} значений {name}: {items}")
+    return items
+
+@lru_cache(maxsize=None)
+def _read_config():
+    """Чтение настроек из .env и окружения; выполняется один раз за запуск."""
     load_dotenv()
     
-    # Получаем строку ADDRESSES_TO_FIND
-    addresses_str = os.getenv("ADDRESSES_TO_FIND", "[]")
-    logging.debug(f"Загружена строка ADDRESSES_TO_FIND: {addresses_str[:100]}...")
-    
-    # Обрабатываем строку с адресами
-    addresses = []
-    try:
-        # Удаляем начальные и конечные скобки
-        if addresses_str.startswith("[") and addresses_str.endswith("]"):
-            addresses_str = addresses_str[1:-1].strip()
-            
-            # Разбиваем на отдельные адреса
-            import re
-            # Находим все строки в кавычках
-            address_matches = re.findall(r'[\'"]([^\'"]+)[\'"]', addresses_str)
-            
-            for address in address_matches:
-                addresses.append(address.strip())
-                
-        logging.debug(f"Распознано {len(addresses)} адресов: {addresses}")
-    except Exception as e:
-        logging.error(f"Ошибка при разборе ADDRESSES_TO_FIND: {e}")
-        addresses = []
+    # Списки адресов для поиска и исключения
+    addresses = parse_list_setting("ADDRESSES_TO_FIND")
+    excluded_addresses = parse_list_setting("EXCLUDED_ADDRESSES")
     
     # Получаем обязательный адрес
     required_address = os.getenv("REQUIRED_ADDRESS", "")
     if required_address:
         logging.debug(f"Обязательный адрес: {required_address}")
     
-    # Получаем адреса для исключения
-    excluded_addresses_str = os.getenv("EXCLUDED_ADDRESSES", "[]")
-    excluded_addresses = []
-    try:
-        # Удаляем начальные и конечные скобки
-        if excluded_addresses_str.startswith("[") and excluded_addresses_str.endswith("]"):
-            excluded_addresses_str = excluded_addresses_str[1:-1].strip()
-            
-            # Разбиваем на отдельные адреса
-            import re
-            # Находим все строки в кавычках
-            address_matches = re.findall(r'[\'"]([^\'"]+)[\'"]', excluded_addresses_str)
-            
-            for address in address_matches:
-                excluded_addresses.append(address.strip())
-                
-        logging.debug(f"Распознано {len(excluded_addresses)} адресов для исключения: {excluded_addresses}")
-    except Exception as e:
-        logging.error(f"Ошибка при разборе EXCLUDED_ADDRESSES: {e}")
-        excluded_addresses = []
-    
     config = {
         "IMAP_SERVER": os.getenv("IMAP_SERVER"),
+        "IMAP_PORT": int(os.getenv("IMAP_PORT", "993")),
         "EMAIL": os.getenv("EMAIL"),
         "PASSWORD": os.getenv("PASSWORD"),
         "MAILBOX_PATH": os.getenv("MAILBOX_PATH", "INBOX"),
+        "SEARCH_FOLDERS": parse_list_setting("SEARCH_FOLDERS"),
         "ADDRESSES_TO_FIND": addresses,
         "REQUIRED_ADDRESS": required_address,
-        "EXCLUDED_ADDRESSES": excluded_addresses
+        "EXCLUDED_ADDRESSES": excluded_addresses,
+        "FETCH_BATCH_SIZE": int(os.getenv("FETCH_BATCH_SIZE", "200")),
+        "FETCH_MODE": os.getenv("FETCH_MODE", "html").lower(),
+        "SENDER_PATTERNS": parse_list_setting("SENDER_PATTERNS"),
+        "SUBJECT_PATTERNS": parse_list_setting("SUBJECT_PATTERNS"),
+        "IMAP_POOL_SIZE": int(os.getenv("IMAP_POOL_SIZE", "1")),
+        "IMAP_RETRIES": int(os.getenv("IMAP_RETRIES", "3")),
+        "PARSER_BACKEND": os.getenv("PARSER_BACKEND", "bs4").lower(),
+        "PARSE_WORKERS": int(os.getenv("PARSE_WORKERS", "0")),
+        "PARSE_MIN_PARALLEL": int(os.getenv("PARSE_MIN_PARALLEL", "200")),
+        "PIPELINE_QUEUE_SIZE": int(os.getenv("PIPELINE_QUEUE_SIZE", "64")),
+        "ACCOUNTS_FILE": os.getenv("ACCOUNTS_FILE", ""),
+        "ACCOUNTS_CONCURRENCY": int(os.getenv("ACCOUNTS_CONCURRENCY", "4")),
+        "CACHE_BACKEND": os.getenv("CACHE_BACKEND", "json").lower(),
+        "MIRROR_ENABLED": os.getenv("MIRROR_ENABLED", "false").lower() in ("1", "true", "yes"),
+        "MIRROR_DIR": os.getenv("MIRROR_DIR", "mirror"),
+        "HOLIDAYS": parse_list_setting("HOLIDAYS"),
+        "WATCH_IDLE": os.getenv("WATCH_IDLE", "true").lower() in ("1", "true", "yes"),
+        "WATCH_IDLE_TIMEOUT": int(os.getenv("WATCH_IDLE_TIMEOUT", "300")),
+        "WATCH_POLL_INTERVAL": int(os.getenv("WATCH_POLL_INTERVAL", "60")),
+        "WATCH_BACKOFF_MAX": int(os.getenv("WATCH_BACKOFF_MAX", "300")),
+        "SERVER_HOST": os.getenv("SERVER_HOST", "127.0.0.1"),
+        "SERVER_PORT": int(os.getenv("SERVER_PORT", "8080")),
+        "SERVER_CACHE_SIZE": int(os.getenv("SERVER_CACHE_SIZE", "128")),
+        "SERVER_REFRESH_INTERVAL": int(os.getenv("SERVER_REFRESH_INTERVAL", "60"))
     }
-    return config 
\ No newline at end of file
+    return config
+
+def load_config():
+    """Загрузка конфигурации из .env файла.
+    
+    Возвращается копия, поэтому изменение настроек аргументами командной
+    строки не влияет на следующие вызовы.
+    """
+    return dict(_read_config())
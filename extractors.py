@@ -0,0 +1,616 @@
+# extractors.py - Извлечение данных поездки из HTML чека
+import re
+import hashlib
+import logging
+from collections import namedtuple
+from html.parser import HTMLParser
+
+import metrics
+
+# Элементы без закрывающего тега (как в html.parser-построителе BeautifulSoup)
+VOID_ELEMENTS = {
+    'area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input', 'keygen', 'link',
+    'menuitem', 'meta', 'param', 'source', 'track', 'wbr', 'basefont', 'bgsound',
+    'command', 'frame', 'image', 'isindex', 'nextid', 'spacer'
+}
+
+# Элементы, текст которых BeautifulSoup не включает в get_text()
+SKIPPED_TEXT_ELEMENTS = {'script', 'style', 'template'}
+
+DATE_LABEL = "Дата"
+
+# Классы строки маршрута и ячейки стоимости
+ROUTE_POINT_CLASS = 'route__point'
+COST_CLASS = 'report__value_main'
+
+# Наибольшее число запоминаемых шаблонов чеков на один извлекатель
+MAX_TEMPLATES = 256
+
+# Наибольшее число планов для одного отпечатка (варианты разметки с одинаковым набором классов)
+MAX_PLANS_PER_TEMPLATE = 4
+
+CLASS_ATTR_RE = re.compile(r'''class=(?:"([^"]*)"|'([^']*)')''')
+
+# План извлечения для шаблона чека: пути (номера дочерних элементов от корня)
+# к таблице строк маршрута, ячейке стоимости и ячейке "Дата"; None - элемента нет
+ExtractionPlan = namedtuple("ExtractionPlan", ("rows", "cost", "date"))
+
+# Признаки письма, найденные по тексту HTML без разбора
+TemplateMarkers = namedtuple("TemplateMarkers", ("fingerprint", "route_rows", "cost_cells"))
+
+
+def _trip_fields(points, start_time, end_time, cost_text, date_text):
+    """Словарь полей поездки в формате EmailParser.extract_trip."""
+    return {
+        "points": points,
+        "start_time": start_time,
+        "end_time": end_time,
+        "cost": cost_text,
+        "date": date_text
+    }
+
+
+def template_markers(content):
+    """Отпечаток шаблона чека и число элементов с классами строки маршрута и стоимости.
+
+    Отпечаток - классы элементов в порядке первого появления; поиск атрибутов
+    class по тексту письма намного быстрее разбора HTML, а чеки одного шаблона
+    с разным числом точек маршрута дают один отпечаток.
+    """
+    values = [double or single for double, single in CLASS_ATTR_RE.findall(content)]
+    fingerprint = hashlib.sha1("|".join(dict.fromkeys(values)).encode('utf-8')).hexdigest()[:12]
+    route_rows = 0
+    cost_cells = 0
+    for value in values:
+        classes = value.split()
+        route_rows += ROUTE_POINT_CLASS in classes
+        cost_cells += COST_CLASS in classes
+    return TemplateMarkers(fingerprint, route_rows, cost_cells)
+
+
+class TemplatePlans:
+    """Запомненные планы извлечения по отпечаткам шаблонов чеков.
+
+    Для известного шаблона элементы чека берутся по сохранённым путям без
+    поиска по всему дереву. Новый шаблон и письмо, не совпавшее ни с одним
+    планом шаблона, записываются в лог: письмо разбирается общим поиском,
+    по его результату план шаблона дополняется.
+    """
+
+    def __init__(self, backend, limit=MAX_TEMPLATES):
+        self.backend = backend
+        self.limit = limit
+        # {отпечаток: список планов}; пустой список - шаблон без плана (не чек)
+        self._plans = {}
+
+    def get(self, fingerprint):
+        """Планы шаблона; пустой кортеж для нового шаблона."""
+        return self._plans.get(fingerprint, ())
+
+    def learn(self, fingerprint, plan):
+        """Запоминание плана, построенного общим поиском для письма, не совпавшего с планами шаблона."""
+        plans = self._plans.get(fingerprint)
+        if plans is None:
+            if len(self._plans) >= self.limit:
+                logging.debug(f"[{self.backend}] Шаблон чека {fingerprint} не запомнен: запомнено шаблонов {self.limit}")
+                return
+            status = "план построен" if plan is not None else "чек не найден или план не строится"
+            logging.info(f"[{self.backend}] Новый шаблон чека {fingerprint}: использован общий поиск, {status}")
+            self._plans[fingerprint] = [plan] if plan is not None else []
+        elif plan is not None and plan not in plans and len(plans) < MAX_PLANS_PER_TEMPLATE:
+            logging.warning(f"[{self.backend}] Новый вариант разметки шаблона чека {fingerprint}: использован общий поиск, план добавлен")
+            plans.append(plan)
+        else:
+            logging.debug(f"[{self.backend}] Письмо не совпало с планами шаблона чека {fingerprint}, использован общий поиск")
+
+    def __len__(self):
+        return len(self._plans)
+
+
+class BS4Extractor:
+    """Эталонное извлечение через полное дерево BeautifulSoup."""
+
+    name = "bs4"
+
+    def __init__(self, use_plans=True):
+        # BeautifulSoup загружается только при разборе писем: отчёт по кешу его не использует
+        from bs4 import BeautifulSoup
+
+        self._soup_class = BeautifulSoup
+        # Без планов все письма разбираются общим поиском по дереву
+        self.plans = TemplatePlans(self.name) if use_plans else None
+
+    def extract(self, content):
+        """Извлечение полей поездки; None, если маршрут не найден."""
+        soup = self._soup_class(content, 'html.parser')
+
+        if self.plans is None:
+            return self._fields(*self._search(soup))
+
+        markers = template_markers(content)
+        for plan in self.plans.get(markers.fingerprint):
+            nodes = self._apply(soup, content, plan, markers)
+            if nodes is not None:
+                metrics.count("parse.plan_hits")
+                return self._fields(*nodes)
+        metrics.count("parse.plan_fallbacks")
+        nodes = self._search(soup)
+        self.plans.learn(markers.fingerprint, self._make_plan(*nodes))
+        return self._fields(*nodes)
+
+    def _search(self, soup):
+        """Общий поиск строк маршрута, ячейки стоимости и ячейки "Дата" по всему дереву."""
+        route_points = soup.find_all('tr', class_=ROUTE_POINT_CLASS)
+        cost = soup.find('td', class_=COST_CLASS)
+        date_row = soup.find('td', string=DATE_LABEL)
+        return route_points, cost, date_row
+
+    @staticmethod
+    def _path(element):
+        """Номера дочерних элементов от корня до element."""
+        path = []
+        while element.parent is not None:
+            siblings = [child for child in element.parent.contents if child.name is not None]
+            path.append(next(index for index, child in enumerate(siblings) if child is element))
+            element = element.parent
+        return tuple(reversed(path))
+
+    @staticmethod
+    def _follow(soup, path):
+        """Элемент по номерам дочерних элементов от корня; None, если пути нет."""
+        element = soup
+        for index in path:
+            children = [child for child in element.contents if child.name is not None]
+            if index >= len(children):
+                return None
+            element = children[index]
+        return element
+
+    def _make_plan(self, route_points, cost, date_row):
+        """План по результату общего поиска; None, если строки маршрута не в одной таблице."""
+        if len(route_points) < 2 or any(row.parent is not route_points[0].parent for row in route_points):
+            return None
+        return ExtractionPlan(
+            self._path(route_points[0].parent),
+            self._path(cost) if cost is not None else None,
+            self._path(date_row) if date_row is not None else None
+        )
+
+    def _apply(self, soup, content, plan, markers):
+        """Элементы чека по плану шаблона; None, если письмо не совпало с планом."""
+        table = self._follow(soup, plan.rows)
+        if table is None:
+            return None
+        route_points = [
+            child for child in table.children
+            if child.name == 'tr' and ROUTE_POINT_CLASS in child.get('class', ())
+        ]
+        # Все элементы с классом строки маршрута должны быть строками этой таблицы
+        if len(route_points) < 2 or len(route_points) != markers.route_rows:
+            return None
+
+        if plan.cost is not None and markers.cost_cells == 1:
+            cost = self._follow(soup, plan.cost)
+            if cost is None or cost.name != 'td' or COST_CLASS not in cost.get('class', ()):
+                return None
+        elif markers.cost_cells or COST_CLASS in content:
+            cost = soup.find('td', class_=COST_CLASS)
+        else:
+            cost = None
+
+        # Ячейка "Дата" определяется по тексту, поэтому при его отличии от плана ищется по дереву
+        date_row = self._follow(soup, plan.date) if plan.date is not None else None
+        if date_row is None or date_row.name != 'td' or date_row.string != DATE_LABEL:
+            date_row = soup.find('td', string=DATE_LABEL) if DATE_LABEL in content else None
+        return route_points, cost, date_row
+
+    def _fields(self, route_points, cost, date_row):
+        """Поля поездки из найденных элементов чека."""
+        if not route_points or len(route_points) < 2:
+            logging.warning("Не удалось извлечь маршрутные точки.")
+            return None
+
+        # Получаем начальную и конечную точки маршрута
+        start_point = route_points[0].find('p', class_='route__point-name').get_text(strip=True)
+        end_point = route_points[-1].find('p', class_='route__point-name').get_text(strip=True)
+
+        # Промежуточные точки маршрута
+        points = [start_point]
+        for route_point in route_points[1:-1]:
+            point_name = route_point.find('p', class_='route__point-name')
+            points.append(point_name.get_text(strip=True) if point_name else "")
+        points.append(end_point)
+
+        # Извлечение времени
+        start_time = route_points[0].find('p', class_='hint').get_text(strip=True) if route_points[0].find('p', class_='hint') else "N/A"
+        end_time = route_points[-1].find('p', class_='hint').get_text(strip=True) if route_points[-1].find('p', class_='hint') else "N/A"
+
+        # Извлечение стоимости
+        cost_text = cost.get_text(strip=True) if cost else "N/A"
+
+        # Извлечение даты
+        date_text = date_row.find_next_sibling('td').get_text(strip=True) if date_row else "N/A"
+
+        return _trip_fields(points, start_time, end_time, cost_text, date_text)
+
+
+class _Element:
+    """Открытый элемент при потоковом разборе."""
+
+    __slots__ = ("tag", "classes", "parent", "children", "only_child", "string", "capture", "handlers")
+
+    def __init__(self, tag, classes, parent):
+        self.tag = tag
+        self.classes = classes
+        self.parent = parent
+        # Количество дочерних узлов и последний из них - для аналога Tag.string
+        self.children = 0
+        self.only_child = None
+        self.string = None
+        # Собранный текст элемента (если он нужен) и обработчики закрытия
+        self.capture = None
+        self.handlers = None
+
+
+class _ReceiptParser(HTMLParser):
+    """Потоковый обработчик html.parser, собирающий только нужные поля чека.
+
+    Повторяет построение дерева html.parser-построителем BeautifulSoup:
+    закрывающий тег закрывает ближайший открытый элемент с тем же именем,
+    текст элементов собирается как get_text(strip=True).
+    """
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.stack = [_Element(None, (), None)]
+        self.capturing = []
+        self.skip_text = 0
+        self.last_text_parent = None
+        # Строки маршрута: словари с названием точки и подсказкой со временем
+        self.rows = []
+        self.open_rows = []
+        self.cost = None
+        self.cost_claimed = False
+        self.date_cell = None
+        self.date_value = None
+        self.date_value_claimed = False
+
+    def handle_starttag(self, tag, attrs):
+        classes = ()
+        for name, value in attrs:
+            if name == 'class' and value:
+                classes = value.split()
+        parent = self.stack[-1]
+        element = _Element(tag, classes, parent)
+        parent.children += 1
+        parent.only_child = element
+        self.last_text_parent = None
+        self._on_open(element)
+        if tag in VOID_ELEMENTS:
+            self._close(element)
+            return
+        self.stack.append(element)
+        if tag in SKIPPED_TEXT_ELEMENTS:
+            self.skip_text += 1
+
+    def handle_startendtag(self, tag, attrs):
+        self.handle_starttag(tag, attrs)
+        if tag not in VOID_ELEMENTS:
+            self.handle_endtag(tag)
+
+    def handle_endtag(self, tag):
+        self.last_text_parent = None
+        for index in range(len(self.stack) - 1, 0, -1):
+            if self.stack[index].tag == tag:
+                while len(self.stack) > index:
+                    element = self.stack.pop()
+                    if element.tag in SKIPPED_TEXT_ELEMENTS:
+                        self.skip_text -= 1
+                    self._close(element)
+                return
+
+    def handle_data(self, data):
+        parent = self.stack[-1]
+        if self.last_text_parent is parent:
+            # Соседние фрагменты текста образуют один текстовый узел
+            parent.only_child += data
+        else:
+            parent.children += 1
+            parent.only_child = data
+            self.last_text_parent = parent
+        if not self.skip_text:
+            for element in self.capturing:
+                element.capture.append(data)
+
+    def handle_comment(self, data):
+        parent = self.stack[-1]
+        parent.children += 1
+        parent.only_child = data
+        self.last_text_parent = None
+
+    def _close(self, element):
+        # Аналог Tag.string: текст единственного дочернего узла
+        if element.children == 1:
+            child = element.only_child
+            element.string = child if isinstance(child, str) else child.string
+        if element.capture is not None:
+            self.capturing.remove(element)
+        if self.open_rows and self.open_rows[-1][0] is element:
+            self.open_rows.pop()
+        if element.handlers:
+            text = "".join(part.strip() for part in element.capture) if element.capture is not None else None
+            for handler in element.handlers:
+                handler(element, text)
+
+    def _on_close(self, element, handler, capture=True):
+        """Регистрация обработчика закрытия элемента (с текстом элемента при capture)."""
+        if element.handlers is None:
+            element.handlers = []
+        element.handlers.append(handler)
+        if capture and element.capture is None:
+            element.capture = []
+            self.capturing.append(element)
+
+    def _on_open(self, element):
+        tag = element.tag
+        classes = element.classes
+        if tag == 'tr' and 'route__point' in classes:
+            row = {"name": None, "hint": None, "claimed": set()}
+            self.rows.append(row)
+            self.open_rows.append((element, row))
+        elif tag == 'p' and self.open_rows:
+            # Первый p нужного класса внутри каждой открытой строки маршрута
+            targets = []
+            for key, class_name in (("name", 'route__point-name'), ("hint", 'hint')):
+                if class_name in classes:
+                    for _, row in self.open_rows:
+                        if key not in row["claimed"]:
+                            row["claimed"].add(key)
+                            targets.append((row, key))
+            if targets:
+                def store_point(closed, text, targets=targets):
+                    for row, key in targets:
+                        row[key] = text
+                self._on_close(element, store_point)
+        elif tag == 'td':
+            if 'report__value_main' in classes and not self.cost_claimed:
+                self.cost_claimed = True
+                self._on_close(element, self._store_cost)
+            if (self.date_cell is not None and not self.date_value_claimed
+                    and element.parent is self.date_cell.parent):
+                # Следующая ячейка td в той же строке после ячейки "Дата"
+                self.date_value_claimed = True
+                self._on_close(element, self._store_date)
+            if self.date_cell is None:
+                self._on_close(element, self._check_date_cell, capture=False)
+
+    def _store_cost(self, element, text):
+        self.cost = text
+
+    def _store_date(self, element, text):
+        self.date_value = text
+
+    def _check_date_cell(self, element, text):
+        if self.date_cell is None and element.string == DATE_LABEL:
+            self.date_cell = element
+
+
+class StreamExtractor:
+    """Потоковое извлечение через html.parser без построения полного дерева."""
+
+    name = "stream"
+
+    def extract(self, content):
+        """Извлечение полей поездки; None, если маршрут не найден."""
+        parser = _ReceiptParser()
+        parser.feed(content)
+        parser.close()
+
+        rows = parser.rows
+        if len(rows) < 2:
+            logging.warning("Не удалось извлечь маршрутные точки.")
+            return None
+        if rows[0]["name"] is None or rows[-1]["name"] is None:
+            raise ValueError("В маршрутной точке нет названия")
+
+        points = [rows[0]["name"]]
+        points.extend(row["name"] or "" for row in rows[1:-1])
+        points.append(rows[-1]["name"])
+
+        start_time = rows[0]["hint"] if rows[0]["hint"] is not None else "N/A"
+        end_time = rows[-1]["hint"] if rows[-1]["hint"] is not None else "N/A"
+        cost_text = parser.cost if parser.cost is not None else "N/A"
+
+        if parser.date_cell is None:
+            date_text = "N/A"
+        elif parser.date_value is None:
+            raise ValueError("Не найдена ячейка со значением даты")
+        else:
+            date_text = parser.date_value
+
+        return _trip_fields(points, start_time, end_time, cost_text, date_text)
+
+
+class LxmlExtractor:
+    """Извлечение через lxml и заранее скомпилированные выражения XPath."""
+
+    name = "lxml"
+
+    def __init__(self, use_plans=True):
+        from lxml import etree, html
+
+        def has_class(name):
+            return f"contains(concat(' ', normalize-space(@class), ' '), ' {name} ')"
+
+        self._html = html
+        self._etree = etree
+        self._route_points = etree.XPath(f"//tr[{has_class(ROUTE_POINT_CLASS)}]")
+        self._point_name = etree.XPath(f".//p[{has_class('route__point-name')}]")
+        self._hint = etree.XPath(f".//p[{has_class('hint')}]")
+        self._cost = etree.XPath(f"(//td[{has_class(COST_CLASS)}])[1]")
+        self._date_cells = etree.XPath("//td[. = $label]")
+        self._texts = etree.XPath(".//text()")
+        self.plans = TemplatePlans(self.name) if use_plans else None
+
+    def _text(self, element):
+        return "".join(text.strip() for text in self._texts(element))
+
+    def _string(self, element):
+        """Аналог Tag.string из BeautifulSoup для элемента lxml."""
+        children = list(element)
+        nodes = (1 if element.text else 0) + len(children) + sum(1 for child in children if child.tail)
+        if nodes != 1:
+            return None
+        if element.text:
+            return element.text
+        child = children[0]
+        if not isinstance(child.tag, str):
+            return child.text
+        return self._string(child)
+
+    def _first(self, xpath, element):
+        found = xpath(element)
+        return found[0] if found else None
+
+    @staticmethod
+    def _has_class(element, name):
+        return name in (element.get('class') or "").split()
+
+    def extract(self, content):
+        """Извлечение полей поездки; None, если маршрут не найден."""
+        try:
+            root = self._html.document_fromstring(content)
+        except ValueError:
+            # Строки с объявлением кодировки lxml принимает только в виде bytes
+            root = self._html.document_fromstring(content.encode('utf-8'))
+
+        if self.plans is None:
+            return self._fields(*self._search(root))
+
+        markers = template_markers(content)
+        for plan in self.plans.get(markers.fingerprint):
+            nodes = self._apply(root, content, plan, markers)
+            if nodes is not None:
+                metrics.count("parse.plan_hits")
+                return self._fields(*nodes)
+        metrics.count("parse.plan_fallbacks")
+        nodes = self._search(root)
+        self.plans.learn(markers.fingerprint, self._make_plan(*nodes))
+        return self._fields(*nodes)
+
+    def _search_date(self, root):
+        for cell in self._date_cells(root, label=DATE_LABEL):
+            if self._string(cell) == DATE_LABEL:
+                return cell
+        return None
+
+    def _search(self, root):
+        """Общий поиск строк маршрута, ячейки стоимости и ячейки "Дата" по всему дереву."""
+        return self._route_points(root), self._first(self._cost, root), self._search_date(root)
+
+    @staticmethod
+    def _path(element):
+        """Номера дочерних узлов от корня до element."""
+        path = []
+        parent = element.getparent()
+        while parent is not None:
+            path.append(parent.index(element))
+            element, parent = parent, parent.getparent()
+        return tuple(reversed(path))
+
+    @staticmethod
+    def _follow(root, path):
+        """Узел по номерам дочерних узлов от корня; None, если пути нет."""
+        element = root
+        for index in path:
+            if index >= len(element):
+                return None
+            element = element[index]
+        return element
+
+    def _make_plan(self, route_points, cost, date_cell):
+        """План по результату общего поиска; None, если строки маршрута не в одной таблице."""
+        if len(route_points) < 2:
+            return None
+        table = route_points[0].getparent()
+        if any(row.getparent() is not table for row in route_points):
+            return None
+        return ExtractionPlan(
+            self._path(table),
+            self._path(cost) if cost is not None else None,
+            self._path(date_cell) if date_cell is not None else None
+        )
+
+    def _apply(self, root, content, plan, markers):
+        """Элементы чека по плану шаблона; None, если письмо не совпало с планом."""
+        table = self._follow(root, plan.rows)
+        if table is None:
+            return None
+        route_points = [child for child in table if child.tag == 'tr' and self._has_class(child, ROUTE_POINT_CLASS)]
+        # Все элементы с классом строки маршрута должны быть строками этой таблицы
+        if len(route_points) < 2 or len(route_points) != markers.route_rows:
+            return None
+
+        if plan.cost is not None and markers.cost_cells == 1:
+            cost = self._follow(root, plan.cost)
+            if cost is None or cost.tag != 'td' or not self._has_class(cost, COST_CLASS):
+                return None
+        elif markers.cost_cells or COST_CLASS in content:
+            cost = self._first(self._cost, root)
+        else:
+            cost = None
+
+        # Ячейка "Дата" определяется по тексту, поэтому при его отличии от плана ищется по дереву
+        date_cell = self._follow(root, plan.date) if plan.date is not None else None
+        if date_cell is None or date_cell.tag != 'td' or self._string(date_cell) != DATE_LABEL:
+            date_cell = self._search_date(root) if DATE_LABEL in content else None
+        return route_points, cost, date_cell
+
+    def _fields(self, route_points, cost, date_cell):
+        """Поля поездки из найденных элементов чека."""
+        if len(route_points) < 2:
+            logging.warning("Не удалось извлечь маршрутные точки.")
+            return None
+
+        points = []
+        for index, route_point in enumerate(route_points):
+            point_name = self._first(self._point_name, route_point)
+            if point_name is None and index in (0, len(route_points) - 1):
+                raise ValueError("В маршрутной точке нет названия")
+            points.append(self._text(point_name) if point_name is not None else "")
+
+        start_hint = self._first(self._hint, route_points[0])
+        end_hint = self._first(self._hint, route_points[-1])
+        start_time = self._text(start_hint) if start_hint is not None else "N/A"
+        end_time = self._text(end_hint) if end_hint is not None else "N/A"
+
+        cost_text = self._text(cost) if cost is not None else "N/A"
+
+        date_text = "N/A"
+        if date_cell is not None:
+            value = next(date_cell.itersiblings('td'), None)
+            if value is None:
+                raise ValueError("Не найдена ячейка со значением даты")
+            date_text = self._text(value)
+
+        return _trip_fields(points, start_time, end_time, cost_text, date_text)
+
+
+EXTRACTORS = {
+    "bs4": BS4Extractor,
+    "stream": StreamExtractor,
+    "lxml": LxmlExtractor
+}
+
+
+def create_extractor(name="bs4"):
+    """Создание извлекателя по имени; при недоступности - эталонный bs4."""
+    extractor_class = EXTRACTORS.get(name)
+    if extractor_class is None:
+        logging.warning(f"Неизвестный способ разбора '{name}', используется bs4")
+        return BS4Extractor()
+    try:
+        return extractor_class()
+    except ImportError as e:
+        logging.warning(f"Способ разбора '{name}' недоступен ({e}), используется bs4")
+        return BS4Extractor()
@@ -0,0 +1,171 @@
+# folder_search.py - Поиск и загрузка писем сразу в нескольких папках
+import logging
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import metrics
+from mail_client import EmailClient
+from imap_pool import IMAPConnectionPool
+
+# Признак окончания загрузки папки в общей очереди
+_END = object()
+
+
+def create_folder_pools(config):
+    """Пулы IMAP-сессий для папок SEARCH_FOLDERS; без списка папок - одна папка с чеками.
+
+    Сессии IMAP_POOL_SIZE делятся между папками (не меньше одной на папку).
+    """
+    folders = list(dict.fromkeys(config.get("SEARCH_FOLDERS") or []))
+    if not folders:
+        return FolderPools([IMAPConnectionPool(EmailClient(config), config["IMAP_POOL_SIZE"], config["IMAP_RETRIES"])])
+    size = max(1, config["IMAP_POOL_SIZE"] // len(folders))
+    return FolderPools([
+        IMAPConnectionPool(EmailClient(config, mailbox=folder), size, config["IMAP_RETRIES"])
+        for folder in folders
+    ])
+
+
+def find_duplicates(found, message_ids):
+    """Повторы писем по Message-ID.
+
+    found - пары (папка, uid) в порядке папок, message_ids - словарь
+    {(папка, uid): Message-ID}. Письмо без Message-ID не считается повтором.
+    Возвращает словарь {(папка, uid): (папка, uid) первого письма с тем же Message-ID}.
+    """
+    first = {}
+    duplicates = {}
+    for key in found:
+        message_id = message_ids.get(key)
+        if not message_id:
+            continue
+        original = first.setdefault(message_id, key)
+        if original != key:
+            duplicates[key] = original
+    return duplicates
+
+
+class FolderPools:
+    """IMAP-пулы нескольких папок: по одному пулу (и не меньше одной сессии) на папку.
+
+    Поиск выполняется во всех папках одновременно, а загрузка HTML -
+    одновременно во всех пулах; письма обозначаются парами (папка, uid).
+    """
+
+    def __init__(self, pools):
+        """Инициализация; pools - пулы IMAPConnectionPool (папки - их email_client.mailbox)."""
+        self._pools = list(pools)
+        # Открытые пулы по папкам в порядке списка
+        self.pools = {}
+        # Папки, к которым не удалось подключиться
+        self.skipped = []
+
+    def open(self):
+        """Открытие пулов всех папок. Возвращает True, если открыт хотя бы один."""
+        with ThreadPoolExecutor(max_workers=len(self._pools)) as executor:
+            opened = list(executor.map(lambda pool: pool.open(), self._pools))
+        self.pools = {}
+        self.skipped = []
+        for pool, is_open in zip(self._pools, opened):
+            mailbox = pool.email_client.mailbox
+            if not is_open:
+                logging.warning(f"Папка {mailbox} пропущена: не удалось подключиться")
+                self.skipped.append(mailbox)
+            elif mailbox in self.pools:
+                # Повторная папка (например, INBOX вместо недоступной) не просматривается дважды
+                pool.close()
+            else:
+                self.pools[mailbox] = pool
+        if len(self._pools) > 1:
+            logging.info(f"Поиск писем в папках: {', '.join(self.pools)}")
+        return bool(self.pools)
+
+    def close(self):
+        """Закрытие сессий всех пулов."""
+        for pool in self._pools:
+            pool.close()
+        self.pools = {}
+
+    def __enter__(self):
+        if not self.open():
+            raise ConnectionError("Не удалось подключиться к почтовому серверу")
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def keepalive(self):
+        """Проверка свободных сессий всех пулов (см. IMAPConnectionPool.keepalive)."""
+        results = [pool.keepalive() for pool in self.pools.values()]
+        return all(results)
+
+    def search(self, function):
+        """Вызов function(папка, пул) для каждой папки одновременно; словарь {папка: результат}.
+
+        Каждая папка просматривается на своей сессии, поэтому время поиска
+        определяется самой медленной папкой, а не их суммой.
+        """
+        if len(self.pools) == 1:
+            return {mailbox: function(mailbox, pool) for mailbox, pool in self.pools.items()}
+        with metrics.stage("imap.folder_search"):
+            with ThreadPoolExecutor(max_workers=len(self.pools), thread_name_prefix="folder") as executor:
+                futures = {mailbox: executor.submit(function, mailbox, pool) for mailbox, pool in self.pools.items()}
+                return {mailbox: future.result() for mailbox, future in futures.items()}
+
+    def fetch_html(self, keys, queue_size=64):
+        """Загрузка HTML писем keys (пары (папка, uid)): генератор пар (ключ, html).
+
+        Папки загружаются одновременно, каждая на своём пуле; результаты
+        выдаются по мере загрузки, в пределах папки - в порядке keys.
+        """
+        by_mailbox = {}
+        for mailbox, uid in keys:
+            by_mailbox.setdefault(mailbox, []).append(uid)
+        if len(by_mailbox) <= 1:
+            for mailbox, uids in by_mailbox.items():
+                for uid, html_content in self.pools[mailbox].fetch_html(uids):
+                    yield (mailbox, uid), html_content
+            return
+
+        results = queue.Queue(maxsize=max(1, queue_size))
+        stop = threading.Event()
+
+        def put(item):
+            while not stop.is_set():
+                try:
+                    results.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+
+        def fetch_folder(mailbox, uids):
+            try:
+                for uid, html_content in self.pools[mailbox].fetch_html(uids):
+                    if not put(((mailbox, uid), html_content)):
+                        return
+            except Exception as e:
+                logging.error(f"Ошибка при загрузке писем папки {mailbox}: {e}")
+            finally:
+                put(_END)
+
+        threads = [
+            threading.Thread(target=fetch_folder, args=(mailbox, uids), name=f"folder-fetch-{i}", daemon=True)
+            for i, (mailbox, uids) in enumerate(by_mailbox.items())
+        ]
+        for thread in threads:
+            thread.start()
+        try:
+            remaining = len(threads)
+            while remaining:
+                item = results.get()
+                if item is _END:
+                    remaining -= 1
+                    continue
+                yield item
+        finally:
+            # При досрочном выходе потоки папок прекращают ждать места в очереди
+            stop.set()
+            for thread in threads:
+                thread.join()
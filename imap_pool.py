@@ -0,0 +1,140 @@
+# imap_pool.py - Пул IMAP-подключений и параллельная загрузка писем
+import imaplib
+import logging
+import queue
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from mail_client import DEFAULT_BATCH_SIZE
+
+
+class IMAPConnectionPool:
+    """Пул авторизованных IMAP-сессий, выбранных на одной папке."""
+
+    def __init__(self, email_client, size, retries=3):
+        """Инициализация пула."""
+        self.email_client = email_client
+        self.size = max(1, size)
+        self.retries = max(1, retries)
+        self._idle = queue.Queue()
+        self._connections = []
+
+    def open(self):
+        """Открытие сессий пула. Возвращает True, если открыта хотя бы одна."""
+        # Первое подключение определяет папку, остальные используют её повторно
+        first = self.email_client.connect()
+        if first is None:
+            return False
+        self._add(first)
+
+        if self.size > 1:
+            with ThreadPoolExecutor(max_workers=self.size - 1) as executor:
+                for mail in executor.map(lambda _: self.email_client.connect(), range(self.size - 1)):
+                    if mail is not None:
+                        self._add(mail)
+
+        if len(self._connections) < self.size:
+            logging.warning(f"Открыто IMAP-сессий: {len(self._connections)} из {self.size}")
+        else:
+            logging.info(f"Открыто IMAP-сессий: {len(self._connections)}")
+        return True
+
+    def _add(self, mail):
+        """Добавление сессии в пул."""
+        self._connections.append(mail)
+        self._idle.put(mail)
+
+    def close(self):
+        """Закрытие всех сессий пула."""
+        for mail in self._connections:
+            try:
+                mail.logout()
+            except Exception as e:
+                logging.debug(f"Ошибка при закрытии IMAP-сессии: {e}")
+        self._connections = []
+        self._idle = queue.Queue()
+
+    def __enter__(self):
+        if not self.open():
+            raise ConnectionError("Не удалось подключиться к почтовому серверу")
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    @contextmanager
+    def connection(self):
+        """Получение свободной сессии из пула на время блока with."""
+        mail = self._idle.get()
+        try:
+            yield mail
+        finally:
+            self._idle.put(mail)
+
+    def _reconnect(self, mail):
+        """Замена оборванной сессии новой; при неудаче возвращается старая."""
+        try:
+            mail.logout()
+        except Exception:
+            pass
+        new_mail = self.email_client.connect()
+        if new_mail is None:
+            logging.error("Не удалось переподключиться к почтовому серверу")
+            return mail
+        self._connections = [new_mail if m is mail else m for m in self._connections]
+        logging.info("IMAP-сессия переподключена")
+        return new_mail
+
+    def keepalive(self):
+        """Проверка свободных сессий командой NOOP; оборванные сессии заменяются новыми.
+
+        Ошибки поиска и загрузки писем не прерывают обработку, поэтому перед
+        повторным использованием долго открытого пула сессии проверяются.
+        Возвращает True, если все проверенные сессии рабочие.
+        """
+        alive = True
+        for _ in range(self._idle.qsize()):
+            mail = self._idle.get()
+            try:
+                mail.noop()
+            except (imaplib.IMAP4.error, OSError) as e:
+                logging.warning(f"IMAP-сессия оборвана: {e}")
+                new_mail = self._reconnect(mail)
+                alive = alive and new_mail is not mail
+                mail = new_mail
+            self._idle.put(mail)
+        return alive
+
+    def _fetch_chunk(self, chunk):
+        """Загрузка HTML части писем на одной сессии с повтором при обрыве."""
+        for attempt in range(1, self.retries + 1):
+            mail = self._idle.get()
+            try:
+                results = list(self.email_client.fetch_html(mail, chunk))
+                self._idle.put(mail)
+                return results
+            except (imaplib.IMAP4.abort, OSError) as e:
+                logging.warning(f"Обрыв IMAP-сессии (попытка {attempt}/{self.retries}): {e}")
+                self._idle.put(self._reconnect(mail))
+        logging.error(f"Не удалось загрузить {len(chunk)} писем после {self.retries} попыток")
+        return []
+
+    def fetch_html(self, email_ids, chunk_size=None):
+        """Параллельная загрузка HTML писем: генератор пар (uid, html).
+
+        Список UID делится на части, которые загружаются параллельно
+        на сессиях пула. Одновременно в работе не больше 2 * size частей,
+        результаты выдаются в порядке исходного списка.
+        """
+        chunk_size = chunk_size or self.email_client.config.get("FETCH_BATCH_SIZE") or DEFAULT_BATCH_SIZE
+        chunks = [email_ids[i:i + chunk_size] for i in range(0, len(email_ids), chunk_size)]
+
+        with ThreadPoolExecutor(max_workers=self.size) as executor:
+            pending = deque()
+            for chunk in chunks:
+                pending.append(executor.submit(self._fetch_chunk, chunk))
+                if len(pending) >= 2 * self.size:
+                    yield from pending.popleft().result()
+            while pending:
+                yield from pending.popleft().result()
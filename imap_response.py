@@ -0,0 +1,199 @@
+# imap_response.py - Разбор ответов IMAP-сервера
+import re
+import base64
+import quopri
+import logging
+
+# Идентификатор письма в начале строки ответа FETCH: b'12 (UID 34 RFC822 {3456}'
+FETCH_ID_RE = re.compile(rb'^(\d+) \(')
+
+# Маркер литерала в конце строки ответа: {3456}
+LITERAL_RE = re.compile(rb'\{(\d+)\}$')
+
+
+class Literal(bytes):
+    """Содержимое литерала IMAP (отличается от атомов при разборе)."""
+
+
+def build_message_set(email_ids):
+    """Сжатие списка идентификаторов в набор сообщений IMAP, например '1:200,205'."""
+    numbers = sorted({int(email_id) for email_id in email_ids})
+    if not numbers:
+        return ""
+    ranges = []
+    start = prev = numbers[0]
+    for number in numbers[1:]:
+        if number == prev + 1:
+            prev = number
+            continue
+        ranges.append(f"{start}:{prev}" if start != prev else str(start))
+        start = prev = number
+    ranges.append(f"{start}:{prev}" if start != prev else str(start))
+    return ",".join(ranges)
+
+
+def _group_fetch_responses(data):
+    """Группировка частей ответа imaplib по письмам.
+
+    imaplib возвращает литералы кортежами (строка ответа, данные), а остаток
+    строки после литерала - отдельным элементом bytes. Генератор выдаёт для
+    каждого письма список фрагментов: bytes (текст ответа) и Literal.
+    """
+    pieces = []
+    for item in data:
+        if isinstance(item, tuple):
+            header, payload = item
+            if FETCH_ID_RE.match(header) and pieces:
+                yield pieces
+                pieces = []
+            pieces.append(LITERAL_RE.sub(b'', header))
+            pieces.append(Literal(payload))
+        elif isinstance(item, bytes):
+            if FETCH_ID_RE.match(item):
+                if pieces:
+                    yield pieces
+                pieces = [item]
+            elif pieces:
+                pieces.append(item)
+    if pieces:
+        yield pieces
+
+
+def _tokenize(pieces):
+    """Разбиение ответа на токены: '(', ')', атомы, строки и литералы."""
+    for piece in pieces:
+        if isinstance(piece, Literal):
+            yield piece
+            continue
+        pos = 0
+        length = len(piece)
+        while pos < length:
+            char = piece[pos:pos + 1]
+            if char in (b' ', b'\r', b'\n'):
+                pos += 1
+            elif char in (b'(', b')'):
+                yield char.decode()
+                pos += 1
+            elif char == b'"':
+                # Строка в кавычках с экранированием \" и \\
+                pos += 1
+                value = bytearray()
+                while pos < length and piece[pos:pos + 1] != b'"':
+                    if piece[pos:pos + 1] == b'\\':
+                        pos += 1
+                    value += piece[pos:pos + 1]
+                    pos += 1
+                pos += 1
+                yield Literal(bytes(value))
+            else:
+                # Атом; квадратные скобки (BODY[HEADER.FIELDS (FROM)]) входят в атом целиком
+                start = pos
+                depth = 0
+                while pos < length:
+                    char = piece[pos:pos + 1]
+                    if char == b'[':
+                        depth += 1
+                    elif char == b']':
+                        depth -= 1
+                    elif depth == 0 and char in (b' ', b'(', b')', b'"'):
+                        break
+                    pos += 1
+                atom = piece[start:pos]
+                yield None if atom.upper() == b'NIL' else atom
+
+
+def _build_tree(tokens):
+    """Сборка вложенных списков из потока токенов."""
+    stack = [[]]
+    for token in tokens:
+        if token == '(':
+            stack.append([])
+        elif token == ')':
+            if len(stack) > 1:
+                finished = stack.pop()
+                stack[-1].append(finished)
+        else:
+            stack[-1].append(token)
+    while len(stack) > 1:
+        finished = stack.pop()
+        stack[-1].append(finished)
+    return stack[0]
+
+
+def parse_fetch_response(data):
+    """Разбор ответа FETCH: генератор пар (номер письма, словарь атрибутов).
+
+    Ключи словаря - имена атрибутов в верхнем регистре (UID, RFC822,
+    BODYSTRUCTURE, BODY[1.2]), значения - bytes, вложенные списки или None.
+    """
+    for pieces in _group_fetch_responses(data):
+        tree = _build_tree(_tokenize(pieces))
+        if len(tree) < 2 or not isinstance(tree[1], list):
+            continue
+        seq = tree[0]
+        items = tree[1]
+        attrs = {}
+        for i in range(0, len(items) - 1, 2):
+            key = items[i]
+            if isinstance(key, bytes):
+                attrs[key.decode('ascii', errors='ignore').upper()] = items[i + 1]
+        yield seq, attrs
+
+
+def _as_str(value):
+    """Преобразование значения BODYSTRUCTURE в строку нижнего регистра."""
+    if isinstance(value, bytes):
+        return value.decode('ascii', errors='ignore').lower()
+    return ""
+
+
+def _part_params(params):
+    """Параметры части письма (charset и т.п.) в виде словаря."""
+    result = {}
+    if isinstance(params, list):
+        for i in range(0, len(params) - 1, 2):
+            result[_as_str(params[i])] = params[i + 1].decode('ascii', errors='ignore') if isinstance(params[i + 1], bytes) else ""
+    return result
+
+
+def find_html_section(structure, prefix=""):
+    """Поиск части text/html в BODYSTRUCTURE.
+
+    Возвращает кортеж (номер секции, кодировка передачи, charset)
+    или None, если HTML-части в письме нет.
+    """
+    if not isinstance(structure, list) or not structure:
+        return None
+
+    if isinstance(structure[0], list):
+        # multipart: вложенные части идут до строки подтипа
+        for index, part in enumerate(structure, start=1):
+            if not isinstance(part, list):
+                break
+            section = f"{prefix}.{index}" if prefix else str(index)
+            found = find_html_section(part, section)
+            if found:
+                return found
+        return None
+
+    # Простая часть: тип, подтип, параметры, id, описание, кодировка, размер...
+    if len(structure) < 7:
+        return None
+    if _as_str(structure[0]) == "text" and _as_str(structure[1]) == "html":
+        charset = _part_params(structure[2]).get("charset") or "utf-8"
+        encoding = _as_str(structure[5]) or "7bit"
+        return prefix or "1", encoding, charset
+    return None
+
+
+def decode_section(payload, encoding, charset):
+    """Декодирование секции письма по кодировке передачи и charset."""
+    if encoding == "base64":
+        payload = base64.b64decode(payload)
+    elif encoding == "quoted-printable":
+        payload = quopri.decodestring(payload)
+    try:
+        return payload.decode(charset, errors='replace')
+    except LookupError:
+        logging.debug(f"Неизвестная кодировка {charset}, используется utf-8")
+        return payload.decode('utf-8', errors='replace')
@@ -0,0 +1,627 @@
+# imap_standin.py - Локальный IMAP-сервер с синтетическими письмами для замеров и проверок загрузки
+import os
+import re
+import ssl
+import gzip
+import time
+import email
+import random
+import select
+import logging
+import threading
+import subprocess
+import socketserver
+from datetime import datetime
+from email.mime.text import MIMEText
+from email.utils import format_datetime, parsedate_to_datetime
+
+from receipt_generator import generate_mailbox
+
+CAPABILITIES = ("IMAP4rev1", "IDLE", "UIDPLUS")
+
+# Размер части ответа при ограничении скорости, байт
+SEND_CHUNK = 16384
+
+# Элементы команды: строка в кавычках или атом
+ARG_RE = re.compile(rb'"((?:[^"\\]|\\.)*)"|(\S+)')
+# Элемент FETCH: имя, секция в квадратных скобках и диапазон <начало.длина>
+FETCH_ITEM_RE = re.compile(r'([A-Z0-9.]+)(\[[^\]]*\])?(<[\d.]+>)?', re.I)
+LITERAL_RE = re.compile(rb'\{(\d+)\+?\}\r?\n$')
+HEADER_END_RE = re.compile(rb'\r?\n\r?\n')
+HEADER_NAME_RE = re.compile(rb'^([^:\s]+):')
+SEARCH_DATE_FORMAT = "%d-%b-%Y"
+
+
+def create_certificate(directory):
+    """Самоподписанный сертификат для localhost (через openssl): пара путей (сертификат, ключ)."""
+    certfile = os.path.join(directory, "standin-cert.pem")
+    keyfile = os.path.join(directory, "standin-key.pem")
+    if not (os.path.exists(certfile) and os.path.exists(keyfile)):
+        subprocess.run(
+            ["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "30",
+             "-subj", "/CN=localhost", "-keyout", keyfile, "-out", certfile],
+            check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+        )
+    return certfile, keyfile
+
+
+def _quote(value):
+    """Строка IMAP: в кавычках или литералом, если в ней есть не-ASCII символы или переводы строк."""
+    if value is None:
+        return b"NIL"
+    if isinstance(value, str):
+        value = value.encode('utf-8')
+    if any(byte > 126 or byte in (10, 13) for byte in value):
+        return b"{%d}\r\n" % len(value) + value
+    return b'"' + value.replace(b'\\', b'\\\\').replace(b'"', b'\\"') + b'"'
+
+
+def _parse_sequence_set(value, highest):
+    """Номера из набора IMAP ('1:200,205', '5:*'); '*' - наибольший номер."""
+    numbers = set()
+    for item in value.split(","):
+        bounds = [highest if bound == "*" else int(bound) for bound in item.split(":")]
+        low, high = min(bounds), max(bounds)
+        numbers.update(range(low, high + 1))
+    return numbers
+
+
+class StoredMessage:
+    """Письмо папки: UID, дата получения и содержимое RFC822 (строки через CRLF)."""
+
+    def __init__(self, uid, data, internaldate):
+        self.uid = uid
+        self.data = re.sub(rb'\r?\n', b'\r\n', data)
+        self.internaldate = internaldate
+        self._parsed = None
+        self._structure = None
+
+    @property
+    def parsed(self):
+        """Разобранное письмо; разбирается при первом обращении."""
+        if self._parsed is None:
+            self._parsed = email.message_from_bytes(self.data)
+        return self._parsed
+
+    def header(self):
+        match = HEADER_END_RE.search(self.data)
+        return self.data[:match.end()] if match else self.data
+
+    def text(self):
+        match = HEADER_END_RE.search(self.data)
+        return self.data[match.end():] if match else b""
+
+    def header_fields(self, names, exclude=False):
+        """Строки заголовка с полями names (или кроме них при exclude) и пустая строка в конце."""
+        names = {name.upper() for name in names}
+        lines = []
+        keep = False
+        for line in self.header().splitlines(keepends=True):
+            if line in (b"\r\n", b"\n"):
+                break
+            match = HEADER_NAME_RE.match(line)
+            if match:
+                keep = (match.group(1).decode('ascii', errors='ignore').upper() in names) != exclude
+            if keep:
+                lines.append(line)
+        return b"".join(lines) + b"\r\n"
+
+    def part(self, section):
+        """Часть письма по номеру секции ('1', '1.2'); None, если её нет."""
+        part = self.parsed
+        for index in section.split("."):
+            index = int(index)
+            if part.is_multipart():
+                payload = part.get_payload()
+                if not 1 <= index <= len(payload):
+                    return None
+                part = payload[index - 1]
+            elif index != 1:
+                return None
+        return part
+
+    @staticmethod
+    def part_body(part):
+        """Тело части в кодировке передачи (как в письме)."""
+        payload = part.get_payload()
+        if isinstance(payload, list):
+            return b"".join(item.as_bytes() for item in payload)
+        return payload.encode('utf-8', errors='surrogateescape')
+
+    def bodystructure(self):
+        """BODYSTRUCTURE письма; строится при первом обращении."""
+        if self._structure is None:
+            self._structure = self._structure_of(self.parsed)
+        return self._structure
+
+    def _structure_of(self, part):
+        if part.is_multipart():
+            parts = b"".join(self._structure_of(item) for item in part.get_payload())
+            return b"(" + parts + b" " + _quote(part.get_content_subtype().upper()) + b")"
+        params = part.get_params() or []
+        params = [item for item in params[1:] if item[1]]
+        params_value = b"(" + b" ".join(_quote(name) + b" " + _quote(value) for name, value in params) + b")" if params else b"NIL"
+        body = self.part_body(part)
+        fields = [
+            _quote(part.get_content_maintype().upper()),
+            _quote(part.get_content_subtype().upper()),
+            params_value,
+            b"NIL",
+            b"NIL",
+            _quote((part.get("Content-Transfer-Encoding") or "7bit").upper()),
+            str(len(body)).encode()
+        ]
+        if part.get_content_maintype() == "text":
+            fields.append(str(body.count(b"\n")).encode())
+        return b"(" + b" ".join(fields) + b")"
+
+
+class StandinMailbox:
+    """Папка сервера: письма в порядке UID."""
+
+    def __init__(self, name, uidvalidity=1):
+        self.name = name
+        self.uidvalidity = uidvalidity
+        self.messages = []
+        self.next_uid = 1
+
+    def append(self, data, internaldate, uid=None):
+        """Добавление письма; UID назначается по порядку, если не задан."""
+        uid = uid or self.next_uid
+        message = StoredMessage(uid, data, internaldate)
+        if self.messages and self.messages[-1].uid > uid:
+            # Список заменяется целиком: сессии читают его без блокировки
+            self.messages = sorted(self.messages + [message], key=lambda item: item.uid)
+        else:
+            self.messages.append(message)
+        self.next_uid = max(self.next_uid, uid + 1)
+        return message
+
+
+def _with_message_id(data, message_id):
+    """Письмо с заголовком Message-ID (генератор писем его не добавляет)."""
+    return f"Message-ID: {message_id}\r\n".encode('ascii') + data
+
+
+def synthetic_mailboxes(count, month, seed=0, folders=("Taxi",), duplicates=0.0):
+    """Папки с синтетическими письмами месяца.
+
+    Письма раскладываются по папкам по кругу; доля duplicates писем
+    дополнительно копируется в следующую папку с тем же Message-ID
+    (как при копировании правилом почты). Дата получения - Date письма.
+    """
+    mailboxes = {name: StandinMailbox(name, uidvalidity=1000 + index) for index, name in enumerate(folders)}
+    names = list(mailboxes)
+    rng = random.Random(seed)
+    for uid, _, data in generate_mailbox(count, month, seed):
+        data = _with_message_id(data, f"<{seed}.{uid}@standin.local>")
+        internaldate = parsedate_to_datetime(email.message_from_bytes(data)["Date"])
+        target = (uid - 1) % len(names)
+        mailboxes[names[target]].append(data, internaldate)
+        if len(names) > 1 and rng.random() < duplicates:
+            mailboxes[names[(target + 1) % len(names)]].append(data, internaldate)
+    return mailboxes
+
+
+def mirror_mailboxes(root):
+    """Папки из локальной копии писем (MIRROR_DIR) с исходными UID и UIDVALIDITY.
+
+    Для каждой папки берётся копия с наибольшим UIDVALIDITY. Сохранённая
+    HTML-часть оборачивается в письмо; дата получения - дата поездки из чека.
+    """
+    from parser import EmailParser
+    email_parser = None
+    mailboxes = {}
+    for name in sorted(os.listdir(root)):
+        folder = os.path.join(root, name)
+        validities = [entry for entry in os.listdir(folder) if entry.isdigit()] if os.path.isdir(folder) else []
+        if not validities:
+            continue
+        uidvalidity = max(validities, key=int)
+        mailbox = StandinMailbox(name, int(uidvalidity))
+        for directory, _, files in os.walk(os.path.join(folder, uidvalidity)):
+            for file_name in files:
+                uid, _, kind = file_name.partition(".")
+                if not uid.isdigit() or kind not in ("html.gz", "eml.gz"):
+                    continue
+                path = os.path.join(directory, file_name)
+                with gzip.open(path, 'rb') as f:
+                    content = f.read()
+                if kind == "eml.gz":
+                    date = email.message_from_bytes(content)["Date"]
+                    internaldate = parsedate_to_datetime(date) if date else None
+                else:
+                    html_content = content.decode('utf-8', errors='replace')
+                    email_parser = email_parser or EmailParser([])
+                    trip = email_parser.extract_trip(html_content)
+                    internaldate = trip.start.astimezone() if trip is not None and trip.start else None
+                    message = MIMEText(html_content, "html", "utf-8")
+                    message["From"] = "Яндекс Go <no-reply@taxi.yandex.ru>"
+                    message["Subject"] = "Отчёт о поездке"
+                    message["Date"] = format_datetime(internaldate or datetime.now().astimezone())
+                    content = message.as_bytes()
+                if "Message-ID" not in email.message_from_bytes(content):
+                    content = _with_message_id(content, f"<{uidvalidity}.{uid}.{name}@standin.local>")
+                internaldate = internaldate or datetime.fromtimestamp(os.path.getmtime(path)).astimezone()
+                mailbox.append(content, internaldate, int(uid))
+        mailboxes[name] = mailbox
+        logging.info(f"Папка {name}: загружено писем из локальной копии: {len(mailbox.messages)}")
+    return mailboxes
+
+
+class _ConnectionDropped(Exception):
+    """Соединение разорвано сервером (имитация обрыва)."""
+
+
+class StandinRequestHandler(socketserver.StreamRequestHandler):
+    """Сессия IMAP: LOGIN, LIST, SELECT/EXAMINE, SEARCH, FETCH, NOOP, IDLE, LOGOUT (и их UID-варианты)."""
+
+    # Небуферизованное чтение: во время IDLE готовность данных проверяется через select
+    rbufsize = 0
+
+    def setup(self):
+        self.request.do_handshake()
+        super().setup()
+        self.authenticated = False
+        self.mailbox = None
+
+    def handle(self):
+        server = self.server
+        server.add_stat("connections")
+        capabilities = " ".join(server.capabilities)
+        try:
+            self.send(f"* OK [CAPABILITY {capabilities}] IMAP stand-in ready\r\n".encode())
+            while not server.closing.is_set():
+                line = self.read_command()
+                if line is None:
+                    return
+                server.add_stat("commands")
+                if not self.dispatch(line):
+                    return
+        except _ConnectionDropped:
+            server.add_stat("dropped")
+        except (OSError, ValueError) as e:
+            logging.debug(f"Сессия IMAP закрыта: {e}")
+
+    def read_command(self):
+        """Строка команды с подставленными литералами; None при закрытом соединении."""
+        line = self.rfile.readline()
+        if not line:
+            return None
+        while True:
+            match = LITERAL_RE.search(line)
+            if not match:
+                return line.rstrip(b"\r\n")
+            size = int(match.group(1))
+            if not line[match.start():].startswith(b"{%d+}" % size):
+                self.send(b"+ Ready for literal\r\n")
+            literal = b""
+            while len(literal) < size:
+                chunk = self.rfile.read(size - len(literal))
+                if not chunk:
+                    return None
+                literal += chunk
+            line = line[:match.start()] + _quote(literal.decode('utf-8', errors='replace')) + self.rfile.readline()
+
+    def send(self, data):
+        """Отправка с ограничением скорости сессии (bandwidth байт/с)."""
+        bandwidth = self.server.bandwidth
+        if not bandwidth:
+            self.wfile.write(data)
+        else:
+            for offset in range(0, len(data), SEND_CHUNK):
+                chunk = data[offset:offset + SEND_CHUNK]
+                self.wfile.write(chunk)
+                time.sleep(len(chunk) / bandwidth)
+        self.server.add_stat("bytes_sent", len(data))
+
+    def complete(self, tag, status, text):
+        """Завершающий ответ команды после задержки latency."""
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        self.send(tag + b" " + status + b" " + text.encode('utf-8') + b"\r\n")
+
+    def dispatch(self, line):
+        """Выполнение команды; False - сессия завершена."""
+        parts = line.split(b" ", 2)
+        tag = parts[0]
+        command = parts[1].upper().decode('ascii', errors='ignore') if len(parts) > 1 else ""
+        args = parts[2] if len(parts) > 2 else b""
+        use_uid = command == "UID"
+        if use_uid:
+            sub = args.split(b" ", 1)
+            command = sub[0].upper().decode('ascii', errors='ignore')
+            args = sub[1] if len(sub) > 1 else b""
+
+        if command == "CAPABILITY":
+            self.send(f"* CAPABILITY {' '.join(self.server.capabilities)}\r\n".encode())
+            self.complete(tag, b"OK", "CAPABILITY completed")
+        elif command == "NOOP":
+            self.complete(tag, b"OK", "NOOP completed")
+        elif command == "LOGOUT":
+            self.send(b"* BYE stand-in logging out\r\n")
+            self.complete(tag, b"OK", "LOGOUT completed")
+            return False
+        elif command == "LOGIN":
+            self.login(tag, args)
+        elif not self.authenticated:
+            self.complete(tag, b"NO", "Not authenticated")
+        elif command == "LIST":
+            self.list(tag, args)
+        elif command in ("SELECT", "EXAMINE"):
+            self.select(tag, command, args)
+        elif command == "CLOSE":
+            self.mailbox = None
+            self.complete(tag, b"OK", "CLOSE completed")
+        elif self.mailbox is None:
+            self.complete(tag, b"NO", "No mailbox selected")
+        elif command == "SEARCH":
+            self.search(tag, args, use_uid)
+        elif command == "FETCH":
+            self.fetch(tag, args, use_uid)
+        elif command == "IDLE" and "IDLE" in self.server.capabilities:
+            self.idle(tag)
+        else:
+            self.complete(tag, b"BAD", f"Unsupported command {command}")
+        return True
+
+    @staticmethod
+    def arguments(args):
+        return [match.group(1) if match.group(1) is not None else match.group(2) for match in ARG_RE.finditer(args)]
+
+    def login(self, tag, args):
+        values = [value.decode('utf-8', errors='replace') for value in self.arguments(args)]
+        if values[:2] == [self.server.user, self.server.password]:
+            self.authenticated = True
+            self.complete(tag, b"OK", "LOGIN completed")
+        else:
+            self.complete(tag, b"NO", "[AUTHENTICATIONFAILED] Invalid credentials")
+
+    def list(self, tag, args):
+        values = [value.decode('utf-8', errors='replace') for value in self.arguments(args)]
+        pattern = values[1] if len(values) > 1 else "*"
+        for name in self.server.mailboxes:
+            if pattern in ("*", "%") or pattern == name:
+                self.send(b'* LIST (\\HasNoChildren) "/" ' + _quote(name) + b"\r\n")
+        self.complete(tag, b"OK", "LIST completed")
+
+    def select(self, tag, command, args):
+        values = self.arguments(args)
+        name = values[0].decode('utf-8', errors='replace') if values else ""
+        mailbox = self.server.find_mailbox(name)
+        if mailbox is None:
+            self.mailbox = None
+            self.complete(tag, b"NO", "[NONEXISTENT] Mailbox does not exist")
+            return
+        self.mailbox = mailbox
+        self.send(
+            b"* FLAGS (\\Seen)\r\n"
+            + b"* %d EXISTS\r\n" % len(mailbox.messages)
+            + b"* 0 RECENT\r\n"
+            + b"* OK [UIDVALIDITY %d] UIDs valid\r\n" % mailbox.uidvalidity
+            + b"* OK [UIDNEXT %d] Predicted next UID\r\n" % mailbox.next_uid
+        )
+        mode = "READ-ONLY" if command == "EXAMINE" else "READ-WRITE"
+        self.complete(tag, b"OK", f"[{mode}] {command} completed")
+
+    def search(self, tag, args, use_uid):
+        """SEARCH с условиями ALL, SINCE, BEFORE, ON, UID и набором номеров."""
+        messages = list(self.mailbox.messages)
+        highest_uid = messages[-1].uid if messages else 0
+        tokens = args.decode('ascii', errors='ignore').split()
+        selected = list(enumerate(messages, start=1))
+        try:
+            position = 0
+            while position < len(tokens):
+                key = tokens[position].upper()
+                position += 1
+                if key == "ALL":
+                    continue
+                if key == "CHARSET":
+                    position += 1
+                elif key in ("SINCE", "BEFORE", "ON"):
+                    day = datetime.strptime(tokens[position], SEARCH_DATE_FORMAT).date()
+                    position += 1
+                    if key == "SINCE":
+                        selected = [(seq, msg) for seq, msg in selected if msg.internaldate.date() >= day]
+                    elif key == "BEFORE":
+                        selected = [(seq, msg) for seq, msg in selected if msg.internaldate.date() < day]
+                    else:
+                        selected = [(seq, msg) for seq, msg in selected if msg.internaldate.date() == day]
+                elif key == "UID":
+                    uids = _parse_sequence_set(tokens[position], highest_uid)
+                    position += 1
+                    selected = [(seq, msg) for seq, msg in selected if msg.uid in uids]
+                elif key[0].isdigit() or key[0] == "*":
+                    seqs = _parse_sequence_set(key, len(messages))
+                    selected = [(seq, msg) for seq, msg in selected if seq in seqs]
+                else:
+                    raise ValueError(f"Unsupported search key {key}")
+        except (ValueError, IndexError) as e:
+            self.complete(tag, b"BAD", f"SEARCH failed: {e}")
+            return
+        numbers = [str(msg.uid if use_uid else seq) for seq, msg in selected]
+        self.send(("* SEARCH " + " ".join(numbers)).rstrip().encode() + b"\r\n")
+        self.complete(tag, b"OK", "SEARCH completed")
+
+    def fetch(self, tag, args, use_uid):
+        message_set, _, items = args.decode('ascii', errors='ignore').partition(" ")
+        items = items.strip()
+        if items.startswith("(") and items.endswith(")"):
+            items = items[1:-1]
+        macros = {"ALL": "FLAGS INTERNALDATE RFC822.SIZE", "FAST": "FLAGS INTERNALDATE RFC822.SIZE",
+                  "FULL": "FLAGS INTERNALDATE RFC822.SIZE BODY"}
+        items = macros.get(items.upper(), items)
+        requested = [(name.upper(), section, partial) for name, section, partial in FETCH_ITEM_RE.findall(items)]
+        if use_uid and not any(name == "UID" for name, _, _ in requested):
+            requested.insert(0, ("UID", "", ""))
+        if not self.server.bodystructure and any(name in ("BODYSTRUCTURE", "BODY") and not section for name, section, _ in requested):
+            self.complete(tag, b"NO", "[CANNOT] BODYSTRUCTURE is disabled")
+            return
+        content = any(name == "RFC822" or (section and "HEADER" not in section.upper()) for name, section, _ in requested)
+
+        messages = list(self.mailbox.messages)
+        highest = messages[-1].uid if use_uid and messages else len(messages)
+        numbers = _parse_sequence_set(message_set, highest)
+        response = []
+        for seq, message in enumerate(messages, start=1):
+            if (message.uid if use_uid else seq) not in numbers:
+                continue
+            attrs = [self.fetch_item(message, name, section) for name, section, _ in requested]
+            response.append(b"* %d FETCH (" % seq + b" ".join(attrs) + b")\r\n")
+        data = b"".join(response)
+        if content and self.server.should_drop():
+            # Обрыв посреди ответа, как при потере соединения
+            self.send(data[:len(data) // 2])
+            raise _ConnectionDropped()
+        self.send(data)
+        self.complete(tag, b"OK", "FETCH completed")
+
+    def fetch_item(self, message, name, section):
+        if name == "UID":
+            return b"UID %d" % message.uid
+        if name == "FLAGS":
+            return b"FLAGS (\\Seen)"
+        if name == "INTERNALDATE":
+            return b"INTERNALDATE " + _quote(message.internaldate.strftime("%d-%b-%Y %H:%M:%S %z"))
+        if name == "RFC822.SIZE":
+            return b"RFC822.SIZE %d" % len(message.data)
+        if name in ("RFC822", "RFC822.HEADER", "RFC822.TEXT"):
+            payload = {"RFC822": message.data, "RFC822.HEADER": message.header(), "RFC822.TEXT": message.text()}[name]
+            return name.encode() + b" {%d}\r\n" % len(payload) + payload
+        if name in ("BODYSTRUCTURE", "BODY") and not section:
+            return name.encode() + b" " + message.bodystructure()
+        if name in ("BODY", "BODY.PEEK"):
+            spec = section[1:-1]
+            payload = self.section(message, spec)
+            key = b"BODY[" + spec.upper().encode() + b"]"
+            if payload is None:
+                return key + b" NIL"
+            return key + b" {%d}\r\n" % len(payload) + payload
+        return name.encode() + b" NIL"
+
+    @staticmethod
+    def section(message, spec):
+        """Содержимое секции BODY[spec]; None, если секции нет."""
+        upper = spec.upper()
+        if not spec:
+            return message.data
+        if upper == "HEADER":
+            return message.header()
+        if upper == "TEXT":
+            return message.text()
+        if upper.startswith("HEADER.FIELDS"):
+            names = upper[upper.find("(") + 1:upper.rfind(")")].split()
+            return message.header_fields(names, exclude=upper.startswith("HEADER.FIELDS.NOT"))
+        if re.fullmatch(r'\d+(\.\d+)*', spec):
+            part = message.part(spec)
+            return StoredMessage.part_body(part) if part is not None else None
+        return None
+
+    def idle(self, tag):
+        """IDLE: сообщения EXISTS о новых письмах до команды DONE."""
+        self.send(b"+ idling\r\n")
+        known = len(self.mailbox.messages)
+        while not self.server.closing.is_set():
+            if not self.request.pending():
+                readable, _, _ = select.select([self.request], [], [], 0.2)
+            else:
+                readable = True
+            if readable:
+                line = self.rfile.readline()
+                if not line:
+                    raise _ConnectionDropped()
+                if line.strip().upper() == b"DONE":
+                    break
+                continue
+            count = len(self.mailbox.messages)
+            if count != known:
+                self.send(b"* %d EXISTS\r\n" % count)
+                known = count
+        self.complete(tag, b"OK", "IDLE terminated")
+
+
+class StandinServer(socketserver.ThreadingTCPServer):
+    """Локальный IMAP-сервер (TLS) с папками в памяти для проверки загрузки писем без почтового сервера.
+
+    latency - задержка ответа на каждую команду, с; bandwidth - ограничение
+    скорости отправки в каждой сессии, байт/с (0 - без ограничения);
+    drop_rate - вероятность обрыва соединения посреди ответа FETCH с
+    содержимым писем. Без bodystructure сервер отклоняет FETCH BODYSTRUCTURE,
+    без idle - не поддерживает IDLE.
+    """
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, mailboxes, certfile, keyfile, address=("127.0.0.1", 0), user="user@standin.local",
+                 password="password", latency=0.0, bandwidth=0, drop_rate=0.0, seed=0,
+                 bodystructure=True, idle=True):
+        super().__init__(address, StandinRequestHandler)
+        self.mailboxes = mailboxes
+        self.ssl_context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        self.ssl_context.load_cert_chain(certfile, keyfile)
+        self.user = user
+        self.password = password
+        self.latency = max(0.0, latency)
+        self.bandwidth = max(0, bandwidth)
+        self.drop_rate = max(0.0, drop_rate)
+        self.bodystructure = bodystructure
+        self.capabilities = tuple(item for item in CAPABILITIES if idle or item != "IDLE")
+        self.closing = threading.Event()
+        self.stats = {"connections": 0, "commands": 0, "bytes_sent": 0, "dropped": 0}
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    def get_request(self):
+        sock, address = super().get_request()
+        # Рукопожатие TLS выполняется в потоке сессии
+        return self.ssl_context.wrap_socket(sock, server_side=True, do_handshake_on_connect=False), address
+
+    def handle_error(self, request, client_address):
+        logging.debug(f"Ошибка сессии IMAP {client_address}", exc_info=True)
+
+    def add_stat(self, name, value=1):
+        with self._lock:
+            self.stats[name] += value
+
+    def should_drop(self):
+        with self._lock:
+            return self.drop_rate > 0 and self._rng.random() < self.drop_rate
+
+    def find_mailbox(self, name):
+        if name.upper() == "INBOX":
+            name = next((key for key in self.mailboxes if key.upper() == "INBOX"), name)
+        return self.mailboxes.get(name)
+
+    def deliver(self, mailbox, data, internaldate=None):
+        """Добавление нового письма в папку (сессии в IDLE получают EXISTS)."""
+        with self._lock:
+            return self.mailboxes[mailbox].append(data, internaldate or datetime.now().astimezone())
+
+    def start(self):
+        """Запуск сервера в фоновом потоке."""
+        self._thread = threading.Thread(target=self.serve_forever, name="imap-standin", daemon=True)
+        self._thread.start()
+        logging.info(f"IMAP stand-in: 127.0.0.1:{self.port}, папки: {', '.join(self.mailboxes)}")
+        return self
+
+    def stop(self):
+        """Остановка сервера и завершение сессий в IDLE."""
+        self.closing.set()
+        if self._thread is not None:
+            self.shutdown()
+            self._thread.join()
+            self._thread = None
+        self.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
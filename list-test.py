@@ -13,6 +13,7 @@ logging.basicConfig(
 # Загрузка переменных окружения
 load_dotenv()
 IMAP_SERVER = os.getenv("IMAP_SERVER")
+IMAP_PORT = int(os.getenv("IMAP_PORT", "993"))
 EMAIL = os.getenv("EMAIL")
 PASSWORD = os.getenv("PASSWORD")
 
@@ -21,7 +22,7 @@ def connect_to_mail():
     """Подключение к серверу IMAP и авторизация."""
     try:
         logging.info("Подключение к серверу IMAP...")
-        mail = imaplib.IMAP4_SSL(IMAP_SERVER)
+        mail = imaplib.IMAP4_SSL(IMAP_SERVER, IMAP_PORT)
         mail.login(EMAIL, PASSWORD)
         logging.info("Успешно подключено к почтовому ящику.")
         return mail
@@ -0,0 +1,278 @@
+# load-test.py - Замеры загрузки писем (fetch_months) на локальном IMAP-сервере без обращения к почте
+import os
+import sys
+import json
+import time
+import random
+import logging
+import platform
+import argparse
+import tempfile
+import multiprocessing
+from datetime import datetime
+
+from config import load_config
+from parser import EmailParser
+from cache_manager import create_cache_manager
+from imap_standin import StandinServer, create_certificate, synthetic_mailboxes, mirror_mailboxes
+from receipt_generator import generate_email
+from benchmark import compare
+from main import fetch_months, month_range
+
+
+class FirstTripTimer:
+    """Кеш с отметкой времени записи первой поездки (обёртка над менеджером кеша)."""
+
+    def __init__(self, cache_manager):
+        self._cache_manager = cache_manager
+        self.first_trip = None
+
+    def __getattr__(self, name):
+        return getattr(self._cache_manager, name)
+
+    def append_message(self, month, mailbox, mailbox_state, uid, trip):
+        if trip is not None and self.first_trip is None:
+            self.first_trip = time.perf_counter()
+        self._cache_manager.append_message(month, mailbox, mailbox_state, uid, trip)
+
+
+def build_mailboxes(args):
+    """Папки сервера: из локальной копии писем или синтетические."""
+    if args.mirror:
+        return mirror_mailboxes(args.mirror)
+    folders = [folder.strip() for folder in args.folders.split(",") if folder.strip()]
+    return synthetic_mailboxes(args.messages, args.month, args.seed, folders, args.duplicates)
+
+
+def corpus_months(mailboxes):
+    """Месяцы писем всех папок (от первого до последнего)."""
+    months = sorted({message.internaldate.strftime("%Y-%m") for mailbox in mailboxes.values() for message in mailbox.messages})
+    return month_range(months[0], months[-1]) if months else []
+
+
+def start_server(args, mailboxes, certfile, keyfile, port=0):
+    return StandinServer(
+        mailboxes, certfile, keyfile,
+        address=("127.0.0.1", port),
+        latency=args.latency / 1000,
+        bandwidth=int(args.bandwidth * 1024),
+        drop_rate=args.drop_rate,
+        seed=args.seed,
+        bodystructure=not args.no_bodystructure,
+        idle=not args.no_idle
+    ).start()
+
+
+def _server_process(conn, args, certfile, keyfile):
+    """Сервер в отдельном процессе: отправляет порт, месяцы и число писем, по команде останавливается и отправляет статистику."""
+    logging.getLogger().setLevel(logging.WARNING)
+    mailboxes = build_mailboxes(args)
+    server = start_server(args, mailboxes, certfile, keyfile)
+    total = sum(len(mailbox.messages) for mailbox in mailboxes.values())
+    conn.send((server.port, server.user, server.password, list(mailboxes), corpus_months(mailboxes), total))
+    conn.recv()
+    server.stop()
+    conn.send(server.stats)
+
+
+class ServerProcess:
+    """Локальный сервер в отдельном процессе, чтобы он не делил GIL с замеряемой загрузкой."""
+
+    def __init__(self, args, certfile, keyfile):
+        self._conn, child_conn = multiprocessing.Pipe()
+        self._process = multiprocessing.Process(target=_server_process, args=(child_conn, args, certfile, keyfile), daemon=True)
+        self.stats = {}
+
+    def __enter__(self):
+        self._process.start()
+        self.port, self.user, self.password, self.folders, self.months, self.total = self._conn.recv()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._conn.send("stop")
+        self.stats = self._conn.recv()
+        self._process.join()
+
+
+def run_config(base_config, server, folders, pool_size, fetch_mode):
+    """Настройки запуска на локальном сервере."""
+    config = dict(
+        base_config,
+        IMAP_SERVER="127.0.0.1",
+        IMAP_PORT=server.port,
+        EMAIL=server.user,
+        PASSWORD=server.password,
+        IMAP_POOL_SIZE=pool_size,
+        FETCH_MODE=fetch_mode,
+        MIRROR_ENABLED=False,
+        SENDER_PATTERNS=["taxi.yandex"],
+        SUBJECT_PATTERNS=[]
+    )
+    if len(folders) > 1:
+        config["SEARCH_FOLDERS"] = folders
+    else:
+        config["SEARCH_FOLDERS"] = []
+        config["MAILBOX_PATH"] = folders[0] if folders else "INBOX"
+    return config
+
+
+def measure_fetch(args, certfile, keyfile, pool_size, fetch_mode):
+    """Один запуск fetch_months на новом сервере с пустым кешем: словарь с замерами."""
+    base_config = load_config()
+    email_parser = EmailParser([], backend=base_config["PARSER_BACKEND"])
+    with ServerProcess(args, certfile, keyfile) as server:
+        if not server.total:
+            logging.error("На сервере нет писем")
+            return None
+        config = run_config(base_config, server, server.folders, pool_size, fetch_mode)
+        with tempfile.TemporaryDirectory() as cache_dir:
+            cache_manager = FirstTripTimer(create_cache_manager(args.cache_backend, cache_dir))
+            started = time.perf_counter()
+            states = fetch_months(config, server.months, cache_manager, email_parser)
+            elapsed = time.perf_counter() - started
+            messages = sum(
+                len(mailbox_state["messages"]) for state in states.values() for mailbox_state in state["mailboxes"].values()
+            )
+            trips = sum(len(cache_manager.collect_trips(state)) for state in states.values())
+            if hasattr(cache_manager, "close"):
+                cache_manager.close()
+    first_trip = cache_manager.first_trip - started if cache_manager.first_trip is not None else None
+    return {
+        "seconds": elapsed,
+        "total": server.total,
+        "months": server.months,
+        "messages": messages,
+        "trips": trips,
+        "first_trip_seconds": first_trip,
+        "bytes_sent": server.stats["bytes_sent"],
+        "dropped": server.stats["dropped"]
+    }
+
+
+def run_load(args, certfile, keyfile):
+    """Замеры для каждого сочетания режима загрузки и размера пула: список словарей с результатами."""
+    results = []
+    for fetch_mode in [mode.strip() for mode in args.fetch_modes.split(",") if mode.strip()]:
+        for pool_size in [int(size) for size in args.pool_sizes.split(",") if size.strip()]:
+            runs = [measure_fetch(args, certfile, keyfile, pool_size, fetch_mode) for _ in range(max(1, args.repeat))]
+            if None in runs:
+                return None
+            best = min(runs, key=lambda run: run["seconds"])
+            total = best["total"]
+            item = {
+                "name": f"fetch[{fetch_mode},pool={pool_size}]",
+                "size": total,
+                "seconds": round(best["seconds"], 6),
+                "messages_per_second": round(best["messages"] / best["seconds"], 1),
+                "first_trip_seconds": round(best["first_trip_seconds"], 6) if best["first_trip_seconds"] is not None else None,
+                "messages": best["messages"],
+                "trips": best["trips"],
+                "bytes_sent": best["bytes_sent"],
+                "dropped": best["dropped"]
+            }
+            results.append(item)
+            first_trip = f"{item['first_trip_seconds']:.3f} с" if item["first_trip_seconds"] is not None else "-"
+            print(
+                f"{item['name']}: {item['seconds']:.3f} с, {item['messages_per_second']} писем/с, "
+                f"первая поездка через {first_trip}, писем {item['messages']} из {total}, "
+                f"поездок {item['trips']}, обрывов {item['dropped']}"
+            )
+            if best["messages"] < total:
+                logging.warning(f"{item['name']}: обработано писем {best['messages']} из {total}")
+    return results
+
+
+def serve(args, mailboxes, certfile, keyfile):
+    """Работа локального сервера до Ctrl+C; с --deliver-interval - добавление новых писем в первую папку."""
+    server = start_server(args, mailboxes, certfile, keyfile, args.port)
+    print(
+        f"IMAP_SERVER=127.0.0.1 IMAP_PORT={server.port} EMAIL={server.user} PASSWORD={server.password} "
+        f"SEARCH_FOLDERS='[{', '.join(json.dumps(name) for name in mailboxes)}]'"
+    )
+    rng = random.Random(args.seed)
+    first_mailbox = next(iter(mailboxes))
+    try:
+        while True:
+            time.sleep(args.deliver_interval or 3600)
+            if args.deliver_interval:
+                started = datetime.now().replace(second=0, microsecond=0)
+                message = server.deliver(first_mailbox, generate_email(rng, started))
+                logging.info(f"Новое письмо в папке {first_mailbox}: UID {message.uid}")
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Замеры загрузки писем на локальном IMAP-сервере')
+    parser.add_argument('--messages', type=int, default=2000, help='Количество синтетических писем')
+    parser.add_argument('--month', type=str, default='2024-05', help='Месяц синтетических писем в формате YYYY-MM')
+    parser.add_argument('--seed', type=int, default=0, help='Начальное значение генератора писем и обрывов')
+    parser.add_argument('--folders', type=str, default='Taxi', help='Папки с письмами через запятую')
+    parser.add_argument('--duplicates', type=float, default=0.0,
+                        help='Доля писем, скопированных в следующую папку с тем же Message-ID')
+    parser.add_argument('--mirror', type=str, default=None, help='Директория локальной копии писем вместо синтетических')
+    parser.add_argument('--latency', type=float, default=0.0, help='Задержка ответа на каждую команду, мс')
+    parser.add_argument('--bandwidth', type=float, default=0.0, help='Скорость отправки в каждой сессии, КБ/с (0 - без ограничения)')
+    parser.add_argument('--drop-rate', type=float, default=0.0,
+                        help='Вероятность обрыва соединения при загрузке содержимого писем')
+    parser.add_argument('--no-bodystructure', action='store_true', help='Сервер не отдаёт BODYSTRUCTURE')
+    parser.add_argument('--no-idle', action='store_true', help='Сервер не поддерживает IDLE')
+    parser.add_argument('--pool-sizes', type=str, default='1,4', help='Размеры пула IMAP-сессий через запятую')
+    parser.add_argument('--fetch-modes', type=str, default='html', help='Режимы загрузки через запятую (html, full)')
+    parser.add_argument('--cache-backend', type=str, default='json', help='Способ хранения кеша')
+    parser.add_argument('--repeat', type=int, default=1, help='Количество повторов замера (берётся лучший)')
+    parser.add_argument('--output', type=str, default=None, help='Файл JSON для сохранения результатов')
+    parser.add_argument('--compare', type=str, default=None, help='Файл JSON с результатами для сравнения')
+    parser.add_argument('--threshold', type=float, default=10.0,
+                        help='Допустимое замедление в процентах при сравнении')
+    parser.add_argument('--serve', action='store_true',
+                        help='Только запустить локальный сервер (для проверки --watch и --serve main.py)')
+    parser.add_argument('--port', type=int, default=9993, help='Порт сервера в режиме --serve')
+    parser.add_argument('--deliver-interval', type=float, default=0.0,
+                        help='В режиме --serve: добавлять новое письмо каждые столько секунд')
+    parser.add_argument('--cert-dir', type=str, default=None,
+                        help='Директория сертификата TLS (по умолчанию временная)')
+    parser.add_argument('--verbose', action='store_true', help='Подробный лог загрузки')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO if args.verbose or args.serve else logging.WARNING,
+                        format='%(asctime)s [%(levelname)s] %(message)s')
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        certfile, keyfile = create_certificate(args.cert_dir or temp_dir)
+        if args.serve:
+            serve(args, build_mailboxes(args), certfile, keyfile)
+            return 0
+        results = run_load(args, certfile, keyfile)
+    if results is None:
+        return 1
+
+    data = {
+        "created_at": datetime.now().isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "seed": args.seed,
+        "repeat": args.repeat,
+        "latency_ms": args.latency,
+        "bandwidth_kbps": args.bandwidth,
+        "drop_rate": args.drop_rate,
+        "results": results
+    }
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+        logging.info(f"Результаты сохранены в {args.output}")
+
+    if args.compare:
+        if not os.path.exists(args.compare):
+            logging.error(f"Файл для сравнения {args.compare} не найден")
+            return 1
+        regressions = compare(results, args.compare, args.threshold)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
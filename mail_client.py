@@ -1,89 +1,153 @@
 # mail_client.py - Работа с почтой
 import imaplib
 import email
+import email.header
 import logging
+import re
+import time
 from contextlib import contextmanager
 from datetime import datetime, timedelta
+import metrics
+from imap_response import build_message_set, parse_fetch_response, find_html_section, decode_section
+from mail_mirror import MailMirror
+
+# Размер пакета FETCH по умолчанию
+DEFAULT_BATCH_SIZE = 200
+
+# Заголовки, загружаемые на этапе предварительного отбора писем
+PRESCREEN_HEADERS = "FROM SUBJECT DATE MESSAGE-ID"
+
+# Дата получения письма сервером: "14-May-2024 09:12:00 +0300"
+INTERNALDATE_RE = re.compile(r'(\d{1,2})-([A-Za-z]{3})-(\d{4})')
+MONTH_ABBREVIATIONS = ("Jan", "Feb", "Mar", "Apr", "May", "Jun", "Jul", "Aug", "Sep", "Oct", "Nov", "Dec")
 
 class EmailClient:
     """Класс для работы с почтой."""
     
-    def __init__(self, config):
-        """Инициализация клиента."""
+    def __init__(self, config, mailbox=None):
+        """Инициализация клиента; mailbox - папка с письмами (по умолчанию определяется при подключении)."""
         self.config = config
+        # Папка с письмами; определяется один раз при первом подключении
+        self.mailbox = mailbox
+        # Заданная папка не заменяется на INBOX, если её не удалось выбрать
+        self.fixed_mailbox = mailbox is not None
+        # UIDVALIDITY выбранной папки (смена значения делает UID недействительными)
+        self.uidvalidity = None
+        # Локальная копия загруженных писем для повторного разбора без подключения
+        self.mirror = MailMirror(config.get("MIRROR_DIR") or "mirror") if config.get("MIRROR_ENABLED") else None
+    
+    def login(self):
+        """Подключение к серверу IMAP и авторизация."""
+        with metrics.stage("imap.connect"):
+            mail = imaplib.IMAP4_SSL(self.config["IMAP_SERVER"], self.config.get("IMAP_PORT") or imaplib.IMAP4_SSL_PORT)
+            mail.login(self.config["EMAIL"], self.config["PASSWORD"])
+        return mail
+    
+    def discover_mailbox(self, mail):
+        """Поиск папки, содержащей "taxi" или "такси"; при отсутствии - MAILBOX_PATH."""
+        status, mailboxes = mail.list()
+        if status != 'OK':
+            logging.error("Не удалось получить список папок.")
+            return None
+        
+        # Ищем папку, содержащую "taxi" или "такси"
+        target_mailbox = None
+        for mailbox in mailboxes:
+            mailbox_name = mailbox.decode('utf-8', errors='ignore')
+            if "taxi" in mailbox_name.lower() or "такси" in mailbox_name.lower():
+                # Извлекаем имя папки
+                parts = mailbox_name.split(' "')
+                if len(parts) > 1:
+                    target_mailbox = parts[-1].strip('"')
+                    break
+        
+        # Если не нашли специальную папку, используем INBOX
+        if not target_mailbox:
+            target_mailbox = self.config["MAILBOX_PATH"]
+        return target_mailbox
+    
+    def select_mailbox(self, mail, target_mailbox, fallback=True):
+        """Выбор папки; при ошибке пробуем INBOX (если fallback). Возвращает имя выбранной папки."""
+        status, data = mail.select(target_mailbox)
+        if status != 'OK' and not fallback:
+            logging.error(f"Не удалось выбрать папку {target_mailbox}")
+            return None
+        if status != 'OK':
+            logging.warning(f"Не удалось выбрать папку {target_mailbox}, пробуем INBOX")
+            status, data = mail.select("INBOX")
+            if status != 'OK':
+                logging.error("Не удалось выбрать папку INBOX")
+                return None
+            logging.info("Успешно подключено к папке: INBOX")
+            return "INBOX"
+        logging.info(f"Успешно подключено к папке: {target_mailbox}")
+        return target_mailbox
     
     def connect(self):
         """Подключение к почтовому серверу."""
         try:
             logging.info("Подключение к серверу IMAP...")
-            mail = imaplib.IMAP4_SSL(self.config["IMAP_SERVER"])
-            mail.login(self.config["EMAIL"], self.config["PASSWORD"])
-            
-            # Получаем список папок
-            status, mailboxes = mail.list()
-            if status != 'OK':
-                logging.error("Не удалось получить список папок.")
-                return None
+            mail = self.login()
             
-            # Ищем папку, содержащую "taxi" или "такси"
-            target_mailbox = None
-            for mailbox in mailboxes:
-                mailbox_name = mailbox.decode('utf-8', errors='ignore')
-                if "taxi" in mailbox_name.lower() or "такси" in mailbox_name.lower():
-                    # Извлекаем имя папки
-                    parts = mailbox_name.split(' "')
-                    if len(parts) > 1:
-                        target_mailbox = parts[-1].strip('"')
-                        break
-            
-            # Если не нашли специальную папку, используем INBOX
-            if not target_mailbox:
-                target_mailbox = self.config["MAILBOX_PATH"]
+            # Список папок запрашиваем только при первом подключении
+            if self.mailbox is None:
+                self.mailbox = self.discover_mailbox(mail)
+                if self.mailbox is None:
+                    return None
             
             # Выбираем папку
-            status, data = mail.select(target_mailbox)
-            if status != 'OK':
-                logging.warning(f"Не удалось выбрать папку {target_mailbox}, пробуем INBOX")
-                status, data = mail.select("INBOX")
-                if status != 'OK':
-                    logging.error("Не удалось выбрать папку INBOX")
-                    return None
-                logging.info("Успешно подключено к папке: INBOX")
-            else:
-                logging.info(f"Успешно подключено к папке: {target_mailbox}")
+            selected = self.select_mailbox(mail, self.mailbox, fallback=not self.fixed_mailbox)
+            if selected is None:
+                return None
+            self.mailbox = selected
+            
+            status, data = mail.response('UIDVALIDITY')
+            if data and data[0]:
+                self.uidvalidity = int(data[0])
             
             return mail
         except Exception as e:
             logging.error(f"Ошибка при подключении к почте: {e}")
             return None
     
-    def calculate_date_range(self, month):
-        """Вычисление диапазона дат для поиска."""
+    def calculate_date_range(self, month, last_month=None):
+        """Вычисление диапазона дат для поиска (от начала month до конца last_month)."""
         start_date = datetime.strptime(month, "%Y-%m")
-        end_date = (start_date.replace(day=28) + timedelta(days=4)).replace(day=1)
+        last_date = datetime.strptime(last_month or month, "%Y-%m")
+        end_date = (last_date.replace(day=28) + timedelta(days=4)).replace(day=1)
         logging.debug(f"Диапазон дат: {start_date.strftime('%d-%b-%Y')} - {end_date.strftime('%d-%b-%Y')}")
         return start_date.strftime("%d-%b-%Y"), end_date.strftime("%d-%b-%Y")
     
-    def fetch_emails(self, mail, month):
-        """Поиск и загрузка писем."""
+    def fetch_emails(self, mail, month, min_uid=None, last_month=None):
+        """Поиск писем за месяц (или за месяцы с month по last_month).
+        
+        Возвращает список UID; при min_uid - только UID не меньше него.
+        """
         try:
-            start_date, end_date = self.calculate_date_range(month)
+            start_date, end_date = self.calculate_date_range(month, last_month)
             
             # Используем запрос только по дате
             query = f'SINCE {start_date} BEFORE {end_date}'
+            if min_uid:
+                query += f' UID {min_uid}:*'
             logging.debug(f"IMAP-запрос: {query}")
             
-            status, messages = mail.search(None, query)
+            with metrics.stage("imap.search"):
+                status, messages = mail.uid('SEARCH', None, query)
             if status != 'OK':
                 logging.warning("Не удалось выполнить поиск писем.")
                 return []
             
             email_ids = messages[0].split()
+            if min_uid:
+                # Диапазон n:* всегда включает последнее письмо папки, даже если его UID меньше n
+                email_ids = [email_id for email_id in email_ids if int(email_id) >= min_uid]
             if not email_ids:
                 logging.info("Писем за указанный период не найдено.")
                 return []
             
-            logging.info(f"Найдено писем за месяц: {len(email_ids)}")
+            logging.info(f"Найдено писем за период: {len(email_ids)}")
+            metrics.count("messages.searched", len(email_ids))
             return email_ids
         except Exception as e:
             logging.error(f"Ошибка при поиске писем: {e}")
@@ -91,16 +155,223 @@ class EmailClient:
     
     def extract_html_from_email(self, email_data):
         """Извлечение HTML-содержимого письма."""
-        try:
-            msg = email.message_from_bytes(email_data)
-            if msg.is_multipart():
-                for part in msg.walk():
-                    if part.get_content_type() == 'text/html':
-                        html_content = part.get_payload(decode=True).decode()
-                        return html_content
-            elif msg.get_content_type() == 'text/html':
-                html_content = msg.get_payload(decode=True).decode()
-                return html_content
-        except Exception as e:
-            logging.error(f"Ошибка при извлечении HTML: {e}")
-        return None 
\ No newline at end of file
+        with metrics.stage("mime.decode"):
+            try:
+                msg = email.message_from_bytes(email_data)
+                if msg.is_multipart():
+                    for part in msg.walk():
+                        if part.get_content_type() == 'text/html':
+                            html_content = part.get_payload(decode=True).decode()
+                            return html_content
+                elif msg.get_content_type() == 'text/html':
+                    html_content = msg.get_payload(decode=True).decode()
+                    return html_content
+            except Exception as e:
+                logging.error(f"Ошибка при извлечении HTML: {e}")
+            return None
+    
+    def _store_in_mirror(self, email_id, kind, content):
+        """Сохранение загруженного письма в локальную копию, если она включена."""
+        if self.mirror is not None:
+            self.mirror.store(self.mailbox, self.uidvalidity, email_id.decode(), kind, content)
+    
+    def load_from_mirror(self, mailbox, uidvalidity, uid):
+        """HTML письма из локальной копии; None, если письма в копии нет.
+        
+        Для писем, сохранённых целиком, HTML заново извлекается extract_html_from_email.
+        """
+        if self.mirror is None:
+            return None
+        found = self.mirror.load(mailbox, uidvalidity, uid)
+        if found is None:
+            return None
+        kind, content = found
+        return self.extract_html_from_email(content) if kind == "eml" else content
+    
+    def _fetch_items(self, mail, email_ids, query, batch_size=None):
+        """Пакетный UID FETCH: генератор пар (uid, словарь атрибутов ответа).
+        
+        UID отправляются на сервер наборами по batch_size штук
+        (например '1:200'), что заменяет отдельный FETCH на каждое письмо.
+        Для каждого пакета в лог пишется время ответа и объём данных.
+        """
+        batch_size = batch_size or self.config.get("FETCH_BATCH_SIZE") or DEFAULT_BATCH_SIZE
+        total_batches = (len(email_ids) + batch_size - 1) // batch_size
+        
+        for batch_num, offset in enumerate(range(0, len(email_ids), batch_size), start=1):
+            batch = email_ids[offset:offset + batch_size]
+            message_set = build_message_set(batch)
+            
+            started = time.perf_counter()
+            try:
+                status, data = mail.uid('FETCH', message_set, query)
+            except (imaplib.IMAP4.abort, OSError):
+                # Обрыв сессии обрабатывается вызывающим кодом (переподключение)
+                raise
+            except Exception as e:
+                logging.error(f"Ошибка при загрузке пакета {batch_num}/{total_batches}: {e}")
+                continue
+            elapsed = time.perf_counter() - started
+            
+            if status != 'OK':
+                logging.warning(f"Не удалось загрузить пакет {batch_num}/{total_batches} ({message_set})")
+                continue
+            
+            batch_bytes = sum(len(item[1]) for item in data if isinstance(item, tuple))
+            batch_bytes += sum(len(item) for item in data if isinstance(item, bytes))
+            # В ответе на UID FETCH сервер всегда возвращает атрибут UID
+            messages = [(attrs["UID"], attrs) for _, attrs in parse_fetch_response(data) if attrs.get("UID")]
+            logging.info(
+                f"Пакет {query} {batch_num}/{total_batches}: писем {len(messages)}, "
+                f"{batch_bytes} байт, {elapsed:.2f} с"
+            )
+            metrics.record_time("imap.fetch", elapsed)
+            metrics.add_bytes("imap.fetch", batch_bytes)
+            
+            yield from messages
+    
+    def fetch_batched(self, mail, email_ids, batch_size=None):
+        """Пакетная загрузка писем целиком: генератор пар (id, raw_bytes)."""
+        for email_id, attrs in self._fetch_items(mail, email_ids, '(RFC822)', batch_size):
+            email_data = attrs.get("RFC822")
+            if isinstance(email_data, bytes):
+                yield email_id, email_data
+    
+    def fetch_html_parts(self, mail, email_ids, batch_size=None):
+        """Загрузка только HTML-части писем: генератор пар (id, html).
+        
+        Сначала запрашивается BODYSTRUCTURE, по нему определяется номер
+        секции text/html, затем загружается только BODY.PEEK[<секция>]
+        и декодируется по объявленной кодировке передачи и charset.
+        Письма, для которых HTML-часть не найдена или не загрузилась,
+        загружаются целиком через RFC822.
+        """
+        batch_size = batch_size or self.config.get("FETCH_BATCH_SIZE") or DEFAULT_BATCH_SIZE
+        
+        for offset in range(0, len(email_ids), batch_size):
+            batch = email_ids[offset:offset + batch_size]
+            
+            # Номер HTML-секции для каждого письма пакета
+            sections = {}
+            for email_id, attrs in self._fetch_items(mail, batch, '(BODYSTRUCTURE)', batch_size):
+                found = find_html_section(attrs.get("BODYSTRUCTURE"))
+                if found:
+                    sections[email_id] = found
+            
+            # Загрузка секций, сгруппированных по номеру
+            by_section = {}
+            for email_id, found in sections.items():
+                by_section.setdefault(found[0], []).append(email_id)
+            
+            html_by_id = {}
+            for section, section_ids in by_section.items():
+                query = f'(BODY.PEEK[{section}])'
+                for email_id, attrs in self._fetch_items(mail, section_ids, query, batch_size):
+                    payload = attrs.get(f"BODY[{section}]")
+                    if not isinstance(payload, bytes) or email_id not in sections:
+                        continue
+                    _, encoding, charset = sections[email_id]
+                    try:
+                        with metrics.stage("mime.decode"):
+                            html_by_id[email_id] = decode_section(payload, encoding, charset)
+                        self._store_in_mirror(email_id, "html", html_by_id[email_id])
+                    except Exception as e:
+                        logging.warning(f"Не удалось декодировать HTML-часть письма {email_id.decode()}: {e}")
+            
+            # Запасной путь: загрузка письма целиком
+            fallback_ids = [email_id for email_id in batch if email_id not in html_by_id]
+            if fallback_ids:
+                logging.debug(f"Писем без HTML-части в BODYSTRUCTURE: {len(fallback_ids)}, загружаем целиком")
+                for email_id, email_data in self.fetch_batched(mail, fallback_ids, batch_size):
+                    self._store_in_mirror(email_id, "eml", email_data)
+                    html_by_id[email_id] = self.extract_html_from_email(email_data)
+            
+            for email_id in batch:
+                if email_id in html_by_id:
+                    yield email_id, html_by_id[email_id]
+    
+    def fetch_html(self, mail, email_ids, batch_size=None):
+        """Загрузка HTML-содержимого писем в режиме FETCH_MODE: генератор пар (id, html)."""
+        if self.config.get("FETCH_MODE", "html") == "full":
+            for email_id, email_data in self.fetch_batched(mail, email_ids, batch_size):
+                self._store_in_mirror(email_id, "eml", email_data)
+                yield email_id, self.extract_html_from_email(email_data)
+        else:
+            yield from self.fetch_html_parts(mail, email_ids, batch_size)
+    
+    def fetch_headers(self, mail, email_ids, batch_size=None):
+        """Загрузка заголовков From, Subject, Date, Message-ID: генератор пар (uid, словарь заголовков)."""
+        query = f'(BODY.PEEK[HEADER.FIELDS ({PRESCREEN_HEADERS})])'
+        key = f"BODY[HEADER.FIELDS ({PRESCREEN_HEADERS})]"
+        for email_id, attrs in self._fetch_items(mail, email_ids, query, batch_size):
+            header_data = attrs.get(key)
+            if not isinstance(header_data, bytes):
+                continue
+            msg = email.message_from_bytes(header_data)
+            headers = {}
+            for name in ("From", "Subject", "Date", "Message-ID"):
+                value = msg.get(name, "")
+                try:
+                    value = str(email.header.make_header(email.header.decode_header(value)))
+                except Exception:
+                    value = str(value)
+                headers[name] = value.strip()
+            yield email_id, headers
+    
+    def prescreen_emails(self, mail, email_ids, batch_size=None, message_ids=None):
+        """Предварительный отбор писем по отправителю и теме: пара списков (прошедшие, отсеянные).
+        
+        Загружаются только заголовки писем; дальше проходят письма, у которых
+        отправитель содержит один из SENDER_PATTERNS и тема - один из
+        SUBJECT_PATTERNS (пустой список шаблонов не ограничивает отбор).
+        Отсеянными считаются только письма, заголовки которых получены;
+        письма, заголовки которых не загрузились, не входят ни в один список
+        и должны быть обработаны при следующем запуске.
+        Если передан словарь message_ids, в него записываются Message-ID
+        прошедших писем (заголовки загружаются и без шаблонов).
+        """
+        sender_patterns = [p.lower() for p in self.config.get("SENDER_PATTERNS", [])]
+        subject_patterns = [p.lower() for p in self.config.get("SUBJECT_PATTERNS", [])]
+        if not email_ids or (not sender_patterns and not subject_patterns and message_ids is None):
+            return email_ids, []
+        
+        matched = []
+        rejected = []
+        for email_id, headers in self.fetch_headers(mail, email_ids, batch_size):
+            sender = headers["From"].lower()
+            subject = headers["Subject"].lower()
+            if sender_patterns and not any(p in sender for p in sender_patterns):
+                logging.debug(f"Письмо {email_id.decode()} отсеяно по отправителю: {headers['From']}")
+                rejected.append(email_id)
+                continue
+            if subject_patterns and not any(p in subject for p in subject_patterns):
+                logging.debug(f"Письмо {email_id.decode()} отсеяно по теме: {headers['Subject']}")
+                rejected.append(email_id)
+                continue
+            matched.append(email_id)
+            if message_ids is not None and headers["Message-ID"]:
+                message_ids[email_id] = headers["Message-ID"]
+        
+        if not sender_patterns and not subject_patterns:
+            # Заголовки загружены только ради Message-ID: письма не отсеиваются
+            return email_ids, []
+        
+        unfetched = len(email_ids) - len(matched) - len(rejected)
+        logging.info(f"Предварительный отбор по заголовкам: прошло {len(matched)}, отсеяно {len(rejected)}")
+        if unfetched:
+            logging.warning(f"Не удалось загрузить заголовки писем: {unfetched}, они будут загружены при следующем запуске")
+        metrics.count("messages.prescreen_rejected", len(rejected))
+        return matched, rejected
+    
+    def fetch_internal_months(self, mail, email_ids, batch_size=None):
+        """Месяц получения писем по INTERNALDATE: словарь {uid: 'YYYY-MM'}."""
+        months = {}
+        for email_id, attrs in self._fetch_items(mail, email_ids, '(INTERNALDATE)', batch_size):
+            value = attrs.get("INTERNALDATE")
+            match = INTERNALDATE_RE.search(value.decode('ascii', errors='ignore')) if isinstance(value, bytes) else None
+            if not match or match.group(2).title() not in MONTH_ABBREVIATIONS:
+                logging.warning(f"Не удалось определить дату письма {email_id.decode()}: {value}")
+                continue
+            month_num = MONTH_ABBREVIATIONS.index(match.group(2).title()) + 1
+            months[email_id] = f"{match.group(3)}-{month_num:02d}"
+        return months
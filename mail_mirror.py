@@ -0,0 +1,64 @@
+# mail_mirror.py - Локальная сжатая копия загруженных писем
+import os
+import re
+import gzip
+import logging
+
+# Виды сохраняемого содержимого: HTML-часть письма или письмо целиком (RFC822)
+MIRROR_KINDS = ("html", "eml")
+
+
+class MailMirror:
+    """Копия загруженных писем на диске для повторного разбора без обращения к почте.
+
+    Каждое письмо хранится отдельным файлом gzip по ключу (папка,
+    UIDVALIDITY, UID): mirror/<папка>/<UIDVALIDITY>/<UID // 1000>/<UID>.<вид>.gz.
+    При смене UIDVALIDITY старая копия папки просто перестаёт использоваться.
+    """
+
+    def __init__(self, root="mirror", compresslevel=6):
+        """Инициализация копии в директории root."""
+        self.root = root
+        self.compresslevel = compresslevel
+
+    def _directory(self, mailbox, uidvalidity, uid):
+        safe_mailbox = re.sub(r'[^\w.-]', '_', mailbox or "INBOX")
+        return os.path.join(self.root, safe_mailbox, str(uidvalidity), str(int(uid) // 1000))
+
+    def _path(self, mailbox, uidvalidity, uid, kind):
+        return os.path.join(self._directory(mailbox, uidvalidity, uid), f"{int(uid)}.{kind}.gz")
+
+    def store(self, mailbox, uidvalidity, uid, kind, content):
+        """Сохранение содержимого письма (str для html, bytes для eml)."""
+        if content is None:
+            return
+        if isinstance(content, str):
+            content = content.encode('utf-8')
+        path = self._path(mailbox, uidvalidity, uid, kind)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Запись через временный файл, чтобы оборванная запись не оставила повреждённый файл
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            with gzip.open(tmp_path, 'wb', compresslevel=self.compresslevel) as f:
+                f.write(content)
+            os.replace(tmp_path, path)
+        except Exception as e:
+            logging.error(f"Ошибка при сохранении письма {uid} в локальную копию: {e}")
+
+    def load(self, mailbox, uidvalidity, uid):
+        """Содержимое письма: пара (вид, данные) или None, если письма нет в копии.
+
+        HTML-часть возвращается строкой, письмо целиком - байтами.
+        """
+        for kind in MIRROR_KINDS:
+            path = self._path(mailbox, uidvalidity, uid, kind)
+            if not os.path.exists(path):
+                continue
+            try:
+                with gzip.open(path, 'rb') as f:
+                    content = f.read()
+            except Exception as e:
+                logging.error(f"Ошибка при чтении письма {uid} из локальной копии: {e}")
+                return None
+            return kind, content.decode('utf-8') if kind == "html" else content
+        return None
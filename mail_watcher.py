@@ -0,0 +1,312 @@
+# mail_watcher.py - Наблюдение за папкой с чеками и обработка писем по мере поступления
+import imaplib
+import logging
+import select
+import ssl
+import threading
+import time
+from datetime import datetime
+
+import metrics
+from cache_manager import month_end
+
+# Начальная пауза перед повторным подключением, с; удваивается до WATCH_BACKOFF_MAX
+BACKOFF_MIN = 5
+
+
+def previous_month(month):
+    """Месяц перед month в формате YYYY-MM."""
+    year, month_num = map(int, month.split('-'))
+    year, month_num = (year - 1, 12) if month_num == 1 else (year, month_num - 1)
+    return f"{year:04d}-{month_num:02d}"
+
+
+class MailWatcher:
+    """Долгоживущая сессия IMAP, которая дописывает новые письма в кеш месяца.
+
+    Новые письма ожидаются командой IDLE, а если сервер её не поддерживает -
+    периодическим NOOP. Каждое новое письмо сразу загружается, разбирается
+    и дописывается в журнал кеша своего месяца (по INTERNALDATE), поэтому
+    отчёт за прошедший месяц строится из кеша без обращения к почте.
+    При обрыве соединения сессия открывается заново с нарастающей паузой.
+    """
+
+    def __init__(self, email_client, cache_manager, email_parser, catch_up, config):
+        """Инициализация.
+
+        catch_up(months) - обработка всех писем месяцев обычной загрузкой
+        (как при запуске main.py); возвращает словарь {месяц: состояние кеша}.
+        """
+        self.email_client = email_client
+        self.cache_manager = cache_manager
+        self.email_parser = email_parser
+        self.catch_up = catch_up
+        self.poll_interval = max(1, config.get("WATCH_POLL_INTERVAL", 60))
+        # Сервер может закрыть сессию после 30 минут IDLE (RFC 2177), поэтому IDLE периодически перезапускается
+        self.idle_timeout = max(1, config.get("WATCH_IDLE_TIMEOUT", 300))
+        self.backoff_max = max(BACKOFF_MIN, config.get("WATCH_BACKOFF_MAX", 300))
+        self.use_idle = config.get("WATCH_IDLE", True)
+        self.backoff = BACKOFF_MIN
+        # Последний UID, до которого включительно обработаны все письма папки
+        self.last_uid = None
+        self.uidvalidity = None
+        # Последний месяц, отмеченный в кеше как полный
+        self._closed_month = None
+        # Месяцы необработанных писем последней проверки (None - месяц письма не определён)
+        self._pending_months = set()
+        self._stop = threading.Event()
+
+    def stop(self):
+        """Остановка наблюдения (из другого потока или обработчика сигнала)."""
+        self._stop.set()
+
+    def _search_last_uid(self, mail):
+        """UID последнего письма папки; 0 для пустой папки."""
+        status, data = mail.uid('SEARCH', None, 'UID *')
+        if status != 'OK':
+            raise imaplib.IMAP4.error("Не удалось получить UID последнего письма")
+        uids = [int(uid) for uid in data[0].split()] if data and data[0] else []
+        return max(uids, default=0)
+
+    def _start(self, mail):
+        """Дозагрузка писем прошлого и текущего месяца и начальная граница UID."""
+        highest = self._search_last_uid(mail)
+        current = datetime.now().strftime("%Y-%m")
+        states = self.catch_up([previous_month(current), current])
+
+        # Наблюдение продолжается с меньшей из границ месяцев: письма, которые
+        # не удалось обработать при дозагрузке, будут обработаны повторно
+        mailbox = self.email_client.mailbox
+        boundaries = [
+            state["mailboxes"][mailbox]["last_uid"] for state in states.values()
+            if state["mailboxes"].get(mailbox, {}).get("uidvalidity") == self.email_client.uidvalidity
+            and state["mailboxes"][mailbox]["last_uid"]
+        ]
+        self.last_uid = min(boundaries) if boundaries else highest
+        self.uidvalidity = self.email_client.uidvalidity
+        logging.info(f"Наблюдение за папкой {mailbox} с UID {self.last_uid + 1}")
+
+    def sync(self, mail):
+        """Обработка писем с UID больше last_uid; возвращает число новых писем."""
+        sync_started = datetime.now()
+        status, data = mail.uid('SEARCH', None, f'UID {self.last_uid + 1}:*')
+        if status != 'OK':
+            raise imaplib.IMAP4.error("Не удалось выполнить поиск новых писем")
+        # Диапазон n:* всегда включает последнее письмо папки, даже если его UID меньше n
+        uids = [uid for uid in (data[0].split() if data and data[0] else []) if int(uid) > self.last_uid]
+
+        processed_count = 0
+        self._pending_months = set()
+        if uids:
+            processed_count = self._process(mail, uids, sync_started)
+        self._close_previous_month(sync_started)
+        return processed_count
+
+    def _process(self, mail, uids, sync_started):
+        """Загрузка, разбор и запись в кеш писем uids."""
+        mailbox = self.email_client.mailbox
+        email_months = self.email_client.fetch_internal_months(mail, uids)
+
+        # Письма, месяц которых не удалось определить, не относятся ни к одному
+        # месяцу и загружаются при следующей проверке
+        undated_ids = [uid for uid in uids if uid not in email_months]
+        if undated_ids:
+            logging.warning(f"Не удалось определить месяц писем: {len(undated_ids)}, повтор при следующей проверке")
+
+        states = {}
+        mailbox_states = {}
+        new_ids = []
+        for uid in uids:
+            month = email_months.get(uid)
+            if month is None:
+                continue
+            if month not in states:
+                states[month] = self.cache_manager.load_state(month)
+                mailbox_states[month] = self.cache_manager.get_mailbox_state(states[month], mailbox, self.uidvalidity)
+            if uid.decode() not in mailbox_states[month]["messages"]:
+                new_ids.append(uid)
+
+        done = set()
+        try:
+            # Письма, заголовки которых не загрузились, не отсеиваются и остаются необработанными
+            screened_ids, rejected_ids = self.email_client.prescreen_emails(mail, new_ids)
+            for uid in rejected_ids:
+                month = email_months[uid]
+                self.cache_manager.append_message(month, mailbox, mailbox_states[month], uid.decode(), None)
+                done.add(uid)
+
+            for uid, html_content in self.email_client.fetch_html(mail, screened_ids):
+                trip = self.email_parser.extract_trip(html_content) if html_content else None
+                month = email_months[uid]
+                self.cache_manager.append_message(month, mailbox, mailbox_states[month], uid.decode(), trip)
+                done.add(uid)
+                if trip is not None:
+                    logging.info(f"Новая поездка ({month}): {trip}")
+        finally:
+            for month in states:
+                self.cache_manager.close_journal(month)
+
+        # Граница UID сдвигается только до первого необработанного письма
+        pending_ids = undated_ids + [uid for uid in new_ids if uid not in done]
+        pending = [int(uid) for uid in pending_ids]
+        if len(pending) > len(undated_ids):
+            logging.warning(f"Не удалось обработать писем: {len(pending) - len(undated_ids)}, повтор при следующей проверке")
+        self.last_uid = min(pending) - 1 if pending else max(int(uid) for uid in uids)
+        self._pending_months = {email_months.get(uid) for uid in pending_ids}
+
+        for month, state in states.items():
+            month_uids = [int(uid) for uid in uids if email_months.get(uid) == month]
+            # Письмо без месяца может относиться к любому месяцу, поэтому задерживает границу каждого
+            month_pending = [int(uid) for uid in pending_ids if email_months.get(uid, month) == month]
+            mailbox_state = mailbox_states[month]
+            last_uid = min(month_pending) - 1 if month_pending else max(month_uids)
+            mailbox_state["last_uid"] = max(mailbox_state["last_uid"], last_uid)
+            self.cache_manager.save_state(month, state)
+
+        logging.info(f"Обработано новых писем: {len(done)}")
+        metrics.count("watch.messages", len(done))
+        return len(done)
+
+    def _close_previous_month(self, sync_started):
+        """Отметка прошлого месяца как полного после первой проверки в новом месяце.
+
+        Наблюдение ведётся за одной папкой, а чеки могут попадать и в другие
+        папки SEARCH_FOLDERS, поэтому перед закрытием месяц дозагружается
+        обычной загрузкой (catch_up) во всех папках; полным его отмечает она,
+        если все папки просмотрены и все письма месяца обработаны. Иначе, как
+        и пока среди необработанных писем наблюдаемой папки есть письма этого
+        месяца или письма, месяц которых не определён, месяц остаётся открытым
+        до следующих проверок.
+        """
+        month = previous_month(sync_started.strftime("%Y-%m"))
+        if month == self._closed_month or sync_started < month_end(month):
+            return
+        if month in self._pending_months or None in self._pending_months:
+            logging.info(f"Месяц {month} не отмечен как полный: есть необработанные письма")
+            return
+        if not self.cache_manager.is_complete(month):
+            state = self.catch_up([month])[month]
+            if not state.get("complete"):
+                logging.warning(f"Месяц {month} не отмечен как полный: не все письма загружены, повтор при следующей проверке")
+                return
+            logging.info(f"Месяц {month} отмечен в кеше как полный")
+        self._closed_month = month
+
+    def _idle(self, mail):
+        """Ожидание изменений папки командой IDLE; True, если сервер сообщил о новых письмах.
+
+        Ожидание прерывается через idle_timeout секунд или по stop().
+        """
+        tag = mail._new_tag()
+        mail.send(tag + b' IDLE\r\n')
+        response = mail.readline()
+        if not response.startswith(b'+'):
+            mail.tagged_commands.pop(tag, None)
+            raise imaplib.IMAP4.error(f"Сервер отклонил IDLE: {response.strip().decode(errors='ignore')}")
+
+        changed = False
+        deadline = time.monotonic() + self.idle_timeout
+        try:
+            while not self._stop.is_set():
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                # select() видит только сокет: строки, уже прочитанные в буфер, разбираются без ожидания
+                if not self._has_buffered_data(mail):
+                    readable, _, _ = select.select([mail.sock], [], [], min(remaining, 1.0))
+                    if not readable:
+                        continue
+                line = mail.readline()
+                if not line or line.startswith(b'* BYE'):
+                    raise imaplib.IMAP4.abort("Сервер закрыл соединение")
+                if b'EXISTS' in line or b'RECENT' in line:
+                    changed = True
+                    break
+        finally:
+            # Завершение IDLE и ожидание ответа на команду
+            mail.send(b'DONE\r\n')
+            while True:
+                line = mail.readline()
+                if not line:
+                    raise imaplib.IMAP4.abort("Сервер закрыл соединение")
+                if line.startswith(tag):
+                    break
+            mail.tagged_commands.pop(tag, None)
+        return changed
+
+    @staticmethod
+    def _has_buffered_data(mail):
+        """Признак данных, уже полученных из сокета, но ещё не прочитанных.
+
+        imaplib читает ответы через буферизованный mail.file, а при TLS данные
+        могут лежать ещё и в буфере расшифрованных записей SSL: несколько строк
+        из одного пакета (например, EXPUNGE и EXISTS) после первого readline()
+        остаются в буфере, и select() по сокету их не видит. Буфер проверяется
+        peek() без блокировки: если он пуст, peek() читает только то, что уже
+        есть в сокете или в буфере SSL.
+        """
+        sock = mail.sock
+        if isinstance(sock, ssl.SSLSocket) and sock.pending():
+            return True
+        timeout = sock.gettimeout()
+        sock.setblocking(False)
+        try:
+            return bool(mail.file.peek(1))
+        except (BlockingIOError, ssl.SSLWantReadError):
+            return False
+        finally:
+            sock.settimeout(timeout)
+
+    def _wait(self, mail, use_idle):
+        """Ожидание новых писем: IDLE или пауза с NOOP. Возвращает признак использования IDLE."""
+        if use_idle:
+            try:
+                self._idle(mail)
+                return True
+            except imaplib.IMAP4.abort:
+                raise
+            except imaplib.IMAP4.error as e:
+                logging.warning(f"{e}; проверка новых писем каждые {self.poll_interval} с")
+                return False
+        if not self._stop.wait(self.poll_interval):
+            mail.noop()
+        return False
+
+    def _watch(self, mail):
+        """Цикл наблюдения на открытой сессии до stop() или обрыва соединения."""
+        if self.last_uid is None or self.email_client.uidvalidity != self.uidvalidity:
+            if self.last_uid is not None:
+                logging.info("UIDVALIDITY папки изменился, письма будут загружены заново")
+            self._start(mail)
+
+        use_idle = self.use_idle and "IDLE" in mail.capabilities
+        logging.info("Ожидание новых писем: " + ("IDLE" if use_idle else f"NOOP каждые {self.poll_interval} с"))
+        while not self._stop.is_set():
+            self.sync(mail)
+            self.backoff = BACKOFF_MIN
+            if self._stop.is_set():
+                break
+            use_idle = self._wait(mail, use_idle)
+
+    def run(self):
+        """Наблюдение за папкой до вызова stop() с переподключением при обрывах."""
+        while not self._stop.is_set():
+            mail = self.email_client.connect()
+            if mail is not None:
+                try:
+                    self._watch(mail)
+                except (imaplib.IMAP4.error, OSError) as e:
+                    logging.warning(f"Обрыв IMAP-сессии: {e}")
+                except Exception as e:
+                    logging.error(f"Ошибка при обработке новых писем: {e}")
+                finally:
+                    try:
+                        mail.logout()
+                    except Exception as e:
+                        logging.debug(f"Ошибка при закрытии IMAP-сессии: {e}")
+            if self._stop.is_set():
+                break
+            logging.info(f"Повторное подключение через {self.backoff} с")
+            self._stop.wait(self.backoff)
+            self.backoff = min(self.backoff * 2, self.backoff_max)
+        logging.info("Наблюдение за почтой остановлено")
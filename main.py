@@ -1,18 +1,466 @@
 # main.py - Точка входа
 import logging
-import os
+import sys
+import time
+import signal
+import threading
 import argparse
+from contextlib import nullcontext
+from functools import partial
+from datetime import datetime
 from config import setup_logging, load_config
-from mail_client import EmailClient
-from parser import EmailParser
+from parser import EmailParser, ParallelParser
+from prefilter import log_reject_rate
 from analytics import TripAnalytics
-from cache_manager import CacheManager
+from analytics_engine import get_calendar
+from cache_manager import create_cache_manager, month_end
+from report import REPORT_FORMATS, format_reports, format_team_reports
+import metrics
+
+# Модули работы с почтой (imaplib, email) и разбора HTML (bs4) загружаются
+# только при обращении к почте: отчёт по полному кешу их не использует.
+
+def fetch_months(config, months, cache_manager, email_parser, parallel_parser=None, pool=None, states=None):
+    """Загрузка новых писем за несколько месяцев с дозаписью результатов в кеш.
+    
+    Для всех месяцев выполняется один поиск в одной IMAP-сессии - от начала
+    первого до конца последнего месяца. При нескольких месяцах письма
+    раскладываются по месяцам по INTERNALDATE. Обрабатываются только письма,
+    UID которых ещё нет в кеше; результат каждого письма сразу дописывается
+    в журнал кеша, поэтому прерванный запуск продолжается с места
+    остановки. В кеш записываются поездки без фильтрации по адресам.
+    
+    При заданных SEARCH_FOLDERS поиск выполняется во всех папках одновременно,
+    по сессии на папку; письмо, Message-ID которого уже найден в предыдущей
+    папке списка, не загружается и не разбирается повторно.
+    
+    Если передан parallel_parser, разбор выполняется в этом (общем) пуле.
+    Если передан pool (FolderPools), используются его уже открытые IMAP-сессии;
+    states - уже загруженные состояния кеша месяцев, которые дополняются на месте.
+    Возвращает словарь {месяц: состояние кеша}.
+    """
+    from folder_search import create_folder_pools, find_duplicates
+    from pipeline import MailPipeline
+    
+    run_started = datetime.now()
+    states = {month: (states or {}).get(month) or cache_manager.load_state(month) for month in months}
+    
+    if pool is not None:
+        # Открытые сессии остаются в пуле после загрузки
+        pool_context = nullcontext(pool)
+    else:
+        # Инициализация клиентов электронной почты (по одному на папку)
+        pool_context = create_folder_pools(config)
+    
+    with pool_context as pools:
+        mailbox_states = {
+            mailbox: {
+                month: cache_manager.get_mailbox_state(states[month], mailbox, folder_pool.email_client.uidvalidity)
+                for month in months
+            }
+            for mailbox, folder_pool in pools.pools.items()
+        }
+        # Message-ID нужны только для поиска повторов между папками
+        several_folders = len(pools.pools) > 1
+        
+        def search_folder(mailbox, folder_pool):
+            """Поиск новых писем папки, их месяцы и отбор по заголовкам (в сессии папки)."""
+            email_client = folder_pool.email_client
+            processed = set()
+            for mailbox_state in mailbox_states[mailbox].values():
+                processed.update(mailbox_state["messages"])
+            min_uid = min(mailbox_state["last_uid"] for mailbox_state in mailbox_states[mailbox].values()) + 1
+            
+            with folder_pool.connection() as mail:
+                email_ids = email_client.fetch_emails(mail, months[0], min_uid=min_uid, last_month=months[-1])
+                new_ids = [email_id for email_id in email_ids if email_id.decode() not in processed]
+                logging.info(f"Папка {mailbox}: новых писем: {len(new_ids)}, уже в кеше: {len(email_ids) - len(new_ids)}")
+                metrics.count("messages.new", len(new_ids))
+                
+                # Месяц каждого письма; для одного месяца дата известна из условия поиска
+                if len(months) > 1:
+                    email_months = email_client.fetch_internal_months(mail, new_ids)
+                else:
+                    email_months = {email_id: months[0] for email_id in new_ids}
+                # Письма из месяцев внутри диапазона, которые не запрошены, не обрабатываются
+                undated_ids = [email_id for email_id in new_ids if email_id not in email_months]
+                new_ids = [email_id for email_id in new_ids if email_months.get(email_id) in mailbox_states[mailbox]]
+                
+                message_ids = {} if several_folders else None
+                screened_ids, rejected_ids = email_client.prescreen_emails(mail, new_ids, message_ids=message_ids)
+            return {
+                "email_ids": email_ids,
+                "processed": processed,
+                "new_ids": new_ids,
+                "email_months": email_months,
+                "undated_ids": undated_ids,
+                "screened_ids": screened_ids,
+                "rejected_ids": rejected_ids,
+                "message_ids": message_ids or {}
+            }
+        
+        found = pools.search(search_folder)
+        
+        # Письма, отсеянные по заголовкам, тоже считаются обработанными; письма,
+        # заголовки которых не загрузились, остаются необработанными до следующего запуска
+        for mailbox, folder in found.items():
+            for email_id in folder["rejected_ids"]:
+                month = folder["email_months"][email_id]
+                cache_manager.append_message(month, mailbox, mailbox_states[mailbox][month], email_id.decode(), None)
+        
+        # Письмо, найденное в нескольких папках, разбирается один раз; копии считаются обработанными без поездки
+        keys = [(mailbox, email_id) for mailbox, folder in found.items() for email_id in folder["screened_ids"]]
+        duplicates = find_duplicates(keys, {
+            (mailbox, email_id): message_id
+            for mailbox, folder in found.items() for email_id, message_id in folder["message_ids"].items()
+        })
+        if duplicates:
+            for mailbox, email_id in duplicates:
+                month = found[mailbox]["email_months"][email_id]
+                cache_manager.append_message(month, mailbox, mailbox_states[mailbox][month], email_id.decode(), None)
+            keys = [key for key in keys if key not in duplicates]
+            logging.info(f"Копий писем из других папок: {len(duplicates)}, они не разбираются")
+            metrics.count("messages.duplicates", len(duplicates))
+        
+        if parallel_parser is not None:
+            # Общий пул разбора нескольких почтовых ящиков
+            parser_context = nullcontext(parallel_parser)
+        else:
+            # Для небольшого числа писем запуск пула процессов дороже самого разбора
+            workers = config["PARSE_WORKERS"] if len(keys) >= config["PARSE_MIN_PARALLEL"] else 1
+            parser_context = ParallelParser(email_parser, workers)
+        
+        # Загрузка, разбор и запись в кеш идут одновременно; каждый результат сразу дописывается в журнал месяца
+        rejected_by_parser = 0
+        with parser_context as parallel_parser:
+            pipeline = MailPipeline(pools, parallel_parser, config["PIPELINE_QUEUE_SIZE"])
+            try:
+                for (mailbox, email_id), trip in pipeline.run(keys):
+                    if trip is None:
+                        rejected_by_parser += 1
+                    month = found[mailbox]["email_months"][email_id]
+                    cache_manager.append_message(month, mailbox, mailbox_states[mailbox][month], email_id.decode(), trip)
+            finally:
+                # Уже полученные результаты остаются на диске и при ошибке
+                for month in months:
+                    cache_manager.close_journal(month)
+        without_html = pipeline.without_html
+        rejected_by_parser -= without_html
+        
+        new_count = sum(len(folder["new_ids"]) for folder in found.values())
+        rejected_count = sum(len(folder["rejected_ids"]) for folder in found.values())
+        logging.info(
+            f"Писем найдено: {new_count}, отсеяно по заголовкам: {rejected_count}, "
+            f"без HTML: {without_html}, не распознано парсером: {rejected_by_parser}"
+        )
+        # Месяц не закрывается, если часть папок не удалось просмотреть
+        skipped_folders = pools.skipped
+    
+    undated_count = sum(len(folder["undated_ids"]) for folder in found.values())
+    if undated_count:
+        logging.warning(f"Не удалось определить месяц писем: {undated_count}, они будут загружены при следующем запуске")
+    
+    for month in months:
+        pending_count = 0
+        for mailbox, folder in found.items():
+            mailbox_state = mailbox_states[mailbox][month]
+            messages = mailbox_state["messages"]
+            email_ids = folder["email_ids"]
+            
+            # Последний UID, до которого включительно обработаны все найденные письма месяца.
+            # Поиск охватывал весь месяц, поэтому без необработанных писем граница - последний найденный UID.
+            pending = [
+                int(email_id) for email_id in email_ids
+                if email_id.decode() not in messages
+                and folder["email_months"].get(email_id, month) == month
+                and email_id.decode() not in folder["processed"]
+            ]
+            if pending:
+                mailbox_state["last_uid"] = max(mailbox_state["last_uid"], min(pending) - 1)
+            elif email_ids:
+                mailbox_state["last_uid"] = max(mailbox_state["last_uid"], max(int(email_id) for email_id in email_ids))
+            pending_count += len(pending)
+        if pending_count:
+            logging.warning(f"Месяц {month}: не удалось обработать писем: {pending_count}, они будут загружены при следующем запуске")
+        
+        # Месяц закрыт, если запуск начался после его окончания и все письма обработаны
+        states[month]["complete"] = run_started >= month_end(month) and not pending_count and not skipped_folders
+        cache_manager.save_state(month, states[month])
+    return states
+
+def mirrored_messages(email_client, state, stats):
+    """Пары ((папка, UID), html) для писем кеша месяца, сохранённых в локальной копии."""
+    for mailbox, mailbox_state in state["mailboxes"].items():
+        for uid in sorted(mailbox_state["messages"], key=int):
+            html_content = email_client.load_from_mirror(mailbox, mailbox_state["uidvalidity"], uid)
+            if html_content is None:
+                stats["missing"] += 1
+                continue
+            yield (mailbox, uid), html_content
+
+def reprocess_offline(config, months, cache_manager, email_parser, parallel_parser=None):
+    """Повторный разбор писем месяцев из локальной копии без подключения к почте.
+    
+    Разбираются письма, уже известные кешу месяца и сохранённые в копии
+    (MIRROR_DIR); результаты заменяют записи кеша. Письма, которых нет
+    в копии, сохраняют прежний результат.
+    Возвращает словарь {месяц: состояние кеша}.
+    """
+    from mail_client import EmailClient
+    
+    email_client = EmailClient(dict(config, MIRROR_ENABLED=True))
+    if parallel_parser is not None:
+        parser_context = nullcontext(parallel_parser)
+    else:
+        parser_context = ParallelParser(email_parser, config["PARSE_WORKERS"])
+    
+    states = {}
+    with parser_context as parallel_parser:
+        for month in months:
+            state = cache_manager.load_state(month)
+            states[month] = state
+            if not state["mailboxes"]:
+                logging.warning(f"Месяц {month}: в кеше нет писем, повторно разбирать нечего")
+                continue
+            
+            stats = {"missing": 0}
+            reparsed = 0
+            try:
+                for (mailbox, uid), trip in parallel_parser.extract_stream(mirrored_messages(email_client, state, stats)):
+                    cache_manager.append_message(month, mailbox, state["mailboxes"][mailbox], uid, trip)
+                    reparsed += 1
+            finally:
+                cache_manager.close_journal(month)
+            
+            cache_manager.save_state(month, state)
+            logging.info(
+                f"Месяц {month}: повторно разобрано писем из локальной копии: {reparsed}, "
+                f"нет в копии: {stats['missing']}"
+            )
+    return states
+
+def build_report(month, state, email_parser, cache_manager, holidays=()):
+    """Отбор поездок по фильтрам адресов и расчёт формул по неделям.
+    
+    Отчёт кешируется по хешу настроек фильтрации (и праздников месяца),
+    поэтому изменение фильтров в .env пересчитывает только отчёт, без
+    загрузки писем.
+    """
+    filter_key = email_parser.filter_key() + get_calendar(tuple(holidays)).month_key(month)
+    revision = cache_manager.state_revision(state)
+    report = cache_manager.load_report(month, filter_key, revision)
+    if report is not None:
+        logging.info(f"Используется отчёт из кеша для фильтров {filter_key}")
+        metrics.count("cache.report_hits")
+        return report
+    metrics.count("cache.report_misses")
+    
+    trips = email_parser.filter_trips(cache_manager.collect_trips(state))
+    report = {"month": month, "filter_key": filter_key, "trips": trips}
+    # Получение рабочих недель и формул расчета (для месяца без поездок - нулевые формулы)
+    report["weeks"], report["formulas"] = TripAnalytics.format_weekly_costs(trips, month, holidays)
+    
+    cache_manager.save_report(month, filter_key, revision, report)
+    return report
+
+def collect_reports(config, months, cache_manager, email_parser, parallel_parser=None):
+    """Отчёты по месяцам одного почтового ящика.
+    
+    Полный кеш используется без обращения к почте, остальные месяцы
+    дозагружаются за один поиск. В режиме OFFLINE письма повторно
+    разбираются из локальной копии без подключения к почте.
+    """
+    offline = config.get("OFFLINE", False)
+    if offline:
+        states = reprocess_offline(config, months, cache_manager, email_parser, parallel_parser)
+    else:
+        states = {}
+        for month in months:
+            if cache_manager.is_complete(month):
+                states[month] = cache_manager.load_state(month)
+                logging.info(f"Используются данные из кеша для месяца {month}")
+        incomplete = [month for month in months if month not in states]
+        metrics.count("cache.month_hits", len(states))
+        metrics.count("cache.month_misses", len(incomplete))
+        if incomplete:
+            states.update(fetch_months(config, incomplete, cache_manager, email_parser, parallel_parser))
+    
+    reports = []
+    for month in months:
+        report = build_report(month, states[month], email_parser, cache_manager, holidays=config["HOLIDAYS"])
+        trips = report["trips"]
+        logging.info(
+            f"Месяц {month}: поездок по заданным адресам: {len(trips)}, "
+            f"отсеяно фильтрами: {len(cache_manager.collect_trips(states[month])) - len(trips)}"
+        )
+        if not trips:
+            logging.info(f"Месяц {month}: маршруты с заданными параметрами не найдены.")
+        reports.append(report)
+    return reports
+
+def process_account(name, config, months, parallel_parser):
+    """Отчёты почтового ящика сотрудника с отдельным кешем и фильтрами адресов."""
+    from accounts import account_cache_dir
+    
+    cache_manager = create_cache_manager(config["CACHE_BACKEND"], account_cache_dir(name))
+    config = dict(config, MIRROR_DIR=account_cache_dir(name, config["MIRROR_DIR"]))
+    email_parser = EmailParser(
+        config["ADDRESSES_TO_FIND"], config["REQUIRED_ADDRESS"], config["EXCLUDED_ADDRESSES"], config["PARSER_BACKEND"]
+    )
+    return collect_reports(config, months, cache_manager, email_parser, parallel_parser)
+
+def process_team(config, accounts_file, months):
+    """Одновременная обработка почтовых ящиков из файла; {имя: отчёты}."""
+    from accounts import load_accounts, process_accounts
+    
+    accounts = load_accounts(accounts_file, config)
+    if not accounts:
+        raise ValueError(f"В файле {accounts_file} нет почтовых ящиков")
+    
+    # Извлечение поездок не зависит от фильтров адресов, поэтому пул разбора общий для всех ящиков
+    with ParallelParser(EmailParser([], backend=config["PARSER_BACKEND"]), config["PARSE_WORKERS"]) as parallel_parser:
+        process = partial(process_account, parallel_parser=parallel_parser)
+        return process_accounts(accounts, months, process, config["ACCOUNTS_CONCURRENCY"])
+
+def watch_mailbox(config, cache_manager, email_parser):
+    """Обработка писем по мере поступления до прерывания (Ctrl+C или SIGTERM)."""
+    from mail_client import EmailClient
+    from mail_watcher import MailWatcher
+    
+    catch_up = partial(fetch_months, config, cache_manager=cache_manager, email_parser=email_parser)
+    # При нескольких папках поиска новые письма ожидаются в первой из них, а остальные
+    # папки просматриваются при запуске и перед закрытием прошлого месяца (catch_up)
+    folders = config.get("SEARCH_FOLDERS") or [None]
+    watcher = MailWatcher(EmailClient(config, mailbox=folders[0]), cache_manager, email_parser, catch_up, config)
+    signal.signal(signal.SIGTERM, lambda signum, frame: watcher.stop())
+    try:
+        watcher.run()
+    except KeyboardInterrupt:
+        logging.info("Наблюдение за почтой прервано")
+
+def serve_reports(config, email_parser, host, port):
+    """Сервер отчётов по HTTP до прерывания (Ctrl+C или SIGTERM)."""
+    from report_server import ReportServer, ReportService
+    
+    fetch = partial(fetch_months, config, email_parser=email_parser)
+    build = partial(build_report, email_parser=email_parser, holidays=config["HOLIDAYS"])
+    service = ReportService(config, email_parser, fetch, build)
+    server = ReportServer((host, port), service)
+    # shutdown() ждёт завершения serve_forever, поэтому вызывается из другого потока
+    signal.signal(signal.SIGTERM, lambda signum, frame: threading.Thread(target=server.shutdown).start())
+    logging.info(f"Сервер отчётов: http://{host}:{server.server_port}/report?month=YYYY-MM")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        logging.info("Сервер отчётов прерван")
+    finally:
+        server.server_close()
+        service.close()
+        logging.info("Сервер отчётов остановлен")
+
+def parse_month(value):
+    """Проверка месяца в формате YYYY-MM для аргументов командной строки."""
+    try:
+        return datetime.strptime(value.strip(), "%Y-%m").strftime("%Y-%m")
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"месяц должен быть в формате YYYY-MM: '{value}'")
+
+def month_range(first_month, last_month):
+    """Список месяцев с first_month по last_month включительно."""
+    year, month_num = map(int, first_month.split('-'))
+    months = []
+    while f"{year:04d}-{month_num:02d}" <= last_month:
+        months.append(f"{year:04d}-{month_num:02d}")
+        year, month_num = (year + 1, 1) if month_num == 12 else (year, month_num + 1)
+    return months
+
+def requested_months(args, parser):
+    """Месяцы отчёта из аргументов командной строки или из запроса пользователю."""
+    try:
+        if args.months:
+            months = [parse_month(value) for value in args.months.split(",") if value.strip()]
+        elif args.month_from or args.month_to:
+            months = month_range(args.month_from or args.month_to, args.month_to or args.month_from)
+        elif args.month:
+            months = [args.month]
+        elif sys.stdin.isatty():
+            # Запрос месяца от пользователя
+            months = [parse_month(input("Введите месяц в формате 'YYYY-MM': "))]
+        else:
+            parser.error("укажите месяц: --month, --from/--to или --months")
+    except argparse.ArgumentTypeError as e:
+        parser.error(str(e))
+    if not months:
+        parser.error("пустой список месяцев")
+    return sorted(set(months))
+
+def write_output(output, path=None):
+    """Вывод отчёта на экран или в файл."""
+    if path:
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(output + "\n")
+        logging.info(f"Отчёт сохранён в {path}")
+    else:
+        print(output)
+
+def report_metrics(run_started, args):
+    """Итоги замеров запуска: в лог, в файл --metrics и профиль разбора для --profile."""
+    metrics.record_time("run.total", time.perf_counter() - run_started)
+    summary = metrics.summary_json()
+    logging.info(f"Замеры этапов обработки:\n{summary}")
+    log_reject_rate()
+    if args.metrics:
+        try:
+            with open(args.metrics, 'w', encoding='utf-8') as f:
+                f.write(summary + "\n")
+        except Exception as e:
+            logging.error(f"Ошибка при сохранении замеров в {args.metrics}: {e}")
+    if args.profile:
+        try:
+            metrics.dump_profile(args.profile)
+        except Exception as e:
+            logging.error(f"Ошибка при сохранении профиля в {args.profile}: {e}")
 
 def main():
+    run_started = time.perf_counter()
     # Обработка аргументов командной строки
     parser = argparse.ArgumentParser(description='Анализ поездок на такси')
     parser.add_argument('--logging-level', type=str, default='INFO',
                         help='Уровень логирования (DEBUG, INFO, WARNING, ERROR, CRITICAL)')
+    parser.add_argument('--batch-size', type=int, default=None,
+                        help='Количество писем в одном запросе FETCH (по умолчанию FETCH_BATCH_SIZE)')
+    parser.add_argument('--connections', type=int, default=None,
+                        help='Количество параллельных IMAP-сессий (по умолчанию IMAP_POOL_SIZE)')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='Количество процессов для разбора писем (по умолчанию PARSE_WORKERS, 0 - по числу процессоров)')
+    parser.add_argument('--month', type=parse_month, default=None,
+                        help='Месяц отчёта в формате YYYY-MM (без аргументов месяц запрашивается в терминале)')
+    parser.add_argument('--from', dest='month_from', type=parse_month, default=None,
+                        help='Первый месяц диапазона в формате YYYY-MM')
+    parser.add_argument('--to', dest='month_to', type=parse_month, default=None,
+                        help='Последний месяц диапазона в формате YYYY-MM')
+    parser.add_argument('--months', type=str, default=None,
+                        help='Список месяцев через запятую, например 2024-01,2024-03')
+    parser.add_argument('--format', dest='output_format', choices=REPORT_FORMATS, default='text',
+                        help='Формат отчёта: text, tsv, json или summary (итоги по неделям, месяцам и годам)')
+    parser.add_argument('--output', type=str, default=None,
+                        help='Файл для сохранения отчёта (по умолчанию - вывод на экран)')
+    parser.add_argument('--offline', action='store_true',
+                        help='Повторный разбор писем из локальной копии (MIRROR_DIR) без подключения к почте')
+    parser.add_argument('--accounts', type=str, default=None,
+                        help='JSON-файл со списком почтовых ящиков сотрудников (по умолчанию ACCOUNTS_FILE)')
+    parser.add_argument('--accounts-concurrency', type=int, default=None,
+                        help='Количество одновременно обрабатываемых ящиков (по умолчанию ACCOUNTS_CONCURRENCY)')
+    parser.add_argument('--watch', action='store_true',
+                        help='Наблюдение за папкой с чеками: новые письма обрабатываются по мере поступления')
+    parser.add_argument('--serve', action='store_true',
+                        help='Сервер отчётов по HTTP: GET /report?month=YYYY-MM (адрес SERVER_HOST, порт SERVER_PORT)')
+    parser.add_argument('--port', type=int, default=None,
+                        help='Порт сервера отчётов (по умолчанию SERVER_PORT)')
+    parser.add_argument('--metrics', type=str, default=None,
+                        help='Файл JSON для сохранения замеров этапов обработки')
+    parser.add_argument('--profile', type=str, nargs='?', const='parse.prof', default=None,
+                        help='Профилирование разбора писем (cProfile); статистика сохраняется в файл (по умолчанию parse.prof)')
     args = parser.parse_args()
     
     # Настройка логирования с учетом аргумента командной строки
@@ -22,73 +470,60 @@ def main():
     try:
         # Загрузка конфигурации
         config = load_config()
+        if args.batch_size:
+            config["FETCH_BATCH_SIZE"] = args.batch_size
+        if args.connections:
+            config["IMAP_POOL_SIZE"] = args.connections
+        if args.workers is not None:
+            config["PARSE_WORKERS"] = args.workers
+        config["OFFLINE"] = args.offline
+        if args.profile:
+            # Профилируется разбор в текущем процессе, поэтому пул процессов не запускается
+            metrics.enable_profiling()
+            config["PARSE_WORKERS"] = 1
+        if args.accounts_concurrency:
+            config["ACCOUNTS_CONCURRENCY"] = args.accounts_concurrency
         
-        # Проверка содержимого .env файла
-        logging.debug(f"Содержимое .env файла:")
-        with open('.env', 'r') as f:
-            env_content = f.read()
-            logging.debug(env_content)
+        if args.watch:
+            # Наблюдение за почтовым ящиком из .env; отчёты строятся отдельными запусками из кеша
+            email_parser = EmailParser([], backend=config["PARSER_BACKEND"])
+            watch_mailbox(config, create_cache_manager(config["CACHE_BACKEND"]), email_parser)
+            return
         
-        # Запрос месяца от пользователя
-        month = input("Введите месяц в формате 'YYYY-MM': ")
+        if args.serve:
+            # Сервер отчётов по почтовому ящику и фильтрам из .env
+            email_parser = EmailParser(
+                config["ADDRESSES_TO_FIND"], config["REQUIRED_ADDRESS"], config["EXCLUDED_ADDRESSES"], config["PARSER_BACKEND"]
+            )
+            serve_reports(config, email_parser, config["SERVER_HOST"], args.port or config["SERVER_PORT"])
+            return
         
-        # Инициализация кеш-менеджера
-        cache_manager = CacheManager()
+        months = requested_months(args, parser)
         
-        # Проверка наличия кеша
-        if cache_manager.has_cache(month):
-            trips = cache_manager.load_from_cache(month)
-            logging.info(f"Используются данные из кеша для месяца {month}")
-        else:
-            # Инициализация клиента электронной почты
-            email_client = EmailClient(config)
-            
-            # Инициализация парсера писем
-            addresses_to_find = config["ADDRESSES_TO_FIND"]
-            required_address = config["REQUIRED_ADDRESS"]
-            excluded_addresses = config["EXCLUDED_ADDRESSES"]
-            email_parser = EmailParser(addresses_to_find, required_address, excluded_addresses)
-            
-            # Получение и обработка писем
-            trips = []
-            with email_client.connect() as mail:
-                email_ids = email_client.fetch_emails(mail, month)
-                
-                for email_id in email_ids:
-                    status, data = mail.fetch(email_id, '(RFC822)')
-                    if status != 'OK':
-                        continue
-                    
-                    email_data = data[0][1]
-                    html_content = email_client.extract_html_from_email(email_data)
-                    
-                    if html_content:
-                        trip_results = email_parser.parse_email_content(html_content)
-                        trips.extend(trip_results)
-            
-            # Сохранение результатов в кеш
-            cache_manager.save_to_cache(month, trips)
+        accounts_file = args.accounts or config["ACCOUNTS_FILE"]
+        if accounts_file:
+            # Отчёты по почтовым ящикам всех сотрудников и сводка по ним
+            output = format_team_reports(process_team(config, accounts_file, months), args.output_format, config["HOLIDAYS"])
+            write_output(output, args.output)
+            return
         
-        # Вывод результатов
-        for trip in trips:
-            print(trip)
+        # Инициализация кеш-менеджера
+        cache_manager = create_cache_manager(config["CACHE_BACKEND"])
         
-        logging.info(f"Поездок по заданным адресам: {len(trips)}")
+        # Инициализация парсера писем
+        addresses_to_find = config["ADDRESSES_TO_FIND"]
+        required_address = config["REQUIRED_ADDRESS"]
+        excluded_addresses = config["EXCLUDED_ADDRESSES"]
+        email_parser = EmailParser(addresses_to_find, required_address, excluded_addresses, config["PARSER_BACKEND"])
         
-        # Анализ поездок
-        if trips:
-            # Получение рабочих недель и формул расчета
-            weeks_str, formulas_str = TripAnalytics.format_weekly_costs(trips, month)
-            
-            print("\n# Рабочие недели месяца:")
-            print(weeks_str)
-            
-            print("\n# Формулы расчета стоимости по неделям:")
-            print(formulas_str)
-        else:
-            logging.info("Маршруты с заданными параметрами не найдены.")
+        reports = collect_reports(config, months, cache_manager, email_parser)
+        
+        # Вывод результатов
+        write_output(format_reports(reports, args.output_format, config["HOLIDAYS"]), args.output)
     except Exception as e:
         logging.error(f"Общая ошибка: {e}")
+    finally:
+        report_metrics(run_started, args)
 
 if __name__ == "__main__":
     main() 
\ No newline at end of file
@@ -0,0 +1,128 @@
+# metrics.py - Замеры этапов обработки: время, счётчики и объём данных
+import io
+import json
+import time
+import logging
+import threading
+from contextlib import contextmanager
+
+_lock = threading.Lock()
+_stages = {}
+_counters = {}
+_bytes = {}
+
+# Профилировщик этапа разбора (включается режимом --profile)
+_profiler = None
+_profiler_lock = threading.Lock()
+
+
+def record_time(name, elapsed):
+    """Учёт времени одного вызова этапа."""
+    with _lock:
+        seconds, calls = _stages.get(name, (0.0, 0))
+        _stages[name] = (seconds + elapsed, calls + 1)
+
+
+@contextmanager
+def stage(name):
+    """Замер времени блока with; время и число вызовов суммируются по имени этапа."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_time(name, time.perf_counter() - started)
+
+
+def count(name, value=1):
+    """Увеличение счётчика."""
+    if value:
+        with _lock:
+            _counters[name] = _counters.get(name, 0) + value
+
+
+def add_bytes(name, value):
+    """Учёт объёма данных в байтах."""
+    if value:
+        with _lock:
+            _bytes[name] = _bytes.get(name, 0) + value
+
+
+def reset():
+    """Сброс всех замеров."""
+    with _lock:
+        _stages.clear()
+        _counters.clear()
+        _bytes.clear()
+
+
+def snapshot():
+    """Текущие замеры (для передачи из рабочего процесса в основной)."""
+    with _lock:
+        return {"stages": dict(_stages), "counters": dict(_counters), "bytes": dict(_bytes)}
+
+
+def merge(data):
+    """Добавление замеров, полученных snapshot() в другом процессе."""
+    with _lock:
+        for name, (seconds, calls) in data.get("stages", {}).items():
+            total_seconds, total_calls = _stages.get(name, (0.0, 0))
+            _stages[name] = (total_seconds + seconds, total_calls + calls)
+        for name, value in data.get("counters", {}).items():
+            _counters[name] = _counters.get(name, 0) + value
+        for name, value in data.get("bytes", {}).items():
+            _bytes[name] = _bytes.get(name, 0) + value
+
+
+def summary():
+    """Итоги запуска: время и число вызовов этапов, счётчики, объём данных."""
+    with _lock:
+        return {
+            "stages": {
+                name: {"seconds": round(seconds, 4), "calls": calls}
+                for name, (seconds, calls) in sorted(_stages.items())
+            },
+            "counters": dict(sorted(_counters.items())),
+            "bytes": dict(sorted(_bytes.items()))
+        }
+
+
+def summary_json():
+    """Итоги запуска в виде JSON."""
+    return json.dumps(summary(), ensure_ascii=False, indent=2)
+
+
+def enable_profiling():
+    """Включение профилирования этапа разбора."""
+    global _profiler
+    import cProfile
+    _profiler = cProfile.Profile()
+    return _profiler
+
+
+@contextmanager
+def profiled():
+    """Профилирование блока with, если профилирование включено.
+
+    Профилировщик один на запуск, поэтому профилируемые блоки разных
+    потоков выполняются по очереди.
+    """
+    if _profiler is None:
+        yield
+        return
+    with _profiler_lock:
+        _profiler.enable()
+        try:
+            yield
+        finally:
+            _profiler.disable()
+
+
+def dump_profile(path, limit=25):
+    """Сохранение статистики профилирования в файл и краткий отчёт в лог."""
+    if _profiler is None:
+        return
+    import pstats
+    _profiler.dump_stats(path)
+    output = io.StringIO()
+    pstats.Stats(_profiler, stream=output).sort_stats("cumulative").print_stats(limit)
+    logging.info(f"Профиль этапа разбора сохранён в {path}\n{output.getvalue()}")
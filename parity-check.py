@@ -0,0 +1,119 @@
+import os
+import sys
+import logging
+import random
+import argparse
+
+from extractors import EXTRACTORS, BS4Extractor, create_extractor
+from mail_client import EmailClient
+from prefilter import looks_like_receipt
+from receipt_generator import generate_receipt, choose_variant, random_start
+
+# Настройка логирования
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s [%(levelname)s] %(message)s',
+    handlers=[logging.StreamHandler()]
+)
+
+
+def load_samples(path):
+    """Загрузка образцов писем: файлы .html как есть, .eml - HTML-часть письма."""
+    email_client = EmailClient({})
+    samples = []
+    for root, _, files in os.walk(path):
+        for file_name in sorted(files):
+            file_path = os.path.join(root, file_name)
+            if file_name.endswith(('.html', '.htm')):
+                with open(file_path, 'r', encoding='utf-8', errors='replace') as f:
+                    samples.append((file_path, f.read()))
+            elif file_name.endswith('.eml'):
+                with open(file_path, 'rb') as f:
+                    html_content = email_client.extract_html_from_email(f.read())
+                if html_content:
+                    samples.append((file_path, html_content))
+    return samples
+
+
+def generate_samples(count, seed=0):
+    """Синтетические чеки из receipt_generator."""
+    rng = random.Random(seed)
+    return [
+        (f"generated-{index}", generate_receipt(rng, random_start(rng, "2024-05"), choose_variant(rng)))
+        for index in range(1, count + 1)
+    ]
+
+
+def run_extractor(extractor, content):
+    """Результат извлечения; исключение считается отдельным результатом."""
+    try:
+        return extractor.extract(content.replace("Точка назначения изменена", ""))
+    except Exception as e:
+        return f"Ошибка: {type(e).__name__}"
+
+
+def check_prefilter(samples):
+    """Сравнение предварительного отсева с полным разбором bs4; возвращает число расхождений.
+
+    Отсев не должен отклонять письмо, из которого полный разбор получает поездку.
+    """
+    reference = create_extractor("bs4")
+    logging.disable(logging.WARNING)
+    fields = [run_extractor(reference, content) for _, content in samples]
+    logging.disable(logging.NOTSET)
+
+    mismatches = 0
+    receipt_rejected = 0
+    for (file_path, content), sample_fields in zip(samples, fields):
+        if not looks_like_receipt(content):
+            receipt_rejected += 1
+            if sample_fields is not None:
+                logging.error(f"[prefilter] отклонено письмо с маршрутом: {file_path}")
+                mismatches += 1
+    logging.info(f"[prefilter] отклонено писем без маршрута: {receipt_rejected} из {len(samples)}")
+    return mismatches
+
+
+def main():
+    """Сравнение результатов всех способов разбора и предварительного отсева с эталонным bs4."""
+    parser = argparse.ArgumentParser(description='Проверка совпадения способов разбора писем')
+    parser.add_argument('path', nargs='?', default=None, help='Папка с образцами писем (.html или .eml)')
+    parser.add_argument('--generate', type=int, default=0,
+                        help='Количество синтетических чеков, добавляемых к образцам')
+    parser.add_argument('--seed', type=int, default=0, help='Начальное значение генератора чеков')
+    args = parser.parse_args()
+
+    samples = load_samples(args.path) if args.path else []
+    samples += generate_samples(args.generate, args.seed)
+    if not samples:
+        logging.error(f"Не найдено образцов писем (папка {args.path}, --generate {args.generate})")
+        return 1
+
+    # Эталон - bs4 с общим поиском по дереву; bs4 с планами шаблонов сравнивается с ним
+    reference = BS4Extractor(use_plans=False)
+    mismatches = 0
+    for name in EXTRACTORS:
+        extractor = create_extractor(name)
+        if extractor.name != name:
+            logging.warning(f"Способ разбора '{name}' пропущен")
+            continue
+
+        # Предупреждения об отсутствии маршрута не нужны при сравнении
+        logging.disable(logging.WARNING)
+        failed = [
+            file_path for file_path, content in samples
+            if run_extractor(extractor, content) != run_extractor(reference, content)
+        ]
+        logging.disable(logging.NOTSET)
+
+        for file_path in failed:
+            logging.error(f"[{name}] результат отличается от bs4: {file_path}")
+        logging.info(f"[{name}] совпадает с bs4: {len(samples) - len(failed)} из {len(samples)}")
+        mismatches += len(failed)
+
+    mismatches += check_prefilter(samples)
+    return 1 if mismatches else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,99 +1,278 @@
+import os
+import json
+import hashlib
 import logging
-from bs4 import BeautifulSoup
+import threading
+from collections import deque
+from itertools import islice
+from address_matcher import AddressMatcher, NORMALIZATION_VERSION
+from prefilter import looks_like_receipt
+from trip import Trip
+import metrics
 
 class EmailParser:
     """Класс для парсинга содержимого писем."""
     
-    def __init__(self, addresses_to_find, required_address="", excluded_addresses=None):
+    def __init__(self, addresses_to_find, required_address="", excluded_addresses=None, backend="bs4"):
         """Инициализация парсера."""
         self.addresses_to_find = addresses_to_find
         self.required_address = required_address
         self.excluded_addresses = excluded_addresses or []
+        # Списки адресов компилируются в автомат один раз
+        self.matcher = AddressMatcher(self.addresses_to_find, self.required_address, self.excluded_addresses)
+        # Способ извлечения данных из HTML (bs4 - эталонный, stream, lxml)
+        self.backend = backend
+        self._extractor = None
+    
+    @property
+    def extractor(self):
+        """Извлекатель создаётся при первом разборе письма.
+        
+        Отбор поездок из кеша по фильтрам не требует разбора HTML, поэтому
+        отчёт по кешу не загружает модули разбора (bs4, lxml).
+        """
+        if self._extractor is None:
+            from extractors import create_extractor
+            self._extractor = create_extractor(self.backend)
+        return self._extractor
+    
+    def init_args(self):
+        """Аргументы конструктора для создания такого же парсера в другом процессе."""
+        return (self.addresses_to_find, self.required_address, self.excluded_addresses, self.backend)
+    
+    def filter_key(self):
+        """Хеш настроек фильтрации для кеширования отчётов."""
+        filters = {
+            "addresses_to_find": self.addresses_to_find,
+            "required_address": self.required_address,
+            "excluded_addresses": self.excluded_addresses,
+            "normalization": NORMALIZATION_VERSION
+        }
+        data = json.dumps(filters, ensure_ascii=False, sort_keys=True)
+        return hashlib.sha1(data.encode('utf-8')).hexdigest()[:16]
+    
+    def extract_trip(self, content):
+        """Извлечение данных поездки из письма без учёта фильтров адресов.
+        
+        Возвращает запись Trip с точками маршрута, временем, стоимостью, датой
+        и признаком смены направления или None, если письмо не похоже на чек.
+        """
+        with metrics.stage("parse"):
+            try:
+                # Письма без точек маршрута отсеиваются без построения дерева HTML
+                metrics.count("prefilter.checked")
+                if not looks_like_receipt(content):
+                    logging.debug("В письме нет точек маршрута, разбор пропущен")
+                    metrics.count("prefilter.rejected")
+                    metrics.count("parse.not_receipt")
+                    return None
+                
+                # Проверяем наличие сообщения о смене направления перед очисткой
+                has_direction_change = "Точка назначения изменена" in content
+                
+                # Предварительная очистка HTML от нежелательных текстов
+                content = content.replace("Точка назначения изменена", "")
+                
+                fields = self.extractor.extract(content)
+                if fields is None:
+                    metrics.count("parse.not_receipt")
+                    return None
+                
+                # Логируем найденные точки маршрута
+                logging.debug(f"Найдены точки маршрута: начало='{fields['points'][0]}', конец='{fields['points'][-1]}'")
+                
+                metrics.count("parse.trips")
+                return Trip.from_fields(fields, has_direction_change)
+            except Exception as e:
+                logging.error(f"Ошибка при парсинге содержимого письма: {e}")
+                metrics.count("parse.errors")
+                return None
+    
+    def matches_filters(self, trip):
+        """Проверка поездки по искомым, обязательному и исключаемым адресам.
+        
+        Адреса сравниваются после нормализации (регистр, ё/е, сокращения
+        вида "ул." и пробелы); все списки проверяются за один проход.
+        """
+        matches = self.matcher.match(trip.start_point, trip.end_point)
+        
+        # Проверка на исключаемые адреса
+        if matches["excluded"]:
+            logging.debug(f"Маршрут содержит исключаемые адреса {matches['excluded']}, пропускаем")
+            return False
+        
+        # Проверка на обязательный адрес
+        required_address_found = True
+        if self.required_address:
+            required_address_found = matches["required"]
+            if not required_address_found:
+                logging.debug(f"Обязательный адрес '{self.required_address}' не найден в маршруте")
+            else:
+                logging.debug(f"Обязательный адрес '{self.required_address}' найден в маршруте")
+
+        # Проверка, содержит ли маршрут хотя бы один из искомых адресов
+        addresses_found = True  # По умолчанию считаем, что адреса найдены
+        if self.addresses_to_find:
+            # Логируем результаты проверки
+            if matches["find_start"]:
+                logging.debug(f"Найдено совпадение в начальной точке: {matches['find_start']}")
+            if matches["find_end"]:
+                logging.debug(f"Найдено совпадение в конечной точке: {matches['find_end']}")
+            
+            addresses_found = bool(matches["find_start"] or matches["find_end"])
+        
+        # Поездка учитывается только если найдены и адреса из списка, и обязательный адрес
+        if not addresses_found:
+            logging.debug("Маршрут не соответствует искомым адресам")
+        if not required_address_found:
+            logging.debug("Маршрут не содержит обязательный адрес")
+        return addresses_found and required_address_found
+    
+    def filter_trips(self, trips):
+        """Отбор поездок по фильтрам адресов."""
+        results = []
+        for trip in trips:
+            if trip and self.matches_filters(trip):
+                logging.debug(f"Найден подходящий маршрут: {trip}")
+                results.append(trip)
+            elif trip:
+                metrics.count("trips.filter_rejected")
+        return results
     
     def parse_email_content(self, content):
         """Парсинг содержимого письма с учётом адресов."""
-        try:
-            # Проверяем наличие сообщения о смене направления перед очисткой
-            has_direction_change = "Точка назначения изменена" in content
-            
-            # Предварительная очистка HTML от нежелательных текстов
-            content = content.replace("Точка назначения изменена", "")
-            
-            soup = BeautifulSoup(content, 'html.parser')
+        return self.filter_trips([self.extract_trip(content)])
 
-            # Извлечение маршрутов
-            route_points = soup.find_all('tr', class_='route__point')
-            if not route_points or len(route_points) < 2:
-                logging.warning("Не удалось извлечь маршрутные точки.")
-                return []
 
-            # Получаем начальную и конечную точки маршрута
-            start_point = route_points[0].find('p', class_='route__point-name').get_text(strip=True)
-            end_point = route_points[-1].find('p', class_='route__point-name').get_text(strip=True)
-            
-            # Логируем найденные точки маршрута
-            logging.debug(f"Найдены точки маршрута: начало='{start_point}', конец='{end_point}'")
-            logging.debug(f"Искомые адреса: {self.addresses_to_find}")
-            
-            # Проверка на исключаемые адреса
-            for excluded_address in self.excluded_addresses:
-                if excluded_address in start_point or excluded_address in end_point:
-                    logging.debug(f"Маршрут содержит исключаемый адрес '{excluded_address}', пропускаем")
-                    return []
-            
-            # Проверка на обязательный адрес
-            required_address_found = True
-            if self.required_address:
-                required_address_found = (self.required_address in start_point or self.required_address in end_point)
-                if not required_address_found:
-                    logging.debug(f"Обязательный адрес '{self.required_address}' не найден в маршруте")
-                else:
-                    logging.debug(f"Обязательный адрес '{self.required_address}' найден в маршруте")
+# Парсер рабочего процесса; создаётся один раз при запуске процесса пула
+_worker_parser = None
 
-            # Извлечение времени
-            start_time = route_points[0].find('p', class_='hint').get_text(strip=True) if route_points[0].find('p', class_='hint') else "N/A"
-            end_time = route_points[-1].find('p', class_='hint').get_text(strip=True) if route_points[-1].find('p', class_='hint') else "N/A"
 
-            # Извлечение стоимости
-            cost = soup.find('td', class_='report__value_main')
-            cost_text = cost.get_text(strip=True) if cost else "N/A"
+def _init_worker(parser_args):
+    """Инициализация рабочего процесса: настройки парсера передаются один раз."""
+    global _worker_parser
+    _worker_parser = EmailParser(*parser_args)
 
-            # Извлечение даты
-            date_row = soup.find('td', string="Дата")
-            date_text = date_row.find_next_sibling('td').get_text(strip=True) if date_row else "N/A"
 
-            # Проверка, содержит ли маршрут хотя бы один из искомых адресов
-            addresses_found = True  # По умолчанию считаем, что адреса найдены
-            if self.addresses_to_find:
-                start_matches = [address for address in self.addresses_to_find if address in start_point]
-                end_matches = [address for address in self.addresses_to_find if address in end_point]
-                
-                # Логируем результаты проверки
-                if start_matches:
-                    logging.debug(f"Найдено совпадение в начальной точке: {start_matches}")
-                if end_matches:
-                    logging.debug(f"Найдено совпадение в конечной точке: {end_matches}")
-                
-                addresses_found = len(start_matches) > 0 or len(end_matches) > 0
-            
-            # Поездка учитывается только если найдены и адреса из списка, и обязательный адрес
-            if addresses_found and required_address_found:
-                # Определяем направление с учетом ранее обнаруженного сообщения
-                if has_direction_change:
-                    direction = f"{end_point} -> {start_point}"
-                else:
-                    direction = f"{start_point} -> {end_point}"
+def _extract_in_worker(content):
+    """Извлечение поездки в рабочем процессе."""
+    return _worker_parser.extract_trip(content)
 
-                result = f"Маршрут: {direction}, Стоимость: {cost_text}, Дата: {date_text}, Время: {start_time} - {end_time}"
-                logging.debug(f"Найден подходящий маршрут: {result}")
-                return [result]
-            else:
-                if not addresses_found:
-                    logging.debug("Маршрут не соответствует искомым адресам")
-                if not required_address_found:
-                    logging.debug("Маршрут не содержит обязательный адрес")
 
-            return []
+def _extract_chunk_in_worker(contents):
+    """Извлечение поездок из части писем в рабочем процессе.
+    
+    Вместе с поездками возвращаются замеры разбора этой части, чтобы
+    основной процесс учёл их в итогах запуска.
+    """
+    metrics.reset()
+    trips = [_worker_parser.extract_trip(content) for content in contents]
+    return trips, metrics.snapshot()
+
+
+class ParallelParser:
+    """Параллельное извлечение поездок из HTML в пуле процессов.
+    
+    Письма отправляются в пул частями по chunksize штук, результаты
+    возвращаются в исходном порядке. При одном рабочем процессе или
+    небольшом числе писем разбор выполняется в текущем процессе.
+    """
+    
+    def __init__(self, email_parser, workers=0, chunksize=16):
+        """Инициализация; workers=0 - по числу процессоров."""
+        self.email_parser = email_parser
+        self.workers = workers or os.cpu_count() or 1
+        self.chunksize = max(1, chunksize)
+        self._executor = None
+        # Пул может использоваться из нескольких потоков (общий пул для нескольких ящиков)
+        self._lock = threading.Lock()
+    
+    def _get_executor(self):
+        """Пул процессов создаётся при первом параллельном разборе."""
+        with self._lock:
+            if self._executor is None:
+                from concurrent.futures import ProcessPoolExecutor
+                logging.info(f"Запуск пула разбора писем: {self.workers} процессов")
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    initializer=_init_worker,
+                    initargs=(self.email_parser.init_args(),)
+                )
+            return self._executor
+    
+    def extract_many(self, contents):
+        """Извлечение поездок из списка HTML; результат в порядке входного списка."""
+        if self.workers <= 1 or len(contents) < 2 * self.chunksize:
+            return self._extract_serial(contents)
+        try:
+            return list(self._get_executor().map(_extract_in_worker, contents, chunksize=self.chunksize))
+        except Exception as e:
+            logging.error(f"Ошибка в пуле разбора писем, разбор в текущем процессе: {e}")
+            self.close()
+            self.workers = 1
+            return self._extract_serial(contents)
+    
+    def _extract_serial(self, contents):
+        """Разбор в текущем процессе; в режиме --profile разбор профилируется."""
+        with metrics.profiled():
+            return [self.email_parser.extract_trip(content) for content in contents]
+    
+    def _submit(self, contents):
+        """Отправка части писем в пул; None, если пул недоступен."""
+        if self.workers <= 1:
+            return None
+        try:
+            return self._get_executor().submit(_extract_chunk_in_worker, contents)
         except Exception as e:
-            logging.error(f"Ошибка при парсинге содержимого письма: {e}")
-            return []
+            logging.error(f"Ошибка в пуле разбора писем, разбор в текущем процессе: {e}")
+            self.workers = 1
+            return None
+    
+    def _chunk_results(self, chunk, future):
+        """Пары (ключ, поездка) для части писем; письма без HTML дают None."""
+        contents = [content for _, content in chunk if content]
+        trips = None
+        if future is not None:
+            try:
+                trips, worker_metrics = future.result()
+                metrics.merge(worker_metrics)
+            except Exception as e:
+                logging.error(f"Ошибка в пуле разбора писем, разбор в текущем процессе: {e}")
+                self.workers = 1
+        if trips is None:
+            trips = self._extract_serial(contents)
+        trips = iter(trips)
+        for key, content in chunk:
+            yield key, next(trips) if content else None
+    
+    def extract_stream(self, items):
+        """Потоковое извлечение поездок: генератор пар (ключ, поездка) для пар (ключ, html).
+        
+        Входной поток читается частями по chunksize писем, в пуле одновременно
+        не больше 2 * workers частей, поэтому в памяти находится ограниченное
+        число писем независимо от их общего количества. Результаты выдаются
+        в порядке входного потока.
+        """
+        items = iter(items)
+        pending = deque()
+        while True:
+            chunk = list(islice(items, self.chunksize))
+            if not chunk:
+                break
+            pending.append((chunk, self._submit([content for _, content in chunk if content])))
+            if len(pending) >= 2 * self.workers:
+                yield from self._chunk_results(*pending.popleft())
+        while pending:
+            yield from self._chunk_results(*pending.popleft())
+    
+    def close(self):
+        """Остановка пула процессов."""
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
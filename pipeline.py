@@ -0,0 +1,107 @@
+# pipeline.py - Потоковая обработка писем: загрузка, разбор, запись в кеш
+import logging
+import queue
+import threading
+
+import metrics
+
+# Признак окончания потока в очереди между этапами
+_END = object()
+
+
+class _StageError:
+    """Исключение этапа, передаваемое по очереди следующему этапу."""
+
+    def __init__(self, error):
+        self.error = error
+
+
+class MailPipeline:
+    """Конвейер этапов, связанных ограниченными очередями.
+
+    Загрузка HTML писем (IMAP-пул) и разбор (пул процессов) работают
+    в отдельных потоках, а результаты забираются генератором run() для
+    записи в кеш. Очереди между этапами ограничены queue_size элементами:
+    если следующий этап не успевает, предыдущий ждёт, поэтому объём
+    писем в памяти не зависит от размера месяца.
+    """
+
+    def __init__(self, pool, parallel_parser, queue_size=64):
+        """Инициализация конвейера."""
+        self.pool = pool
+        self.parallel_parser = parallel_parser
+        self.queue_size = max(1, queue_size)
+        self.without_html = 0
+        self._stop = threading.Event()
+
+    def _put(self, target, item):
+        """Добавление в очередь с ожиданием места; False, если конвейер остановлен."""
+        while not self._stop.is_set():
+            try:
+                target.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _drain(self, source):
+        """Генератор элементов очереди до признака окончания."""
+        while True:
+            try:
+                item = source.get(timeout=0.1)
+            except queue.Empty:
+                if self._stop.is_set():
+                    return
+                continue
+            if item is _END:
+                return
+            if isinstance(item, _StageError):
+                raise item.error
+            yield item
+
+    def _run_stage(self, name, items, target):
+        """Перенос элементов потока items в очередь target."""
+        try:
+            for item in items:
+                if not self._put(target, item):
+                    return
+        except Exception as e:
+            logging.error(f"Ошибка на этапе '{name}': {e}")
+            self._put(target, _StageError(e))
+            return
+        self._put(target, _END)
+
+    def _fetch(self, email_ids):
+        """Этап загрузки: пары (uid, html) из IMAP-пула."""
+        for email_id, html_content in self.pool.fetch_html(email_ids):
+            metrics.count("messages.fetched")
+            if not html_content:
+                self.without_html += 1
+                metrics.count("messages.without_html")
+            yield email_id, html_content
+
+    def run(self, email_ids):
+        """Обработка писем: генератор пар (uid, поездка или None) в порядке email_ids."""
+        self._stop.clear()
+        fetched = queue.Queue(maxsize=self.queue_size)
+        parsed = queue.Queue(maxsize=self.queue_size)
+        stages = [
+            threading.Thread(
+                target=self._run_stage, args=("загрузка", self._fetch(email_ids), fetched),
+                name="pipeline-fetch", daemon=True
+            ),
+            threading.Thread(
+                target=self._run_stage,
+                args=("разбор", self.parallel_parser.extract_stream(self._drain(fetched)), parsed),
+                name="pipeline-parse", daemon=True
+            )
+        ]
+        for stage in stages:
+            stage.start()
+        try:
+            yield from self._drain(parsed)
+        finally:
+            # При досрочном выходе этапы прекращают ждать места в очередях
+            self._stop.set()
+            for stage in stages:
+                stage.join()
@@ -0,0 +1,38 @@
+# prefilter.py - Быстрый отсев писем без маршрута до построения дерева разбора
+import html
+import logging
+
+import metrics
+
+# Класс строки точки маршрута; в чеке не меньше двух таких строк
+RECEIPT_MARKER = "route__point"
+MIN_MARKERS = 2
+
+
+def _as_text(content):
+    """HTML в виде строки; байты декодируются как UTF-8."""
+    if isinstance(content, bytes):
+        return content.decode('utf-8', errors='replace')
+    return content
+
+
+def looks_like_receipt(content):
+    """Признак того, что письмо может быть чеком: в нём есть хотя бы две точки маршрута.
+
+    Проверяется только число вхождений класса точки маршрута, поэтому
+    письмо, которое полный разбор признаёт чеком, не отсеивается.
+    """
+    content = _as_text(content)
+    if content.count(RECEIPT_MARKER) >= MIN_MARKERS:
+        return True
+    # Класс может быть записан через мнемоники (&#95; и т.п.)
+    return "&" in content and html.unescape(content).count(RECEIPT_MARKER) >= MIN_MARKERS
+
+
+def log_reject_rate():
+    """Доля писем, отсеянных до разбора HTML, по счётчикам запуска."""
+    counters = metrics.summary()["counters"]
+    checked = counters.get("prefilter.checked", 0)
+    if checked:
+        rejected = counters.get("prefilter.rejected", 0)
+        logging.info(f"Предварительный отсев: отклонено {rejected} из {checked} писем ({rejected / checked:.1%})")
@@ -0,0 +1,162 @@
+# receipt_generator.py - Генератор синтетических писем с чеками Яндекс Такси
+import os
+import random
+import argparse
+import calendar
+from email.mime.application import MIMEApplication
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+from email.utils import format_datetime
+from datetime import datetime, timedelta
+
+from trip import MONTH_NAMES
+
+# Варианты писем и их доля в наборе
+VARIANTS = (
+    ("simple", 0.55),
+    ("multi_stop", 0.15),
+    ("direction_changed", 0.1),
+    ("missing_hint", 0.1),
+    ("attachment", 0.1)
+)
+
+STREETS = (
+    "улица Ленина", "Обычная улица", "проспект Мира", "ул. Автора Парсера", "Длиннонзванная улица",
+    "микрорайон Тестовый", "пер. Почтовый", "Садовая улица", "наб. Речная", "б-р Весенний"
+)
+
+# Разметка чека: строки маршрута route__point, стоимость report__value_main, строка "Дата"
+RECEIPT_TEMPLATE = """<!DOCTYPE html>
+<html><head><meta charset="utf-8"><title>Отчёт о поездке</title>
+<style>.route__point-name {{ font-weight: bold; }} .hint {{ color: #999; }}</style></head>
+<body>
+<table class="header"><tr><td><img src="https://yastatic.net/taxi/logo.png" alt="Яндекс Go"></td></tr></table>
+{notice}<table class="route">
+{points}
+</table>
+<table class="report">
+<tr><td class="report__label">Итого</td><td class="report__value report__value_main">{cost}</td></tr>
+<tr><td class="report__label">Способ оплаты</td><td class="report__value">Карта •••• {card}</td></tr>
+</table>
+<table class="details">
+<tr><td>Дата</td><td>{date}</td></tr>
+<tr><td>Тариф</td><td>{tariff}</td></tr>
+</table>
+<p class="footer">Спасибо, что выбрали Яндекс Go.</p>
+</body></html>
+"""
+
+POINT_TEMPLATE = """<tr class="route__point"><td class="route__point-icon"></td><td>
+<p class="route__point-name">{name}</p>{hint}
+</td></tr>"""
+
+
+def _address(rng):
+    return f"{rng.choice(STREETS)}, {rng.randint(1, 150)}"
+
+
+def _cost_text(kopecks):
+    """Стоимость в виде чека: разделитель тысяч - неразрывный пробел, копейки после запятой."""
+    rubles, kopecks = divmod(kopecks, 100)
+    rubles_text = f"{rubles:,}".replace(",", "\u00a0")
+    return f"{rubles_text},{kopecks:02d} ₽" if kopecks else f"{rubles_text} ₽"
+
+
+def generate_receipt(rng, start, variant="simple"):
+    """HTML чека поездки, начавшейся в start (datetime)."""
+    stops = rng.randint(1, 3) if variant == "multi_stop" else 0
+    duration = timedelta(minutes=rng.randint(7, 70))
+    names = [_address(rng) for _ in range(stops + 2)]
+
+    points = []
+    for index, name in enumerate(names):
+        if index == 0:
+            hint_time = start
+        elif index == len(names) - 1:
+            hint_time = start + duration
+        else:
+            hint_time = None
+        if hint_time is None or (variant == "missing_hint" and index == len(names) - 1):
+            hint = ""
+        else:
+            hint = f'\n<p class="hint">{hint_time.strftime("%H:%M")}</p>'
+        points.append(POINT_TEMPLATE.format(name=name, hint=hint))
+
+    notice = ""
+    if variant == "direction_changed":
+        notice = '<p class="notice">Точка назначения изменена</p>\n'
+
+    return RECEIPT_TEMPLATE.format(
+        notice=notice,
+        points="\n".join(points),
+        cost=_cost_text(rng.randint(150, 3500) * 100 + rng.choice((0, 0, rng.randint(1, 99)))),
+        card=rng.randint(1000, 9999),
+        date=f"{start.day} {MONTH_NAMES[start.month]} {start.year}",
+        tariff=rng.choice(("Эконом", "Комфорт", "Комфорт+"))
+    )
+
+
+def generate_email(rng, start, variant="simple"):
+    """Письмо с чеком в формате RFC822 (bytes): текстовая и HTML-часть, при variant="attachment" - вложение PDF."""
+    html_content = generate_receipt(rng, start, variant)
+    alternative = MIMEMultipart("alternative")
+    alternative.attach(MIMEText("Отчёт о поездке с Яндекс Go", "plain", "utf-8"))
+    alternative.attach(MIMEText(html_content, "html", "utf-8"))
+
+    if variant == "attachment":
+        message = MIMEMultipart("mixed")
+        message.attach(alternative)
+        attachment = MIMEApplication(rng.randbytes(rng.randint(20000, 60000)), "pdf")
+        attachment.add_header("Content-Disposition", "attachment", filename="receipt.pdf")
+        message.attach(attachment)
+    else:
+        message = alternative
+
+    message["From"] = "Яндекс Go <no-reply@taxi.yandex.ru>"
+    message["To"] = "user@yandex.ru"
+    message["Subject"] = "Отчёт о поездке"
+    message["Date"] = format_datetime((start + timedelta(hours=1)).astimezone())
+    return message.as_bytes()
+
+
+def choose_variant(rng):
+    """Случайный вариант письма с учётом долей VARIANTS."""
+    names = [name for name, _ in VARIANTS]
+    weights = [weight for _, weight in VARIANTS]
+    return rng.choices(names, weights)[0]
+
+
+def random_start(rng, month):
+    """Случайное время начала поездки в месяце YYYY-MM (утро, вечер или ночь)."""
+    year, month_num = map(int, month.split('-'))
+    day = rng.randint(1, calendar.monthrange(year, month_num)[1])
+    hour = rng.choice((rng.randint(7, 10), rng.randint(17, 22), rng.randint(0, 3)))
+    return datetime(year, month_num, day, hour, rng.randint(0, 59))
+
+
+def generate_mailbox(count, month, seed=0):
+    """Генератор писем месяца: тройки (UID, вариант, письмо RFC822)."""
+    rng = random.Random(seed)
+    for uid in range(1, count + 1):
+        variant = choose_variant(rng)
+        yield uid, variant, generate_email(rng, random_start(rng, month), variant)
+
+
+def main():
+    """Запись синтетических писем в папку (например, для parity-check.py)."""
+    parser = argparse.ArgumentParser(description='Генерация синтетических писем с чеками такси')
+    parser.add_argument('path', help='Папка для файлов .eml')
+    parser.add_argument('--count', type=int, default=100, help='Количество писем')
+    parser.add_argument('--month', type=str, default='2024-05', help='Месяц поездок в формате YYYY-MM')
+    parser.add_argument('--seed', type=int, default=0, help='Начальное значение генератора случайных чисел')
+    args = parser.parse_args()
+
+    os.makedirs(args.path, exist_ok=True)
+    for uid, variant, email_data in generate_mailbox(args.count, args.month, args.seed):
+        with open(os.path.join(args.path, f"{uid:06d}-{variant}.eml"), 'wb') as f:
+            f.write(email_data)
+    print(f"Создано писем: {args.count} в {args.path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+# report.py - Форматирование итогового отчёта
+import json
+from trip import format_cost
+from analytics_engine import AnalyticsEngine, TripColumns, get_calendar
+
+REPORT_FORMATS = ("text", "tsv", "json", "summary")
+
+
+def format_text(reports):
+    """Отчёт для чтения человеком: поездки, рабочие недели и формулы по месяцам."""
+    lines = []
+    for report in reports:
+        if len(reports) > 1:
+            lines.append(f"\n# Месяц {report['month']}")
+        for trip in report["trips"]:
+            lines.append(str(trip))
+        if report["trips"]:
+            lines.append("\n# Рабочие недели месяца:")
+            lines.append(report["weeks"])
+            lines.append("\n# Формулы расчета стоимости по неделям:")
+            lines.append(report["formulas"])
+    return "\n".join(lines)
+
+
+def _tsv_rows(reports):
+    """Строки TSV по рабочим неделям: месяц, неделя, число поездок месяца, формула."""
+    for report in reports:
+        weeks = report["weeks"].split("\t") if report["weeks"] else []
+        formulas = report["formulas"].split("\t") if report["formulas"] else []
+        for week, formula in zip(weeks, formulas):
+            yield f"{report['month']}\t{week}\t{len(report['trips'])}\t{formula}"
+
+
+def format_tsv(reports):
+    """Отчёт TSV: строка на каждую рабочую неделю (месяц, неделя, число поездок месяца, формула)."""
+    lines = ["month\tweek\ttrips\tformula"]
+    lines.extend(_tsv_rows(reports))
+    return "\n".join(lines)
+
+
+def _json_reports(reports):
+    """Данные отчётов по месяцам для JSON."""
+    data = []
+    for report in reports:
+        data.append({
+            "month": report["month"],
+            "trips_count": len(report["trips"]),
+            "weeks": report["weeks"].split("\t") if report["weeks"] else [],
+            "formulas": report["formulas"].split("\t") if report["formulas"] else [],
+            "trips": [dict(trip.to_dict(), text=str(trip)) for trip in report["trips"]]
+        })
+    return data
+
+
+def format_json(reports):
+    """Отчёт JSON: список месяцев с поездками, неделями и формулами."""
+    return json.dumps(_json_reports(reports), ensure_ascii=False, indent=2)
+
+
+def format_summary(reports, holidays=()):
+    """Итоги по рабочим неделям, месяцам и годам: суммы формул в рублях."""
+    engine = AnalyticsEngine(
+        TripColumns(trip for report in reports for trip in report["trips"]),
+        get_calendar(tuple(holidays))
+    )
+    months = [report["month"] for report in reports]
+    lines = []
+    for year in sorted({int(month[:4]) for month in months}):
+        yearly = engine.yearly(year, months)
+        lines.append(f"# {year}: {format_cost(yearly['total'] * 100)}")
+        for monthly in yearly["months"]:
+            weeks = monthly["weeks"].split("\t") if monthly["weeks"] else []
+            week_totals = ", ".join(f"{week} {format_cost(total * 100)}" for week, total in zip(weeks, monthly["week_totals"]))
+            lines.append(f"{monthly['month']}: {format_cost(monthly['total'] * 100)} ({week_totals})")
+    return "\n".join(lines)
+
+
+def format_reports(reports, output_format="text", holidays=()):
+    """Форматирование отчётов по месяцам в заданном формате."""
+    if output_format == "tsv":
+        return format_tsv(reports)
+    if output_format == "json":
+        return format_json(reports)
+    if output_format == "summary":
+        return format_summary(reports, holidays)
+    return format_text(reports)
+
+
+def summarize(reports):
+    """Итоги по отчётам ящика: число поездок и их стоимость в копейках."""
+    trips = [trip for report in reports for trip in report["trips"]]
+    return {
+        "trips_count": len(trips),
+        "cost": sum(trip.cost for trip in trips if trip.cost is not None)
+    }
+
+
+def format_team_reports(account_reports, output_format="text", holidays=()):
+    """Отчёты нескольких почтовых ящиков и сводка по ним.
+
+    account_reports - словарь {имя: список отчётов по месяцам или None,
+    если ящик не удалось обработать}.
+    """
+    if output_format == "tsv":
+        lines = ["account\tmonth\tweek\ttrips\tformula"]
+        for name, reports in account_reports.items():
+            lines.extend(f"{name}\t{row}" for row in _tsv_rows(reports or []))
+        return "\n".join(lines)
+
+    summary = {name: summarize(reports) for name, reports in account_reports.items() if reports is not None}
+    total = {
+        "trips_count": sum(item["trips_count"] for item in summary.values()),
+        "cost": sum(item["cost"] for item in summary.values())
+    }
+
+    if output_format == "json":
+        data = {
+            "accounts": [
+                {"name": name, "error": reports is None, "reports": _json_reports(reports or [])}
+                for name, reports in account_reports.items()
+            ],
+            "summary": [dict(name=name, **summary[name]) for name in summary],
+            "total": total
+        }
+        return json.dumps(data, ensure_ascii=False, indent=2)
+
+    lines = []
+    for name, reports in account_reports.items():
+        lines.append(f"\n## Сотрудник: {name}")
+        lines.append(format_reports(reports, output_format, holidays) if reports is not None else "Не удалось обработать почтовый ящик")
+    lines.append("\n## Сводка")
+    for name, reports in account_reports.items():
+        if reports is None:
+            lines.append(f"{name}: ошибка обработки")
+        else:
+            lines.append(f"{name}: поездок {summary[name]['trips_count']}, стоимость {format_cost(summary[name]['cost'])}")
+    lines.append(f"Итого: поездок {total['trips_count']}, стоимость {format_cost(total['cost'])}")
+    return "\n".join(lines)
@@ -0,0 +1,256 @@
+# report_server.py - Локальный HTTP-сервер отчётов с открытыми IMAP-сессиями и отчётами в памяти
+import json
+import time
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+import metrics
+from cache_manager import create_cache_manager
+from report import REPORT_FORMATS, format_reports
+
+CONTENT_TYPES = {
+    "json": "application/json; charset=utf-8",
+    "tsv": "text/tab-separated-values; charset=utf-8"
+}
+DEFAULT_CONTENT_TYPE = "text/plain; charset=utf-8"
+
+
+class ReportService:
+    """Отчёты по месяцам для сервера.
+
+    Данные месяцев (состояния кеша) и IMAP-сессии остаются открытыми между
+    запросами. Готовые отчёты хранятся в памяти (LRU по месяцу и формату);
+    отчёты месяца сбрасываются, когда меняется кеш месяца (новые письма или
+    повторный разбор --offline). Неполный месяц проверяется в почте, а полный -
+    перечитывается из кеша не чаще раза в refresh_interval секунд.
+    Одинаковые одновременные запросы выполняются один раз.
+
+    Кеш, IMAP-сессии и пул разбора используются только в одном потоке
+    обработки (соединение SQLite нельзя использовать из других потоков),
+    поэтому загрузка писем разных месяцев выполняется по очереди.
+    """
+
+    def __init__(self, config, email_parser, fetch, build):
+        """Инициализация.
+
+        fetch(months, cache_manager, parallel_parser=, pool=, states=) - дозагрузка
+        писем месяцев (как fetch_months); build(month, state, cache_manager=) -
+        отчёт месяца по состоянию кеша (как build_report).
+        """
+        self.config = config
+        self.email_parser = email_parser
+        self.fetch = fetch
+        self.build = build
+        self.refresh_interval = max(0, config.get("SERVER_REFRESH_INTERVAL", 60))
+        self.cache_size = max(1, config.get("SERVER_CACHE_SIZE", 128))
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="report")
+        self._cache_manager = None
+        self._pool = None
+        self._parallel_parser = None
+        # Состояния кеша и их ревизии по месяцам (только в потоке обработки)
+        self._states = {}
+        self._revisions = {}
+        # Готовые отчёты {(месяц, формат): текст} в порядке последнего обращения
+        self._reports = OrderedDict()
+        # Момент (time.monotonic), до которого месяц не проверяется в почте и кеше
+        self._fresh_until = {}
+        # Выполняемые запросы {(месяц, формат): Future}
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def report(self, month, output_format="json"):
+        """Отчёт месяца в заданном формате."""
+        key = (month, output_format)
+        with self._lock:
+            output = self._cached(key)
+            if output is not None:
+                metrics.count("server.cache_hits")
+                return output
+            future = self._pending.get(key)
+            if future is None:
+                metrics.count("server.cache_misses")
+                future = self._executor.submit(self._render, key)
+                self._pending[key] = future
+            else:
+                # Запрос присоединяется к уже выполняемому
+                metrics.count("server.coalesced")
+        return future.result()
+
+    def _cached(self, key):
+        """Готовый отчёт, если данные месяца не требуют проверки в почте (под self._lock)."""
+        if time.monotonic() >= self._fresh_until.get(key[0], 0):
+            return None
+        output = self._reports.get(key)
+        if output is not None:
+            self._reports.move_to_end(key)
+        return output
+
+    def _render(self, key):
+        """Построение отчёта в потоке обработки."""
+        month, output_format = key
+        try:
+            state = self._refresh(month)
+            with self._lock:
+                output = self._reports.get(key)
+            if output is None:
+                report = self.build(month, state, cache_manager=self._get_cache_manager())
+                output = format_reports([report], output_format, self.config["HOLIDAYS"])
+            with self._lock:
+                self._reports[key] = output
+                self._reports.move_to_end(key)
+                while len(self._reports) > self.cache_size:
+                    self._reports.popitem(last=False)
+            return output
+        finally:
+            with self._lock:
+                self._pending.pop(key, None)
+
+    def _refresh(self, month):
+        """Состояние кеша месяца; неполный месяц дозагружается из почты."""
+        now = time.monotonic()
+        if now < self._fresh_until.get(month, 0):
+            return self._states[month]
+
+        cache_manager = self._get_cache_manager()
+        state = self._states.get(month)
+        if cache_manager.is_complete(month):
+            # Полный месяц перечитывается из кеша: его поездки мог изменить повторный разбор (--offline)
+            if state is None:
+                logging.info(f"Используются данные из кеша для месяца {month}")
+            state = cache_manager.load_state(month)
+        else:
+            states = {month: state} if state is not None and not state.get("complete") else None
+            state = self.fetch(
+                [month], cache_manager, parallel_parser=self._get_parallel_parser(), pool=self._get_pool(), states=states
+            )[month]
+        self._states[month] = state
+
+        revision = cache_manager.state_revision(state)
+        with self._lock:
+            if self._revisions.get(month) != revision:
+                # Кеш месяца изменился: готовые отчёты месяца устарели
+                for key in [key for key in self._reports if key[0] == month]:
+                    del self._reports[key]
+                self._revisions[month] = revision
+            self._fresh_until[month] = now + self.refresh_interval
+        return state
+
+    def _get_cache_manager(self):
+        if self._cache_manager is None:
+            self._cache_manager = create_cache_manager(self.config["CACHE_BACKEND"])
+        return self._cache_manager
+
+    def _get_parallel_parser(self):
+        if self._parallel_parser is None:
+            from parser import ParallelParser
+            self._parallel_parser = ParallelParser(self.email_parser, self.config["PARSE_WORKERS"])
+        return self._parallel_parser
+
+    def _get_pool(self):
+        """Открытый пул IMAP-сессий; сессии проверяются перед каждой загрузкой."""
+        if self._pool is None:
+            from folder_search import create_folder_pools
+            pool = create_folder_pools(self.config)
+            if not pool.open():
+                raise ConnectionError("Не удалось подключиться к почтовому серверу")
+            self._pool = pool
+        elif not self._pool.keepalive():
+            # Пул открывается заново при следующем запросе
+            self._pool.close()
+            self._pool = None
+            raise ConnectionError("Не удалось восстановить IMAP-сессии")
+        return self._pool
+
+    def _close_resources(self):
+        if self._pool is not None:
+            self._pool.close()
+            self._pool = None
+        if self._parallel_parser is not None:
+            self._parallel_parser.close()
+            self._parallel_parser = None
+        if hasattr(self._cache_manager, "close"):
+            self._cache_manager.close()
+        self._cache_manager = None
+
+    def close(self):
+        """Закрытие IMAP-сессий, пула разбора и кеша."""
+        try:
+            self._executor.submit(self._close_resources).result()
+        except Exception as e:
+            logging.error(f"Ошибка при остановке сервера отчётов: {e}")
+        self._executor.shutdown()
+
+
+class ReportRequestHandler(BaseHTTPRequestHandler):
+    """Запросы к серверу отчётов.
+
+    GET /report?month=YYYY-MM[&format=json|text|tsv|summary] - отчёт месяца;
+    GET /health - проверка работы сервера; GET /metrics - замеры обработки.
+    """
+
+    server_version = "TaxiReports/1.0"
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        if url.path == "/report":
+            self._report(parse_qs(url.query))
+        elif url.path == "/health":
+            self._send(200, json.dumps({"status": "ok"}), "json")
+        elif url.path == "/metrics":
+            self._send(200, metrics.summary_json(), "json")
+        else:
+            self._send_error(404, f"Неизвестный путь {url.path}")
+
+    def _report(self, params):
+        month = params.get("month", [""])[0]
+        output_format = params.get("format", ["json"])[0]
+        try:
+            month = datetime.strptime(month.strip(), "%Y-%m").strftime("%Y-%m")
+        except ValueError:
+            self._send_error(400, f"Месяц должен быть в формате YYYY-MM: '{month}'")
+            return
+        if output_format not in REPORT_FORMATS:
+            self._send_error(400, f"Формат отчёта должен быть одним из: {', '.join(REPORT_FORMATS)}")
+            return
+
+        try:
+            with metrics.stage("server.request"):
+                output = self.server.service.report(month, output_format)
+        except ConnectionError as e:
+            logging.error(f"Ошибка при построении отчёта за {month}: {e}")
+            self._send_error(503, str(e))
+            return
+        except Exception as e:
+            logging.error(f"Ошибка при построении отчёта за {month}: {e}")
+            self._send_error(500, f"Ошибка при построении отчёта: {e}")
+            return
+        self._send(200, output, output_format)
+
+    def _send(self, status, body, output_format):
+        data = body.encode('utf-8')
+        self.send_response(status)
+        self.send_header("Content-Type", CONTENT_TYPES.get(output_format, DEFAULT_CONTENT_TYPE))
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _send_error(self, status, message):
+        self._send(status, json.dumps({"error": message}, ensure_ascii=False), "json")
+
+    def log_message(self, format, *args):
+        logging.debug(f"{self.address_string()} {format % args}")
+
+
+class ReportServer(ThreadingHTTPServer):
+    """HTTP-сервер отчётов; каждый запрос обрабатывается в отдельном потоке."""
+
+    daemon_threads = True
+
+    def __init__(self, address, service):
+        super().__init__(address, ReportRequestHandler)
+        self.service = service
@@ -0,0 +1,310 @@
+# sqlite_cache.py - Хранение кеша поездок в базе SQLite
+import os
+import glob
+import json
+import logging
+import sqlite3
+from datetime import datetime
+from cache_manager import CacheManager, CACHE_VERSION
+from address_matcher import normalize_address
+from trip import Trip
+import metrics
+
+# Количество записей о письмах, записываемых в базу одной транзакцией
+FLUSH_SIZE = 200
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS months (
+    month TEXT PRIMARY KEY,
+    version INTEGER NOT NULL,
+    created_at TEXT,
+    updated_at TEXT,
+    complete INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS mailboxes (
+    month TEXT NOT NULL,
+    mailbox TEXT NOT NULL,
+    uidvalidity INTEGER,
+    last_uid INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (month, mailbox)
+);
+CREATE TABLE IF NOT EXISTS messages (
+    month TEXT NOT NULL,
+    mailbox TEXT NOT NULL,
+    uidvalidity INTEGER,
+    uid INTEGER NOT NULL,
+    has_trip INTEGER NOT NULL,
+    date TEXT,
+    start TEXT,
+    end TEXT,
+    cost INTEGER,
+    start_point TEXT,
+    end_point TEXT,
+    start_address TEXT,
+    end_address TEXT,
+    points TEXT,
+    direction_changed INTEGER,
+    PRIMARY KEY (month, mailbox, uid)
+);
+CREATE INDEX IF NOT EXISTS messages_date ON messages (date);
+CREATE INDEX IF NOT EXISTS messages_start_address ON messages (start_address);
+CREATE INDEX IF NOT EXISTS messages_end_address ON messages (end_address);
+CREATE INDEX IF NOT EXISTS messages_uid ON messages (mailbox, uidvalidity, uid);
+"""
+
+# Колонки поездки в таблице messages
+TRIP_COLUMNS = "date, start, end, cost, points, direction_changed"
+
+
+def _trip_row(data):
+    """Значения колонок поездки для словаря Trip.to_dict() (или None)."""
+    if not data:
+        return (0, None, None, None, None, None, None, None, None, None, None)
+    points = data.get("points") or []
+    start_point = points[0] if points else ""
+    end_point = points[-1] if points else ""
+    return (
+        1, data.get("date"), data.get("start"), data.get("end"), data.get("cost"),
+        start_point, end_point, normalize_address(start_point), normalize_address(end_point),
+        json.dumps(points, ensure_ascii=False), int(bool(data.get("direction_changed")))
+    )
+
+
+def _trip_dict(row):
+    """Словарь в формате Trip.to_dict() из колонок TRIP_COLUMNS."""
+    return {
+        "date": row[0],
+        "start": row[1],
+        "end": row[2],
+        "cost": row[3],
+        "points": json.loads(row[4]) if row[4] else [],
+        "direction_changed": bool(row[5])
+    }
+
+
+class SQLiteCacheManager(CacheManager):
+    """Кеш поездок в базе SQLite с тем же интерфейсом, что и CacheManager.
+
+    Каждое письмо хранится строкой таблицы messages с индексами по дате,
+    начальному и конечному адресу и UID, что позволяет выбирать поездки
+    за произвольный период или по адресу без чтения всех месяцев.
+    Результаты писем накапливаются и записываются в базу пакетами по
+    FLUSH_SIZE строк в одной транзакции. Отчёты по фильтрам по-прежнему
+    хранятся файлами в cache/reports/.
+    """
+
+    def __init__(self, cache_dir="cache", db_path=None):
+        """Подключение к базе; при первом создании в неё переносятся JSON-файлы кеша."""
+        super().__init__(cache_dir)
+        self.db_path = db_path or os.path.join(cache_dir, "trips.sqlite3")
+        is_new = not os.path.exists(self.db_path)
+        self.db = sqlite3.connect(self.db_path)
+        self.db.executescript(SCHEMA)
+        self._pending = []
+        if is_new:
+            self.migrate_json()
+
+    def close(self):
+        """Запись накопленных результатов и закрытие базы."""
+        self.flush()
+        self.db.close()
+
+    def has_cache(self, month):
+        """Проверка наличия кеша для указанного месяца."""
+        return self.db.execute("SELECT 1 FROM months WHERE month = ?", (month,)).fetchone() is not None
+
+    def is_complete(self, month):
+        """Проверка, что кеш месяца полный и его можно использовать без обращения к почте."""
+        row = self.db.execute("SELECT version, complete FROM months WHERE month = ?", (month,)).fetchone()
+        return bool(row and row[0] == CACHE_VERSION and row[1])
+
+    def load_state(self, month):
+        """Загрузка состояния кеша месяца для дозагрузки писем.
+
+        Письма, записанные прерванным запуском до сохранения состояния
+        месяца, тоже попадают в состояние.
+        """
+        with metrics.stage("cache.load"):
+            self.flush()
+            row = self.db.execute(
+                "SELECT version, created_at, complete FROM months WHERE month = ?", (month,)
+            ).fetchone()
+            if row is not None and row[0] != CACHE_VERSION:
+                logging.info(f"Кеш месяца {month} в устаревшем формате, будет пересоздан")
+                with self.db:
+                    for table in ("months", "mailboxes", "messages"):
+                        self.db.execute(f"DELETE FROM {table} WHERE month = ?", (month,))
+                row = None
+
+            state = {
+                "version": CACHE_VERSION,
+                "created_at": row[1] if row else datetime.now().isoformat(),
+                "month": month,
+                "complete": bool(row[2]) if row else False,
+                "mailboxes": {}
+            }
+            for mailbox, uidvalidity, last_uid in self.db.execute(
+                    "SELECT mailbox, uidvalidity, last_uid FROM mailboxes WHERE month = ?", (month,)):
+                state["mailboxes"][mailbox] = {"uidvalidity": uidvalidity, "last_uid": last_uid, "messages": {}}
+            for row in self.db.execute(
+                    f"SELECT mailbox, uidvalidity, uid, has_trip, {TRIP_COLUMNS} FROM messages WHERE month = ?", (month,)):
+                mailbox_state = state["mailboxes"].setdefault(
+                    row[0], {"uidvalidity": row[1], "last_uid": 0, "messages": {}}
+                )
+                if mailbox_state["uidvalidity"] == row[1]:
+                    mailbox_state["messages"][str(row[2])] = _trip_dict(row[4:]) if row[3] else None
+            return state
+
+    def append_message(self, month, mailbox, mailbox_state, uid, trip):
+        """Запись результата обработки письма в состояние папки и в очередь записи в базу."""
+        self.set_message(mailbox_state, uid, trip)
+        self._pending.append(
+            (month, mailbox, mailbox_state["uidvalidity"], int(uid)) + _trip_row(mailbox_state["messages"][uid])
+        )
+        if len(self._pending) >= FLUSH_SIZE:
+            self.flush()
+
+    def close_journal(self, month):
+        """Запись накопленных результатов (аналог закрытия журнала JSON-кеша)."""
+        self.flush()
+
+    def flush(self):
+        """Запись накопленных результатов писем в базу одной транзакцией."""
+        if not self._pending:
+            return
+        with self.db:
+            self.db.executemany(
+                "INSERT OR REPLACE INTO messages VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                self._pending
+            )
+        logging.debug(f"Записано в базу кеша писем: {len(self._pending)}")
+        self._pending = []
+
+    def _write_state(self, month, state):
+        """Запись состояния месяца в текущей транзакции (без фиксации)."""
+        self.db.execute(
+            "INSERT OR REPLACE INTO months VALUES (?, ?, ?, ?, ?)",
+            (month, CACHE_VERSION, state.get("created_at"), state["updated_at"], int(bool(state.get("complete"))))
+        )
+        mailboxes = state.get("mailboxes", {})
+        self.db.execute(
+            f"DELETE FROM mailboxes WHERE month = ? AND mailbox NOT IN ({','.join('?' * len(mailboxes))})",
+            (month, *mailboxes)
+        )
+        for mailbox, data in mailboxes.items():
+            self.db.execute(
+                "INSERT OR REPLACE INTO mailboxes VALUES (?, ?, ?, ?)",
+                (month, mailbox, data.get("uidvalidity"), data.get("last_uid", 0))
+            )
+            # Письма папки со старым UIDVALIDITY больше не относятся к кешу
+            self.db.execute(
+                "DELETE FROM messages WHERE month = ? AND mailbox = ? AND uidvalidity IS NOT ?",
+                (month, mailbox, data.get("uidvalidity"))
+            )
+        self.db.execute(
+            f"DELETE FROM messages WHERE month = ? AND mailbox NOT IN ({','.join('?' * len(mailboxes))})",
+            (month, *mailboxes)
+        )
+
+    def save_state(self, month, state):
+        """Сохранение состояния кеша месяца."""
+        with metrics.stage("cache.save"):
+            try:
+                self.flush()
+                state["updated_at"] = datetime.now().isoformat()
+                state["trips_count"] = len(self.collect_trips(state))
+                with self.db:
+                    self._write_state(month, state)
+                logging.debug(f"Состояние кеша месяца {month} сохранено в {self.db_path}")
+                return True
+            except Exception as e:
+                logging.error(f"Ошибка при сохранении данных в кеш: {e}")
+                return False
+
+    def load_from_cache(self, month):
+        """Загрузка извлечённых поездок месяца из кеша."""
+        if not self.has_cache(month):
+            logging.warning(f"Кеш для месяца {month} не найден")
+            return None
+        return self.find_trips(month=month)
+
+    def find_trips(self, date_from=None, date_to=None, address=None, month=None):
+        """Поездки за период дат (включительно) и/или с адресом в начальной или конечной точке.
+
+        Даты - объекты date или строки 'YYYY-MM-DD'; адрес сравнивается
+        после нормализации (регистр, сокращения), как в фильтрах отчёта.
+        """
+        self.flush()
+        conditions = ["has_trip = 1"]
+        params = []
+        if month is not None:
+            conditions.append("month = ?")
+            params.append(month)
+        if date_from is not None:
+            conditions.append("date >= ?")
+            params.append(str(date_from))
+        if date_to is not None:
+            conditions.append("date <= ?")
+            params.append(str(date_to))
+        if address:
+            normalized = normalize_address(address)
+            conditions.append("(instr(start_address, ?) > 0 OR instr(end_address, ?) > 0)")
+            params.extend([normalized, normalized])
+        rows = self.db.execute(
+            f"SELECT {TRIP_COLUMNS} FROM messages WHERE {' AND '.join(conditions)} ORDER BY start, mailbox, uid",
+            params
+        )
+        return [Trip.from_dict(_trip_dict(row)) for row in rows]
+
+    def find_duplicates(self):
+        """Повторяющиеся чеки: группы писем с одинаковыми временем начала, стоимостью и маршрутом.
+
+        Возвращает список словарей {trip, messages: [(месяц, папка, UID), ...]}.
+        """
+        self.flush()
+        duplicates = []
+        groups = self.db.execute(
+            "SELECT start, cost, start_address, end_address FROM messages "
+            "WHERE has_trip = 1 AND start IS NOT NULL "
+            "GROUP BY start, cost, start_address, end_address HAVING COUNT(*) > 1 ORDER BY start"
+        ).fetchall()
+        for start, cost, start_address, end_address in groups:
+            rows = self.db.execute(
+                f"SELECT month, mailbox, uid, {TRIP_COLUMNS} FROM messages "
+                "WHERE has_trip = 1 AND start = ? AND cost IS ? AND start_address = ? AND end_address = ? "
+                "ORDER BY month, mailbox, uid",
+                (start, cost, start_address, end_address)
+            ).fetchall()
+            duplicates.append({
+                "trip": Trip.from_dict(_trip_dict(rows[0][3:])),
+                "messages": [(row[0], row[1], row[2]) for row in rows]
+            })
+        return duplicates
+
+    def migrate_json(self):
+        """Перенос в базу кеша месяцев из файлов cache/YYYY-MM.json (включая журналы).
+
+        Файлы устаревшего формата пропускаются. Возвращает число перенесённых месяцев.
+        """
+        json_cache = CacheManager(self.cache_dir)
+        migrated = 0
+        for cache_path in sorted(glob.glob(os.path.join(self.cache_dir, "????-??.json"))):
+            month = os.path.basename(cache_path)[:-len(".json")]
+            state = json_cache.load_state(month)
+            if not state.get("mailboxes"):
+                logging.info(f"Кеш месяца {month} в устаревшем формате, не перенесён в базу")
+                continue
+            state["updated_at"] = state.get("updated_at") or datetime.now().isoformat()
+            rows = []
+            for mailbox, data in state["mailboxes"].items():
+                for uid, trip_data in data.get("messages", {}).items():
+                    rows.append((month, mailbox, data.get("uidvalidity"), int(uid)) + _trip_row(trip_data))
+            with self.db:
+                self.db.execute("DELETE FROM messages WHERE month = ?", (month,))
+                self.db.executemany(
+                    "INSERT OR REPLACE INTO messages VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows
+                )
+                self._write_state(month, state)
+            migrated += 1
+            logging.info(f"Кеш месяца {month} перенесён в базу: писем {len(rows)}")
+        return migrated
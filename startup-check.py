@@ -0,0 +1,115 @@
+# startup-check.py - Проверка времени запуска при отчёте по полному кешу
+import os
+import re
+import sys
+import random
+import argparse
+import tempfile
+import subprocess
+from datetime import datetime, timedelta
+
+from cache_manager import create_cache_manager
+from trip import Trip
+
+# Бюджет суммарного времени импорта модулей при отчёте по полному кешу, мс
+IMPORT_BUDGET_MS = 120
+
+# Модули почты, разбора HTML и пулов, которые не нужны для отчёта по полному кешу
+FORBIDDEN_MODULES = ("bs4", "lxml", "imaplib", "email", "asyncio", "concurrent.futures.process")
+
+MONTH = "2024-05"
+
+IMPORT_LINE = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \|( +)(\S+)')
+
+PROJECT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def create_cache(cache_dir, count, seed=0):
+    """Полный кеш месяца MONTH с count поездками."""
+    rng = random.Random(seed)
+    cache_manager = create_cache_manager("json", cache_dir)
+    state = cache_manager.load_state(MONTH)
+    mailbox_state = cache_manager.get_mailbox_state(state, "INBOX", 1)
+    year, month_num = map(int, MONTH.split('-'))
+    for uid in range(1, count + 1):
+        start = datetime(year, month_num, rng.randint(1, 28), rng.choice((8, 9, 19, 20)), rng.randint(0, 59))
+        trip = Trip(
+            date=start.date(),
+            start=start,
+            end=start + timedelta(minutes=rng.randint(10, 60)),
+            cost=rng.randint(200, 2000) * 100,
+            points=(f"улица Ленина, {rng.randint(1, 50)}", f"Обычная улица, {rng.randint(1, 50)}")
+        )
+        cache_manager.set_message(mailbox_state, str(uid), trip)
+    mailbox_state["last_uid"] = count
+    state["complete"] = True
+    cache_manager.save_state(MONTH, state)
+
+
+def run_report(work_dir):
+    """Запуск main.py с -X importtime; словарь {модуль: (собственное, общее время, мкс)} и общее время импорта."""
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [PROJECT_DIR, env.get("PYTHONPATH")]))
+    # Настройки из .env не должны менять способ хранения кеша
+    env["CACHE_BACKEND"] = "json"
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", os.path.join(PROJECT_DIR, "main.py"),
+         f"--month={MONTH}", "--format=json", "--output=report.json", "--logging-level=WARNING"],
+        cwd=work_dir, env=env, capture_output=True, text=True
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"main.py завершился с кодом {result.returncode}: {result.stderr[-2000:]}")
+
+    modules = {}
+    total = 0
+    for line in result.stderr.splitlines():
+        match = IMPORT_LINE.match(line)
+        if not match:
+            continue
+        self_time, cumulative, indent, name = match.groups()
+        modules[name] = (int(self_time), int(cumulative))
+        # Модули верхнего уровня: их общее время включает время вложенных импортов
+        if len(indent) == 1:
+            total += int(cumulative)
+    return modules, total
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Проверка времени запуска и лишних импортов при отчёте по полному кешу')
+    parser.add_argument('--budget-ms', type=float, default=IMPORT_BUDGET_MS,
+                        help='Допустимое суммарное время импорта модулей, мс')
+    parser.add_argument('--repeat', type=int, default=5, help='Количество запусков (берётся лучший)')
+    parser.add_argument('--trips', type=int, default=500, help='Количество поездок в кеше месяца')
+    parser.add_argument('--top', type=int, default=10, help='Количество самых медленных модулей в выводе')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        create_cache(os.path.join(work_dir, "cache"), args.trips)
+        best_total = None
+        best_modules = None
+        for _ in range(max(1, args.repeat)):
+            modules, total = run_report(work_dir)
+            if best_total is None or total < best_total:
+                best_total, best_modules = total, modules
+
+    failed = False
+    loaded = sorted(name for name in best_modules if name.split('.')[0] in FORBIDDEN_MODULES or name in FORBIDDEN_MODULES)
+    if loaded:
+        print(f"При отчёте по полному кешу загружены лишние модули: {', '.join(loaded)}")
+        failed = True
+
+    print("Самые медленные модули (общее время, мс):")
+    slowest = sorted(best_modules.items(), key=lambda item: item[1][1], reverse=True)[:args.top]
+    for name, (_, cumulative) in slowest:
+        print(f"  {name}: {cumulative / 1000:.1f}")
+
+    total_ms = best_total / 1000
+    status = "ok" if total_ms <= args.budget_ms else "ПРЕВЫШЕН БЮДЖЕТ"
+    print(f"Время импорта: {total_ms:.1f} мс (бюджет {args.budget_ms:.0f} мс) {status}")
+    if total_ms > args.budget_ms:
+        failed = True
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,161 @@
+# trip.py - Запись о поездке
+import re
+from datetime import date, datetime, timedelta
+
+# Дата в чеке: "14 мая 2024" (месяц в родительном падеже, допускаются сокращения)
+DATE_RE = re.compile(r'(\d{1,2})\s+([а-яё]+)\.?,?\s+(\d{4})', re.IGNORECASE)
+
+# Время в подсказке точки маршрута: "09:12"
+TIME_RE = re.compile(r'(\d{1,2}):(\d{2})')
+
+# Стоимость: "1 234,50 ₽" - разделители тысяч (любые пробелы) и копейки после запятой или точки
+COST_RE = re.compile(r'(\d[\d\s]*)(?:[.,](\d{1,2}))?')
+
+# Месяц по первым буквам названия (мар - март, мая/май - май)
+MONTH_PREFIXES = {
+    "янв": 1, "фев": 2, "мар": 3, "апр": 4, "мая": 5, "май": 5,
+    "июн": 6, "июл": 7, "авг": 8, "сен": 9, "окт": 10, "ноя": 11, "дек": 12
+}
+
+MONTH_NAMES = (
+    "", "января", "февраля", "марта", "апреля", "мая", "июня",
+    "июля", "августа", "сентября", "октября", "ноября", "декабря"
+)
+
+
+def parse_russian_date(text):
+    """Разбор даты вида "14 мая 2024"; None, если дата не распознана."""
+    match = DATE_RE.search(text or "")
+    if not match:
+        return None
+    month = MONTH_PREFIXES.get(match.group(2).lower().replace("ё", "е")[:3])
+    if month is None:
+        return None
+    try:
+        return date(int(match.group(3)), month, int(match.group(1)))
+    except ValueError:
+        return None
+
+
+def parse_time(text):
+    """Разбор времени "ЧЧ:ММ" в минуты от начала суток; None для "N/A"."""
+    match = TIME_RE.search(text or "")
+    if not match:
+        return None
+    hour, minute = int(match.group(1)), int(match.group(2))
+    if hour > 23 or minute > 59:
+        return None
+    return hour * 60 + minute
+
+
+def parse_cost(text):
+    """Разбор стоимости в копейках; None, если сумма не найдена."""
+    match = COST_RE.search(text or "")
+    if not match:
+        return None
+    rubles = int(re.sub(r'\D', '', match.group(1)))
+    kopecks = match.group(2) or "0"
+    return rubles * 100 + int(kopecks.ljust(2, "0"))
+
+
+def format_cost(kopecks):
+    """Стоимость в копейках в виде "523 ₽" или "523,40 ₽"; "N/A" для неизвестной."""
+    if kopecks is None:
+        return "N/A"
+    rubles, kopecks = divmod(kopecks, 100)
+    return f"{rubles},{kopecks:02d} ₽" if kopecks else f"{rubles} ₽"
+
+
+class Trip:
+    """Поездка из чека: дата и время начала и окончания, стоимость в копейках, точки маршрута."""
+
+    __slots__ = ("date", "start", "end", "cost", "points", "direction_changed")
+
+    def __init__(self, date=None, start=None, end=None, cost=None, points=(), direction_changed=False):
+        """Инициализация записи о поездке."""
+        self.date = date
+        self.start = start
+        self.end = end
+        self.cost = cost
+        self.points = tuple(points)
+        self.direction_changed = direction_changed
+
+    @classmethod
+    def from_fields(cls, fields, direction_changed=False):
+        """Создание поездки из текстовых полей чека (результат извлечения из HTML)."""
+        trip_date = parse_russian_date(fields.get("date"))
+        start_minutes = parse_time(fields.get("start_time"))
+        end_minutes = parse_time(fields.get("end_time"))
+
+        start = end = None
+        if trip_date is not None and start_minutes is not None:
+            start = datetime(trip_date.year, trip_date.month, trip_date.day) + timedelta(minutes=start_minutes)
+            if end_minutes is not None:
+                end = start.replace(hour=0, minute=0) + timedelta(minutes=end_minutes)
+                # Поездка через полночь заканчивается на следующий день
+                if end < start:
+                    end += timedelta(days=1)
+
+        return cls(
+            date=trip_date,
+            start=start,
+            end=end,
+            cost=parse_cost(fields.get("cost")),
+            points=fields.get("points", ()),
+            direction_changed=direction_changed
+        )
+
+    @property
+    def start_point(self):
+        """Начальная точка маршрута."""
+        return self.points[0] if self.points else ""
+
+    @property
+    def end_point(self):
+        """Конечная точка маршрута."""
+        return self.points[-1] if self.points else ""
+
+    def to_dict(self):
+        """Словарь для сохранения в JSON."""
+        return {
+            "date": self.date.isoformat() if self.date else None,
+            "start": self.start.isoformat() if self.start else None,
+            "end": self.end.isoformat() if self.end else None,
+            "cost": self.cost,
+            "points": list(self.points),
+            "direction_changed": self.direction_changed
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        """Создание поездки из словаря, сохранённого to_dict()."""
+        return cls(
+            date=date.fromisoformat(data["date"]) if data.get("date") else None,
+            start=datetime.fromisoformat(data["start"]) if data.get("start") else None,
+            end=datetime.fromisoformat(data["end"]) if data.get("end") else None,
+            cost=data.get("cost"),
+            points=data.get("points", ()),
+            direction_changed=data.get("direction_changed", False)
+        )
+
+    def __str__(self):
+        """Строка для вывода в формате "Маршрут: ..., Стоимость: ..., Дата: ..., Время: ..."."""
+        # Направление с учетом сообщения о смене точки назначения
+        if self.direction_changed:
+            direction = f"{self.end_point} -> {self.start_point}"
+        else:
+            direction = f"{self.start_point} -> {self.end_point}"
+        date_text = f"{self.date.day} {MONTH_NAMES[self.date.month]} {self.date.year}" if self.date else "N/A"
+        start_time = self.start.strftime("%H:%M") if self.start else "N/A"
+        end_time = self.end.strftime("%H:%M") if self.end else "N/A"
+        return f"Маршрут: {direction}, Стоимость: {format_cost(self.cost)}, Дата: {date_text}, Время: {start_time} - {end_time}"
+
+    def __repr__(self):
+        return f"Trip({self.to_dict()!r})"
+
+    def __eq__(self, other):
+        if not isinstance(other, Trip):
+            return NotImplemented
+        return all(getattr(self, name) == getattr(other, name) for name in self.__slots__)
+
+    __hash__ = None